@@ -70,6 +70,9 @@ class ChatControl(ChatControlBase):
 
     TYPE_ID = message_control.TYPE_CHAT
     old_msg_kind = None # last kind of the printed message
+    history_kinds = (KindConstant.SINGLE_MSG_RECV, KindConstant.SINGLE_MSG_SENT,
+                     KindConstant.CHAT_MSG_RECV, KindConstant.CHAT_MSG_SENT,
+                     KindConstant.ERROR)
 
     # Set a command host to bound to. Every command given through a chat will be
     # processed with this command host.
@@ -1375,8 +1378,15 @@ class ChatControl(ChatControlBase):
         rows = app.logger.get_last_conversation_lines(
             self.account, jid, pending)
 
-        local_old_kind = None
         self.conv_textview.just_cleared = True
+        self.conv_textview.begin_batch()
+        self.print_history_rows(rows)
+        if len(rows):
+            self.conv_textview.print_empty_line()
+        self.conv_textview.end_batch()
+
+    def print_history_rows(self, rows):
+        local_old_kind = None
         for row in rows: # time, kind, message, subject, additional_data
             msg = row.message
             additional_data = row.additional_data
@@ -1409,13 +1419,12 @@ class ChatControl(ChatControlBase):
             ChatControlBase.print_conversation_line(self, msg, kind, name,
                 tim, small_attr, small_attr + ['restored_message'],
                 small_attr + ['restored_message'], False,
-                old_kind=local_old_kind, xhtml=xhtml, additional_data=additional_data)
+                old_kind=local_old_kind, xhtml=xhtml, msg_log_id=row.log_line_id,
+                additional_data=additional_data)
             if row.message.startswith('/me ') or row.message.startswith('/me\n'):
                 local_old_kind = None
             else:
                 local_old_kind = kind
-        if len(rows):
-            self.conv_textview.print_empty_line()
 
     def read_queue(self):
         """
@@ -66,6 +66,10 @@ from gajim.command_system.implementation import execute
 if app.HAVE_SPELL:
     from gi.repository import Gspell
 
+# How many lines are loaded from the logs when the user scrolls to the top of
+# a conversation whose oldest lines were removed
+HISTORY_LINES = 50
+
 
 ################################################################################
 class ChatControlBase(MessageControl, ChatCommandProcessor, CommandTools):
@@ -73,6 +77,9 @@ class ChatControlBase(MessageControl, ChatCommandProcessor, CommandTools):
     A base class containing a banner, ConversationTextview, MessageTextView
     """
 
+    # The kinds of log lines load_older_history() prints, see KindConstant
+    history_kinds = ()
+
     keymap = Gdk.Keymap.get_default()
     try:
         keycode_c = keymap.get_entries_for_keyval(Gdk.KEY_c)[1][0].keycode
@@ -986,7 +993,7 @@ class ChatControlBase(MessageControl, ChatCommandProcessor, CommandTools):
             subject, old_kind, xhtml, simple=simple, graphics=graphics,
             displaymarking=displaymarking, msg_stanza_id=msg_stanza_id,
             correct_id=correct_id, additional_data=additional_data,
-            encrypted=encrypted)
+            encrypted=encrypted, msg_log_id=msg_log_id)
 
         if xep0184_id is not None:
             textview.add_xep0184_mark(xep0184_id)
@@ -1229,6 +1236,9 @@ class ChatControlBase(MessageControl, ChatCommandProcessor, CommandTools):
         self.conv_textview.scroll_to_end(force)
 
     def _on_edge_reached(self, scrolledwindow, pos):
+        if pos == Gtk.PositionType.TOP:
+            self.load_older_history()
+            return
         if pos != Gtk.PositionType.BOTTOM:
             return
         # Remove all events and set autoscroll True
@@ -1261,6 +1271,38 @@ class ChatControlBase(MessageControl, ChatCommandProcessor, CommandTools):
                 # There were events to remove
                 self.redraw_after_event_removed(jid)
 
+    def load_older_history(self):
+        """
+        Print the lines from the logs again that the conversation textview
+        removed
+        """
+        textview = self.conv_textview
+        if not self.history_kinds or not textview.history_evicted or \
+        not textview.message_list:
+            return
+        first_mark = textview.message_list[0][1]
+        oldest_time, log_line_id = textview.get_oldest_line()
+        rows = app.logger.get_conversation_before(self.account,
+            self.contact.jid, oldest_time, self.history_kinds, HISTORY_LINES,
+            log_line_id)
+        if len(rows) < HISTORY_LINES:
+            textview.history_evicted = False
+        if not rows:
+            return
+        textview.begin_batch()
+        self.print_history_rows(rows)
+        textview.end_batch()
+        # Keep the line the user looked at in place
+        textview.tv.scroll_to_mark(first_mark, 0, True, 0, 0)
+
+    def print_history_rows(self, rows):
+        """
+        Print rows from the logs, see Logger.get_conversation_before()
+
+        Must be implemented by controls which set history_kinds
+        """
+        raise NotImplementedError
+
     def _on_scrollbar_button_release(self, scrollbar, event):
         if event.get_button()[1] != 1:
             # We want only to catch the left mouse button
@@ -47,11 +47,12 @@ from gajim.common.contacts import LegacyContactsAPI
 from gajim.common.events import Events
 
 interface = None # The actual interface (the gtk one for the moment)
-thread_interface = lambda *args: None # Interface to run a thread and then a callback
+thread_interface = lambda *args, **kwargs: None # Interface to run a thread and then a callback, see common/executor.py
 config = c_config.Config()
 version = config.get('version')
 connections = {} # 'account name': 'account (connection.Connection) instance'
-avatar_cache = {}
+avatar_cache = None # LRU cache for avatar pixbufs, see gtkgui_helpers.AvatarCache
+image_cache = None # Cache for images in XHTML-IM messages
 ipython_window = None
 app = None  # Gtk.Application
 
@@ -67,6 +68,7 @@ gajimpaths = configpaths.gajimpaths
 
 VCARD_PATH = gajimpaths['VCARD']
 AVATAR_PATH = gajimpaths['AVATAR']
+IMAGE_CACHE_PATH = gajimpaths['IMAGE_CACHE']
 MY_EMOTS_PATH = gajimpaths['MY_EMOTS']
 MY_ICONSETS_PATH = gajimpaths['MY_ICONSETS']
 MY_MOOD_ICONSETS_PATH = gajimpaths['MY_MOOD_ICONSETS']
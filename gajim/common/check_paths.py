@@ -88,6 +88,9 @@ def create_log_db():
             );
 
             CREATE INDEX idx_logs_jid_id_time ON logs (jid_id, time DESC);
+
+            CREATE INDEX idx_logs_account_id_stanza_id
+            ON logs (account_id, stanza_id);
             '''
             )
 
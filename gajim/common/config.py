@@ -205,6 +205,8 @@ class Config:
             'notify_on_file_complete': [opt_bool, True],
             'file_transfers_port': [opt_int, 28011],
             'ft_add_hosts_to_send': [opt_str, '', _('Comma separated list of sent hosts, in addition of local interfaces, for File Transfer in case of address translation/port forwarding.')],
+            'ibb_block_size': [opt_int, 4096, _('Size in bytes of the blocks proposed when a file is sent with In-Band Bytestreams. A smaller size is used if the receiver refuses it.')],
+            'ibb_window_size': [opt_int, 8, _('Number of In-Band Bytestream blocks sent before waiting for their acknowledgement.')],
             'conversation_font': [opt_str, ''],
             'use_kib_mib': [opt_bool, False, _('IEC standard says KiB = 1024 bytes, KB = 1000 bytes.')],
             'notify_on_all_muc_messages': [opt_bool, False],
@@ -306,6 +308,11 @@ class Config:
             'pgp_encoding': [ opt_str, '', _('Sets the encoding used by python-gnupg'), True],
             'remote_commands': [opt_bool, False, _('If true, Gajim will execute XEP-0146 Commands.')],
             'mam_blacklist': [opt_str, '', _('All non-compliant MAM Groupchats')],
+            'mam_page_size': [opt_int, 30, _('Number of messages Gajim requests per page when it fetches a message archive (MAM). The size of the following pages depends on how fast the server answers.')],
+            'mam_max_page_size': [opt_int, 250, _('Maximum number of messages Gajim requests per page when it fetches a message archive (MAM).')],
+            'mam_max_parallel_queries': [opt_int, 4, _('Maximum number of groupchat archives that are fetched at the same time per account. 0 means no limit.')],
+            'avatar_cache_size': [opt_int, 32, _('Maximum memory in MiB used for avatar images. The least recently shown avatars are removed first.')],
+            'image_cache_size': [opt_int, 50, _('Maximum size in MiB of the cache for images in XHTML messages. The least recently shown images are removed first.')],
     }, {})
 
     __options_per_key = {
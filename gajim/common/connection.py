@@ -784,11 +784,15 @@ class Connection(CommonConnection, ConnectionHandlers):
     def disconnect(self, on_purpose=False):
         app.interface.music_track_changed(None, None, self.name)
         self.reset_awaiting_pep()
+        self.reset_mam_queries()
         self.on_purpose = on_purpose
         self.connected = 0
         self.time_to_reconnect = None
         self.privacy_rules_supported = False
         self.avatar_presence_sent = False
+        self.presence_signatures.clear()
+        if self.gpg:
+            self.gpg.verification.shutdown()
         if on_purpose:
             self.sm = Smacks(self)
         if self.connection:
@@ -776,10 +776,16 @@ class ConnectionHandlersBase:
         # We decrypt GPG messages one after the other. Keep queue in mem
         self.gpg_messages_to_decrypt = []
 
+        # {(jid, resource): (status, signature)} of the last signed presence
+        # of every resource, see _nec_gpg_presence_verified()
+        self.presence_signatures = {}
+
         app.ged.register_event_handler('iq-error-received', ged.CORE,
             self._nec_iq_error_received)
         app.ged.register_event_handler('presence-received', ged.CORE,
             self._nec_presence_received)
+        app.ged.register_event_handler('gpg-presence-verified', ged.CORE,
+            self._nec_gpg_presence_verified)
         app.ged.register_event_handler('gc-presence-received', ged.CORE,
             self._nec_gc_presence_received)
         app.ged.register_event_handler('message-received', ged.CORE,
@@ -798,6 +804,8 @@ class ConnectionHandlersBase:
             self._nec_iq_error_received)
         app.ged.remove_event_handler('presence-received', ged.CORE,
             self._nec_presence_received)
+        app.ged.remove_event_handler('gpg-presence-verified', ged.CORE,
+            self._nec_gpg_presence_verified)
         app.ged.remove_event_handler('gc-presence-received', ged.CORE,
             self._nec_gc_presence_received)
         app.ged.remove_event_handler('message-received', ged.CORE,
@@ -815,6 +823,23 @@ class ConnectionHandlersBase:
         if obj.conn.name != self.name:
             return
 
+    def _nec_gpg_presence_verified(self, obj):
+        if obj.conn.name != self.name:
+            return
+        if self.presence_signatures.get((obj.jid, obj.resource)) != \
+        obj.signature:
+            # The resource sent another presence in the meantime
+            return True
+        attached_keys = app.config.get_per('accounts', self.name,
+            'attached_gpg_keys').split()
+        if obj.jid in attached_keys:
+            # Do not override assigned key, see _nec_presence_received()
+            return True
+        contact = app.contacts.get_contact(self.name, obj.jid, obj.resource)
+        if contact is None:
+            return True
+        contact.keyID = obj.keyID
+
     def _nec_presence_received(self, obj):
         account = obj.conn.name
         if account != self.name:
@@ -822,6 +847,11 @@ class ConnectionHandlersBase:
         jid = obj.jid
         resource = obj.resource or ''
 
+        if obj.signature is None or obj.ptype == 'unavailable':
+            self.presence_signatures.pop((jid, resource), None)
+        else:
+            self.presence_signatures[(jid, resource)] = obj.signature
+
         statuss = ['offline', 'error', 'online', 'chat', 'away', 'xa', 'dnd',
             'invisible']
         obj.old_show = 0
@@ -1632,14 +1662,16 @@ ConnectionHTTPUpload):
     def _nec_roster_set_received(self, obj):
         if obj.conn.name != self.name:
             return
+        roster = {}
         for jid in obj.items:
             item = obj.items[jid]
             app.nec.push_incoming_event(RosterInfoEvent(None, conn=self,
                 jid=jid, nickname=item['name'], sub=item['sub'],
                 ask=item['ask'], groups=item['groups']))
-            account_jid = app.get_jid_from_account(self.name)
-            app.logger.add_or_update_contact(account_jid, jid, item['name'],
-                item['sub'], item['ask'], item['groups'])
+            roster[jid] = {'name': item['name'], 'subscription': item['sub'],
+                           'ask': item['ask'], 'groups': item['groups']}
+        account_jid = app.get_jid_from_account(self.name)
+        app.logger.add_or_update_contacts(account_jid, roster)
         if obj.version:
             app.config.set_per('accounts', self.name, 'roster_version',
                 obj.version)
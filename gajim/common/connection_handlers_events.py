@@ -741,15 +741,32 @@ PresenceHelperEvent):
 
     def _generate_keyID(self, sig_tag):
         self.keyID = ''
+        # (status, signature) of a signed presence
+        self.signature = None
         if sig_tag and self.conn.USE_GPG and self.ptype != 'error':
             # error presences contain our own signature
             # verify
             sig_msg = sig_tag.getData()
-            self.keyID = self.conn.gpg.verify(self.status, sig_msg)
+            self.signature = (self.status, sig_msg)
+            verification = self.conn.gpg.verification
+            self.keyID = verification.get_cached(self.status, sig_msg)
+            if self.keyID is None:
+                # Verifying spawns gpg, so it is done in a thread. Until the
+                # GPGPresenceVerifiedEvent arrives the presence is handled
+                # like an unsigned one.
+                self.keyID = ''
+                verification.verify(self.status, sig_msg,
+                                    self._on_signature_verified)
             self.keyID = helpers.prepare_and_validate_gpg_keyID(self.conn.name,
                                                                 self.jid,
                                                                 self.keyID)
 
+    def _on_signature_verified(self, key_id):
+        app.nec.push_incoming_event(
+            GPGPresenceVerifiedEvent(None, conn=self.conn, jid=self.jid,
+                                     resource=self.resource or '',
+                                     signature=self.signature, key_id=key_id))
+
     def _generate_prio(self):
         self.prio = self.stanza.getPriority()
         try:
@@ -864,6 +881,18 @@ PresenceHelperEvent):
             elif self.jid in jid_list or self.jid == our_jid:
                 return True
 
+class GPGPresenceVerifiedEvent(nec.NetworkIncomingEvent):
+    name = 'gpg-presence-verified'
+    base_network_events = []
+
+    def generate(self):
+        if not self.conn.USE_GPG or self.conn.connected < 2:
+            return
+        self.keyID = helpers.prepare_and_validate_gpg_keyID(self.conn.name,
+                                                            self.jid,
+                                                            self.key_id)
+        return True
+
 class ZeroconfPresenceReceivedEvent(nec.NetworkIncomingEvent):
     name = 'presence-received'
     base_network_events = []
@@ -873,6 +902,7 @@ class ZeroconfPresenceReceivedEvent(nec.NetworkIncomingEvent):
         self.resource = 'local'
         self.prio = 0
         self.keyID = None
+        self.signature = None
         self.timestamp = 0
         self.contact_nickname = None
         self.avatar_sha = None
@@ -894,6 +924,9 @@ class GcPresenceReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
     name = 'gc-presence-received'
     base_network_events = []
 
+    def get_routing_key(self):
+        return (self.conn.name, self.room_jid)
+
     def generate(self):
         self.ptype = self.presence_obj.ptype
         self.fjid = self.presence_obj.fjid
@@ -1369,10 +1402,12 @@ class MessageReceivedEvent(nec.NetworkIncomingEvent, HelperEvent):
         if result and result.getNamespace() in (nbxmpp.NS_MAM_1,
                                                 nbxmpp.NS_MAM_2):
 
-            if result.getAttr('queryid') not in self.conn.mam_query_ids:
+            query_id = result.getAttr('queryid')
+            if query_id not in self.conn.mam_query_ids:
                 log.warning('Invalid MAM Message: unknown query id')
                 log.debug(self.stanza)
                 return
+            self.conn.mam_query_ids.message_received(query_id)
 
             forwarded = result.getTag('forwarded',
                                       namespace=nbxmpp.NS_FORWARD,
@@ -1683,6 +1718,9 @@ class GcMessageReceivedEvent(nec.NetworkIncomingEvent):
     name = 'gc-message-received'
     base_network_events = []
 
+    def get_routing_key(self):
+        return (self.conn.name, self.room_jid)
+
     def generate(self):
         self.stanza = self.msg_obj.stanza
         if not hasattr(self.msg_obj, 'additional_data'):
@@ -90,6 +90,14 @@ class Contact(CommonContact):
     """
     Information concerning a contact
     """
+    # Attributes which change how the contact is counted in the roster or
+    # which contact of a metacontact family is shown
+    _TRACKED_ATTRIBUTES = frozenset(('show', 'groups', 'sub', 'ask', 'name',
+                                     'priority'))
+
+    # The Contacts instance the contact was added to
+    _contacts_list = None
+
     def __init__(self, jid, account, name='', groups=None, show='', status='',
     sub='', ask='', resource='', priority=0, keyID='', client_caps=None,
     our_chatstate=None, chatstate=None, idle_time=None, avatar_sha=None):
@@ -114,6 +122,12 @@ class Contact(CommonContact):
 
         self.pep = {}
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._TRACKED_ATTRIBUTES and \
+        self._contacts_list is not None:
+            self._contacts_list.contact_changed(self.jid)
+
     def get_full_jid(self):
         if self.resource:
             return self.jid + '/' + self.resource
@@ -359,6 +373,22 @@ class LegacyContactsAPI:
             return contact
         return self.get_highest_prio_contact_from_contacts(contacts)
 
+    def get_generation(self):
+        """
+        Return a number which changes whenever a contact changes
+        """
+        return sum(account.contacts.generation
+                   for account in self._accounts.values())
+
+    def contact_changed(self, account, jid):
+        """
+        Recount jid in the online/total counters of its groups
+
+        Needed if the groups of a contact were changed in place.
+        """
+        if account in self._accounts:
+            self._accounts[account].contacts.contact_changed(jid)
+
     def get_nb_online_total_contacts(self, accounts=None, groups=None):
         """
         Return the number of online contacts and the total number of contacts
@@ -367,6 +397,37 @@ class LegacyContactsAPI:
             accounts = self.get_accounts()
         if groups is None:
             groups = []
+        if len(groups) > 1:
+            return self._count_online_total_contacts(accounts, groups)
+
+        # Use the counters the Contacts keep per group, and correct them for
+        # our own jid and for metacontacts, which are counted only once
+        group = groups[0] if groups else None
+        nbr_online = 0
+        nbr_total = 0
+        excluded = []
+        for account in accounts:
+            contacts = self._accounts[account].contacts
+            online, total = contacts.get_nb_online_total(group)
+            nbr_online += online
+            nbr_total += total
+            our_jid = common.app.get_jid_from_account(account)
+            excluded.append((account, our_jid))
+            for jid in self.get_hidden_brothers(account, accounts):
+                if jid != our_jid:
+                    excluded.append((account, jid))
+
+        for account, jid in excluded:
+            online, total = self._accounts[account].contacts.get_jid_count(
+                jid, group)
+            nbr_online -= online
+            nbr_total -= total
+        return nbr_online, nbr_total
+
+    def _count_online_total_contacts(self, accounts, groups):
+        """
+        Count the contacts of accounts which are in one of groups
+        """
         nbr_online = 0
         nbr_total = 0
         for account in accounts:
@@ -452,8 +513,76 @@ class Contacts():
     def __init__(self):
         # list of contacts  {jid1: [C1, C2]}, } one Contact per resource
         self._contacts = {}
+        # How each jid is counted: {jid: (online, groups, is_transport)}
+        self._counted = {}
+        # Online and total contacts per shown group: {group: [online, total]}
+        # The key None counts all contacts except transports
+        self._counters = {}
+        # jids whose contacts changed since the counters were updated
+        self._changed = set()
+        # Increased on every change of a contact
+        self.generation = 0
+
+    def contact_changed(self, jid):
+        self._changed.add(jid)
+        self.generation += 1
+
+    def _update_counters(self):
+        for jid in self._changed:
+            counted = self._counted.pop(jid, None)
+            if counted is not None:
+                self._count(counted, -1)
+            if jid not in self._contacts:
+                continue
+            contact = self._contacts[jid][0]
+            if _('Not in roster') in contact.groups:
+                continue
+            counted = (contact.show not in ('offline', 'error'),
+                       frozenset(contact.get_shown_groups()),
+                       common.app.jid_is_transport(jid))
+            self._counted[jid] = counted
+            self._count(counted, 1)
+        self._changed.clear()
+
+    def _count(self, counted, value):
+        online, groups, is_transport = counted
+        keys = list(groups)
+        if not is_transport:
+            keys.append(None)
+        for key in keys:
+            counter = self._counters.setdefault(key, [0, 0])
+            counter[1] += value
+            if online:
+                counter[0] += value
+
+    def get_nb_online_total(self, group=None):
+        """
+        Return the number of online contacts and the total number of contacts
+        in group, or of all contacts except transports if group is None
+        """
+        self._update_counters()
+        online, total = self._counters.get(group, (0, 0))
+        return online, total
+
+    def get_jid_count(self, jid, group=None):
+        """
+        Return how jid is counted in get_nb_online_total(group)
+        """
+        self._update_counters()
+        counted = self._counted.get(jid)
+        if counted is None:
+            return 0, 0
+        online, groups, is_transport = counted
+        if group is None:
+            if is_transport:
+                return 0, 0
+        elif group not in groups:
+            return 0, 0
+        return int(online), 1
 
     def add_contact(self, contact):
+        contact._contacts_list = self
+        self.contact_changed(contact.jid)
         if contact.jid not in self._contacts:
             self._contacts[contact.jid] = [contact]
             return
@@ -473,8 +602,10 @@ class Contacts():
     def remove_contact(self, contact):
         if contact.jid not in self._contacts:
             return
+        self.contact_changed(contact.jid)
         if contact in self._contacts[contact.jid]:
             self._contacts[contact.jid].remove(contact)
+            contact._contacts_list = None
         if len(self._contacts[contact.jid]) == 0:
             del self._contacts[contact.jid]
 
@@ -483,7 +614,10 @@ class Contacts():
         Remove all contacts for a given jid
         """
         if jid in self._contacts:
+            for contact in self._contacts[jid]:
+                contact._contacts_list = None
             del self._contacts[jid]
+            self.contact_changed(jid)
 
     def get_contacts(self, jid):
         """
@@ -583,6 +717,8 @@ class Contacts():
     def change_contact_jid(self, old_jid, new_jid):
         if old_jid not in self._contacts:
             return
+        self.contact_changed(old_jid)
+        self.contact_changed(new_jid)
         self._contacts[new_jid] = []
         for _contact in self._contacts[old_jid]:
             _contact.jid = new_jid
@@ -626,10 +762,10 @@ class GC_Contacts():
         return list(self._rooms[room_jid].keys())
 
     def get_gc_contact(self, room_jid, nick):
-        nick_list = self.get_nick_list(room_jid)
-        if not nick in nick_list:
+        try:
+            return self._rooms[room_jid][nick]
+        except KeyError:
             return None
-        return self._rooms[room_jid][nick]
 
     def is_gc_contact(self, jid):
         """
@@ -666,20 +802,48 @@ class MetacontactManager():
     def __init__(self, contacts):
         self._metacontacts_tags = {}
         self._contacts = contacts
+        # {account: {jid: tag}}
+        self._tag_index = {}
+        # {tag: family}, see _get_metacontacts_family_from_tag()
+        self._families = {}
+        # {family key: (contacts generation, big brother data)}
+        self._big_brothers = {}
+
+    def _index_account(self, account):
+        index = {}
+        for tag, data_list in self._metacontacts_tags[account].items():
+            for data in data_list:
+                index.setdefault(data['jid'], tag)
+        self._tag_index[account] = index
+
+    def _invalidate(self, tag=None):
+        if tag is None:
+            self._families.clear()
+        else:
+            self._families.pop(tag, None)
+        self._big_brothers.clear()
 
     def change_account_name(self, old_name, new_name):
         self._metacontacts_tags[new_name] = self._metacontacts_tags[old_name]
         del self._metacontacts_tags[old_name]
+        self._tag_index[new_name] = self._tag_index.pop(old_name)
+        self._invalidate()
 
     def add_account(self, account):
         if account not in self._metacontacts_tags:
             self._metacontacts_tags[account] = {}
+            self._tag_index[account] = {}
+        self._invalidate()
 
     def remove_account(self, account):
         del self._metacontacts_tags[account]
+        del self._tag_index[account]
+        self._invalidate()
 
     def define_metacontacts(self, account, tags_list):
         self._metacontacts_tags[account] = tags_list
+        self._index_account(account)
+        self._invalidate()
 
     def _get_new_metacontacts_tag(self, jid):
         if not jid in self._metacontacts_tags:
@@ -696,13 +860,9 @@ class MetacontactManager():
         """
         Return the tag of a jid
         """
-        if not account in self._metacontacts_tags:
+        if not account in self._tag_index:
             return None
-        for tag in self._metacontacts_tags[account]:
-            for data in self._metacontacts_tags[account][tag]:
-                if data['jid'] == jid:
-                    return tag
-        return None
+        return self._tag_index[account].get(jid)
 
     def add_metacontact(self, brother_account, brother_jid, account, jid, order=None):
         tag = self._get_metacontacts_tag(brother_account, brother_jid)
@@ -710,6 +870,7 @@ class MetacontactManager():
             tag = self._get_new_metacontacts_tag(brother_jid)
             self._metacontacts_tags[brother_account][tag] = [{'jid': brother_jid,
                     'tag': tag}]
+            self._index_account(brother_account)
             if brother_account != account:
                 common.app.connections[brother_account].store_metacontacts(
                         self._metacontacts_tags[brother_account])
@@ -727,24 +888,45 @@ class MetacontactManager():
             else:
                 self._metacontacts_tags[account][tag].append({'jid': jid,
                         'tag': tag})
+        self._index_account(account)
+        self._invalidate(tag)
         common.app.connections[account].store_metacontacts(
                 self._metacontacts_tags[account])
 
     def remove_metacontact(self, account, jid):
-        if not account in self._metacontacts_tags:
+        tag = self._get_metacontacts_tag(account, jid)
+        if tag is None:
             return
 
-        found = None
-        for tag in self._metacontacts_tags[account]:
-            for data in self._metacontacts_tags[account][tag]:
-                if data['jid'] == jid:
-                    found = data
-                    break
-            if found:
-                self._metacontacts_tags[account][tag].remove(found)
-                common.app.connections[account].store_metacontacts(
-                        self._metacontacts_tags[account])
+        for data in self._metacontacts_tags[account][tag]:
+            if data['jid'] == jid:
+                self._metacontacts_tags[account][tag].remove(data)
                 break
+        # The jid may be listed in more than one tag
+        self._index_account(account)
+        self._invalidate(tag)
+        common.app.connections[account].store_metacontacts(
+                self._metacontacts_tags[account])
+
+    def get_hidden_brothers(self, account, accounts):
+        """
+        Return the jids of account which have a brother in accounts but are
+        not the big brother of their family
+        """
+        if account not in self._metacontacts_tags:
+            return []
+        hidden = []
+        for tag in self._metacontacts_tags[account]:
+            meta_jids = self._get_metacontacts_jids(tag, accounts)
+            if sum(len(jids) for jids in meta_jids.values()) < 2:
+                continue
+            family = self._get_metacontacts_family_from_tag(account, tag)
+            big_brother = self._get_metacontacts_big_brother(family)
+            for jid in meta_jids.get(account, []):
+                if jid != big_brother['jid'] or \
+                account != big_brother['account']:
+                    hidden.append(jid)
+        return hidden
 
     def has_brother(self, account, jid, accounts):
         tag = self._get_metacontacts_tag(account, jid)
@@ -768,13 +950,14 @@ class MetacontactManager():
         Return all jid for the given tag in the form {acct: [jid1, jid2],.}
         """
         answers = {}
-        for account in self._metacontacts_tags:
-            if tag in self._metacontacts_tags[account]:
-                if account not in accounts:
-                    continue
+        for data in self._get_metacontacts_family_from_tag(None, tag):
+            if data['account'] in accounts:
+                answers.setdefault(data['account'], []).append(data['jid'])
+        for account in accounts:
+            if account not in answers and \
+            tag in self._metacontacts_tags.get(account, ()):
+                # The tag exists but has no members
                 answers[account] = []
-                for data in self._metacontacts_tags[account][tag]:
-                    answers[account].append(data['jid'])
         return answers
 
     def get_metacontacts_family(self, account, jid):
@@ -783,18 +966,25 @@ class MetacontactManager():
         [{'account': acct, 'jid': jid, 'order': order}, ] 'order' is optional
         """
         tag = self._get_metacontacts_tag(account, jid)
-        return self._get_metacontacts_family_from_tag(account, tag)
+        return list(self._get_metacontacts_family_from_tag(account, tag))
 
     def _get_metacontacts_family_from_tag(self, account, tag):
+        """
+        Return the cached family of tag, do not modify it
+        """
         if not tag:
             return []
-        answers = []
+        family = self._families.get(tag)
+        if family is not None:
+            return family
+        family = []
         for account in self._metacontacts_tags:
             if tag in self._metacontacts_tags[account]:
                 for data in self._metacontacts_tags[account][tag]:
                     data['account'] = account
-                    answers.append(data)
-        return answers
+                    family.append(data)
+        self._families[tag] = family
+        return family
 
     def _metacontact_key(self, data):
         """
@@ -849,8 +1039,17 @@ class MetacontactManager():
         """
         Which of the family will be the big brother under wich all others will be
         ?
+
+        The result is cached until a contact changes in one of the accounts.
         """
-        return max(family, key=self._metacontact_key)
+        key = tuple((data['account'], data['jid']) for data in family)
+        generation = self._contacts.get_generation()
+        cached = self._big_brothers.get(key)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        big_brother = max(family, key=self._metacontact_key)
+        self._big_brothers[key] = (generation, big_brother)
+        return big_brother
 
 
 if __name__ == "__main__":
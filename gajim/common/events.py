@@ -25,6 +25,8 @@
 ##
 
 import time
+import heapq
+import itertools
 
 class Event:
     """
@@ -179,19 +181,42 @@ class JingleIncomingEvent(Event):
 class Events:
     """
     Information concerning all events
+
+    Besides the events themselves, counters per account, jid, type and
+    attribute (shown in systray or in roster) and heaps ordered by the time
+    of the events are kept, so counting events and finding the oldest event
+    does not need to look at every pending event.
     """
 
+    ATTRIBUTES = ('systray', 'roster')
+
     def __init__(self):
         self._events = {} # list of events {acct: {jid1: [E1, E2]}, }
         self._event_added_listeners = []
         self._event_removed_listeners = []
-
-    def event_added_subscribe(self, listener):
+        # Listeners that also get the change of the counters
+        self._delta_listeners = set()
+        # {(account, jid, attribute, type_): number of events}
+        # account, jid, attribute and type_ can be None for all
+        self._counters = {}
+        # {event: (account, jid, attributes)} how the event was counted
+        self._counted = {}
+        # {attribute: [(time_, sequence, event), ]} None for all events,
+        # removed events are dropped when they reach the top
+        self._heaps = {None: [], 'systray': [], 'roster': []}
+        self._sequence = itertools.count()
+
+    def event_added_subscribe(self, listener, delta=False):
         """
         Add a listener when an event is added to the queue
+
+        It is called with the event. If delta is True, it also gets the
+        change of the counters, see _get_delta()
         """
         if not listener in self._event_added_listeners:
             self._event_added_listeners.append(listener)
+        if delta:
+            self._delta_listeners.add(listener)
 
     def event_added_unsubscribe(self, listener):
         """
@@ -199,13 +224,20 @@ class Events:
         """
         if listener in self._event_added_listeners:
             self._event_added_listeners.remove(listener)
+        if listener not in self._event_removed_listeners:
+            self._delta_listeners.discard(listener)
 
-    def event_removed_subscribe(self, listener):
+    def event_removed_subscribe(self, listener, delta=False):
         """
         Add a listener when an event is removed from the queue
+
+        It is called with the list of removed events. If delta is True, it
+        also gets the change of the counters, see _get_delta()
         """
         if not listener in self._event_removed_listeners:
             self._event_removed_listeners.append(listener)
+        if delta:
+            self._delta_listeners.add(listener)
 
     def event_removed_unsubscribe(self, listener):
         """
@@ -213,19 +245,99 @@ class Events:
         """
         if listener in self._event_removed_listeners:
             self._event_removed_listeners.remove(listener)
+        if listener not in self._event_added_listeners:
+            self._delta_listeners.discard(listener)
 
     def fire_event_added(self, event):
-        for listener in self._event_added_listeners:
-            listener(event)
+        self._fire(self._event_added_listeners, event, [event], 1)
 
     def fire_event_removed(self, event_list):
-        for listener in self._event_removed_listeners:
-            listener(event_list)
+        self._fire(self._event_removed_listeners, event_list, event_list, -1)
+
+    def _fire(self, listeners, arg, events, value):
+        delta = None
+        for listener in listeners:
+            if listener in self._delta_listeners:
+                if delta is None:
+                    delta = self._get_delta(events, value)
+                listener(arg, delta)
+            else:
+                listener(arg)
+
+    def _get_delta(self, events, value):
+        """
+        Return {(account, attribute, type_): change} of the number of events,
+        attribute is None for all events
+        """
+        delta = {}
+        for event in events:
+            for attribute in self._get_attributes(event):
+                key = (event.account, attribute, event.type_)
+                delta[key] = delta.get(key, 0) + value
+        return delta
+
+    def _get_attributes(self, event):
+        attributes = [None]
+        if event.show_in_systray:
+            attributes.append('systray')
+        if event.show_in_roster:
+            attributes.append('roster')
+        return tuple(attributes)
+
+    def _count(self, account, jid, attributes, type_, value):
+        for key_account, key_jid in ((account, jid), (account, None),
+                                     (None, None)):
+            for attribute in attributes:
+                for key_type in (type_, None):
+                    key = (key_account, key_jid, attribute, key_type)
+                    number = self._counters.get(key, 0) + value
+                    if number:
+                        self._counters[key] = number
+                    else:
+                        del self._counters[key]
+
+    def _index_event(self, account, jid, event):
+        attributes = self._get_attributes(event)
+        self._counted[event] = (account, jid, attributes)
+        self._count(account, jid, attributes, event.type_, 1)
+        entry = (event.time_, next(self._sequence), event)
+        for attribute in attributes:
+            heapq.heappush(self._heaps[attribute], entry)
+
+    def _unindex_events(self, events):
+        for event in events:
+            counted = self._counted.pop(event, None)
+            if counted is None:
+                continue
+            account, jid, attributes = counted
+            self._count(account, jid, attributes, event.type_, -1)
+        # Removed events stay in the heaps until they reach the top
+        for heap in self._heaps.values():
+            self._clean_heap(heap)
+
+    def _clean_heap(self, heap):
+        while heap and heap[0][2] not in self._counted:
+            heapq.heappop(heap)
+        if len(heap) > 2 * len(self._counted) + 100:
+            # Too many removed events below the top
+            heap[:] = [entry for entry in heap if entry[2] in self._counted]
+            heapq.heapify(heap)
+
+    def _reindex(self):
+        self._counters.clear()
+        self._counted.clear()
+        for heap in self._heaps.values():
+            heap.clear()
+        for account in self._events:
+            for jid in self._events[account]:
+                for event in self._events[account][jid]:
+                    self._index_event(account, jid, event)
 
     def change_account_name(self, old_name, new_name):
         if old_name in self._events:
             self._events[new_name] = self._events[old_name]
             del self._events[old_name]
+            self._reindex()
 
     def add_account(self, account):
         self._events[account] = {}
@@ -234,7 +346,10 @@ class Events:
         return self._events.keys()
 
     def remove_account(self, account):
+        events = [event for jid in self._events[account]
+                  for event in self._events[account][jid]]
         del self._events[account]
+        self._unindex_events(events)
 
     def add_event(self, account, jid, event):
         # No such account before ?
@@ -247,6 +362,7 @@ class Events:
             self._events[account][jid].append(event)
         event.jid = jid
         event.account = account
+        self._index_event(account, jid, event)
         self.fire_event_added(event)
 
     def remove_events(self, account, jid, event=None, types=None):
@@ -266,6 +382,7 @@ class Events:
                     del self._events[account][jid]
                 else:
                     self._events[account][jid].remove(event)
+                self._unindex_events([event])
                 self.fire_event_removed([event])
                 return
             else:
@@ -284,22 +401,31 @@ class Events:
                 self._events[account][jid] = new_list
             else:
                 del self._events[account][jid]
+            self._unindex_events(removed_list)
             self.fire_event_removed(removed_list)
             return
         # no event nor type given, remove them all
-        self.fire_event_removed(self._events[account][jid])
+        removed_list = self._events[account][jid]
         del self._events[account][jid]
+        self._unindex_events(removed_list)
+        self.fire_event_removed(removed_list)
 
     def change_jid(self, account, old_jid, new_jid):
         if account not in self._events:
             return
-        if old_jid not in self._events[account]:
+        if old_jid not in self._events[account] or old_jid == new_jid:
             return
         if new_jid in self._events[account]:
             self._events[account][new_jid] += self._events[account][old_jid]
         else:
             self._events[account][new_jid] = self._events[account][old_jid]
+        moved = self._events[account][old_jid]
         del self._events[account][old_jid]
+        for event in moved:
+            attributes = self._counted[event][2]
+            self._count(account, old_jid, attributes, event.type_, -1)
+            self._count(account, new_jid, attributes, event.type_, 1)
+            self._counted[event] = (account, new_jid, attributes)
 
     def get_nb_events(self, types=None, account=None):
         if types is None:
@@ -339,7 +465,7 @@ class Events:
         Return the first event of type type_ if given
         """
         if not account:
-            return self._get_first_event_with_attribute(self._events)
+            return self._get_first_event_with_attribute(None)
         events_list = self.get_events(account, jid, type_)
         # be sure it's bigger than latest event
         first_event_time = time.time() + 1
@@ -356,28 +482,19 @@ class Events:
         """
         if types is None:
             types = []
-        nb = 0
         if account:
             accounts = [account]
+        elif jid:
+            # The counters have no entry for a jid of all accounts
+            accounts = list(self._events.keys())
         else:
-            accounts = self._events.keys()
+            accounts = [None]
+        types = set(types) or [None]
+        nb = 0
         for acct in accounts:
-            if acct not in self._events:
-                continue
-            if jid:
-                jids = [jid]
-            else:
-                jids = self._events[acct].keys()
-            for j in jids:
-                if j not in self._events[acct]:
-                    continue
-                for event in self._events[acct][j]:
-                    if types and event.type_ not in types:
-                        continue
-                    if not attribute or \
-                    attribute == 'systray' and event.show_in_systray or \
-                    attribute == 'roster' and event.show_in_roster:
-                        nb += 1
+            for type_ in types:
+                nb += self._counters.get((acct, jid or None, attribute, type_),
+                                         0)
         return nb
 
     def _get_some_events(self, attribute):
@@ -399,26 +516,19 @@ class Events:
                 del events[account]
         return events
 
-    def _get_first_event_with_attribute(self, events):
+    def _get_first_event_with_attribute(self, attribute):
         """
-        Get the first event
+        Get the first event with attribute (systray, roster or None for all)
 
-        events is in the form {account1: {jid1: [ev1, ev2], },. }
+        Return (account, jid, event)
         """
-        # be sure it's bigger than latest event
-        first_event_time = time.time() + 1
-        first_account = None
-        first_jid = None
-        first_event = None
-        for account in events:
-            for jid in events[account]:
-                for event in events[account][jid]:
-                    if event.time_ < first_event_time:
-                        first_event_time = event.time_
-                        first_account = account
-                        first_jid = jid
-                        first_event = event
-        return first_account, first_jid, first_event
+        heap = self._heaps[attribute]
+        self._clean_heap(heap)
+        if not heap:
+            return None, None, None
+        event = heap[0][2]
+        account, jid, attributes = self._counted[event]
+        return account, jid, event
 
     def get_nb_systray_events(self, types=None):
         """
@@ -436,8 +546,7 @@ class Events:
         return self._get_some_events('systray')
 
     def get_first_systray_event(self):
-        events = self.get_systray_events()
-        return self._get_first_event_with_attribute(events)
+        return self._get_first_event_with_attribute('systray')
 
     def get_nb_roster_events(self, account=None, jid=None, types=None):
         """
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Gajim.
+#
+# Gajim is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; version 3 only.
+#
+# Gajim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Bounded thread pools for blocking work
+
+Every pool has a name and a maximum number of worker threads. Tasks are
+started in order of priority, tasks with the same priority in the order they
+were submitted. Callbacks are called in the main loop.
+"""
+
+import heapq
+import time
+import logging
+import itertools
+import threading
+
+from gi.repository import GLib
+
+log = logging.getLogger('gajim.c.executor')
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+# Log a task if it waited longer than this in the queue (seconds)
+SLOW_WAIT = 1.0
+
+
+class Task:
+    def __init__(self, func, args, callback, callback_args, priority):
+        self.func = func
+        self.args = args
+        self.callback = callback
+        self.callback_args = callback_args
+        self.priority = priority
+        self.submitted = time.monotonic()
+        self.started = None
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self):
+        """
+        Cancel the task
+
+        A task that is still queued is not started anymore, the callback of a
+        running task is not called. Returns False if the task is finished
+        already.
+        """
+        if self.done:
+            return False
+        self.cancelled = True
+        return True
+
+
+class ExecutorStats:
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.max_queued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    @property
+    def average_wait(self):
+        started = self.completed + self.failed
+        if not started:
+            return 0.0
+        return self.total_wait / started
+
+    @property
+    def average_run(self):
+        started = self.completed + self.failed
+        if not started:
+            return 0.0
+        return self.total_run / started
+
+
+class Executor:
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self.stats = ExecutorStats()
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._workers = 0
+        self._idle = 0
+        self._running = 0
+        self._shutdown = False
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    @property
+    def running(self):
+        return self._running
+
+    def submit(self, func, args=(), callback=None, callback_args=(),
+               priority=PRIORITY_NORMAL):
+        """
+        Call func(*args) in a worker thread
+
+        If callback is given, callback(result, *callback_args) is called in
+        the main loop afterwards. Returns None if the executor is shut down
+        already (while quitting).
+        """
+        task = Task(func, args, callback, callback_args, priority)
+        with self._condition:
+            if self._shutdown:
+                log.debug('%s is shut down, dropping task %s',
+                          self.name, func)
+                return None
+            heapq.heappush(self._queue,
+                           (priority, next(self._counter), task))
+            self.stats.submitted += 1
+            self.stats.max_queued = max(self.stats.max_queued,
+                                        len(self._queue))
+            if self._idle:
+                self._condition.notify()
+            elif self._workers < self.max_workers:
+                self._start_worker()
+        return task
+
+    def shutdown(self):
+        """
+        Drop all queued tasks, running tasks are finished
+        """
+        with self._condition:
+            self._shutdown = True
+            for _priority, _count, task in self._queue:
+                task.cancelled = True
+            self.stats.cancelled += len(self._queue)
+            self._queue.clear()
+            self._condition.notify_all()
+
+    def _start_worker(self):
+        self._workers += 1
+        thread = threading.Thread(target=self._work,
+                                  name='%s-%s' % (self.name, self._workers))
+        thread.daemon = True
+        thread.start()
+
+    def _get_task(self):
+        with self._condition:
+            while True:
+                while not self._queue and not self._shutdown:
+                    self._idle += 1
+                    self._condition.wait()
+                    self._idle -= 1
+                if self._shutdown:
+                    self._workers -= 1
+                    return None
+                _priority, _count, task = heapq.heappop(self._queue)
+                if task.cancelled:
+                    self.stats.cancelled += 1
+                    continue
+                self._running += 1
+                return task
+
+    def _work(self):
+        while True:
+            task = self._get_task()
+            if task is None:
+                return
+
+            task.started = time.monotonic()
+            wait = task.started - task.submitted
+            if wait > SLOW_WAIT:
+                log.info('%s: task %s waited %.2fs, %s queued',
+                         self.name, task.func, wait, self.queued)
+            try:
+                result = task.func(*task.args)
+            except Exception:
+                log.exception('%s: task %s failed', self.name, task.func)
+                failed = True
+            else:
+                failed = False
+            run = time.monotonic() - task.started
+
+            with self._condition:
+                self._running -= 1
+                task.done = True
+                stats = self.stats
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+                stats.total_run += run
+                if failed:
+                    stats.failed += 1
+                else:
+                    stats.completed += 1
+
+            log.debug('%s: task %s finished, wait: %.3fs, run: %.3fs',
+                      self.name, task.func, wait, run)
+
+            if not failed and task.callback is not None:
+                GLib.idle_add(self._finished, task, result)
+
+    @staticmethod
+    def _finished(task, result):
+        if not task.cancelled:
+            task.callback(result, *task.callback_args)
+        return False
+
+
+# Name: maximum number of worker threads
+# 'default' is for short blocking work like downloads, 'sound' for sound
+# playback, which may take long
+EXECUTORS = {
+    'default': 4,
+    'sound': 2,
+}
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(name='default'):
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = Executor(name, EXECUTORS.get(name, 1))
+            _executors[name] = executor
+        return executor
+
+
+def run_in_thread(func, func_args=(), callback=None, callback_args=(),
+                  priority=PRIORITY_NORMAL, executor='default'):
+    """
+    Call a function in a thread of the executor with the given name
+
+    This is what app.thread_interface points to.
+    """
+    return get_executor(executor).submit(
+        func, func_args, callback, callback_args, priority)
+
+
+def get_stats():
+    """
+    Return a dict of name: (queued, running, ExecutorStats)
+    """
+    with _lock:
+        executors = list(_executors.values())
+    return {executor.name: (executor.queued, executor.running, executor.stats)
+            for executor in executors}
+
+
+def shutdown():
+    with _lock:
+        executors = list(_executors.values())
+    for executor in executors:
+        executor.shutdown()
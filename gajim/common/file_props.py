@@ -17,6 +17,60 @@ Exception: this class should not be instatiated
 True
 """
 
+import hashlib
+from base64 import b64encode
+from functools import partial
+
+# XEP-0300 hash algorithms
+HASH_FUNCTIONS = {
+    'sha-256': hashlib.sha256,
+    'sha-512': hashlib.sha512,
+    'sha3-256': hashlib.sha3_256,
+    'sha3-512': hashlib.sha3_512,
+    'blake2b-256': partial(hashlib.blake2b, digest_size=32),
+    'blake2b-512': partial(hashlib.blake2b, digest_size=64),
+}
+# The algorithm a sender chooses for us when it tells the hash only after the
+# transfer: the strongest one in app.gajim_common_features
+RECEIVED_HASH_ALGO = 'sha-512'
+HASH_BLOCK_SIZE = 65536
+
+
+class FileHash:
+    """
+    XEP-0300 hash of a file, computed from the data while it is transferred
+
+    >>> h = FileHash('sha-256')
+    >>> h.update(b'abc')
+    >>> h.get_hash()
+    'ungWv48Bz+pBQUDeXa4iI7ADYaOWF3qctBD/YfIAFa0='
+    """
+    def __init__(self, algo):
+        self.algo = algo
+        self.length = 0
+        self._hash = HASH_FUNCTIONS[algo]()
+
+    def update(self, data):
+        self._hash.update(data)
+        self.length += len(data)
+
+    def update_from_file(self, file_name, length):
+        """
+        Hash the file until length, the part of a resumed transfer that was
+        transferred before
+        """
+        with open(file_name, 'rb') as file_:
+            file_.seek(self.length)
+            while self.length < length:
+                data = file_.read(min(HASH_BLOCK_SIZE, length - self.length))
+                if not data:
+                    break
+                self.update(data)
+
+    def get_hash(self):
+        return b64encode(self._hash.digest()).decode('ascii')
+
+
 class FilesProp:
     _files_props = {}
 
@@ -114,6 +168,11 @@ class FileProp(object):
         self.disconnect_cb = None
         self.continue_cb = None
         self.sha_str = None
+        # FileHash of the data transferred so far, see start_hash()
+        self.hasher = None
+        # method callback called when the hash of a received file arrives
+        # after the transfer
+        self.checksum_cb = None
         # transfer type: 's' for sending and 'r' for receiving
         self.type_ = None
         self.error = None
@@ -138,8 +197,18 @@ class FileProp(object):
         self.algo = None
         self.direction = None
         self.syn_id = None
+        # IBB: {iq id: time sent} of the data blocks not yet acknowledged
+        self.ibb_pending = {}
+        # IBB: number of acknowledged data blocks and the sum of their round
+        # trip times
+        self.ibb_acked = 0
+        self.ibb_round_trip_time = 0.0
         self.seq = None
         self.hash_ = None
+        # True if the sender put the hash in the offer
+        self.hash_sent = False
+        # Index of the SOCKS5 connection in app.socks5queue
+        self.socks5_idx = None
         self.fd = None
         self.startexmpp = None
         # Type of the session, if it is 'jingle' or 'si'
@@ -161,6 +230,49 @@ class FileProp(object):
 
     sid = property(getsid, setsid)
 
+    def start_hash(self, offset=0):
+        """
+        Hash the data of a jingle transfer while it is sent or received, it
+        (re)starts at offset. The data before offset is read from the file.
+        """
+        self.hasher = None
+        if self.session_type != 'jingle':
+            return
+        if self.type_ == 's':
+            if self.hash_sent or self.algo is None:
+                # The hash was sent already or the receiver can not check it
+                return
+            algo = self.algo
+        else:
+            algo = self.algo or RECEIVED_HASH_ALGO
+        if algo not in HASH_FUNCTIONS:
+            return
+        hasher = FileHash(algo)
+        if offset:
+            try:
+                hasher.update_from_file(self.file_name, offset)
+            except OSError:
+                return
+        self.hasher = hasher
+
+    def get_throughput(self):
+        """
+        Return the average transfer speed so far in bytes per second
+        """
+        if not self.elapsed_time or not self.received_len:
+            return 0.0
+        return self.received_len / self.elapsed_time
+
+    def get_received_hash(self):
+        """
+        Return the hash of the received file computed during the transfer, or
+        None if it can not be compared with the hash sent by the sender
+        """
+        if self.hasher is None or self.hasher.algo != self.algo or \
+        self.hasher.length != self.size:
+            return None
+        return self.hasher.get_hash()
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -25,7 +25,10 @@ Global Events Dispatcher module.
 :license: GPL
 '''
 
+import heapq
+import time
 import traceback
+from collections import deque
 
 from nbxmpp import NodeProcessed
 import logging
@@ -55,48 +58,193 @@ OUT_PRECORE = 90
 OUT_CORE = 100
 OUT_POSTCORE = 110
 
+# Number of handler calls kept by the profiler, see enable_profiling()
+PROFILE_SIZE = 1000
+
 class GlobalEventsDispatcher(object):
 
     def __init__(self):
         self.handlers = {}
+        # Handlers that only want the events about one conversation
+        # {event_name: {(account, jid): [(priority, handler)]}}
+        self.keyed_handlers = {}
+        # {event_name: [number of times raised, handler calls, seconds]}
+        self._profile = {}
+        # Set by enable_profiling()
+        self.profiling = False
+        # {(event_name, handler_name): [calls, seconds]}
+        self._handler_profile = {}
+        # (event_name, handler_name, seconds) of the last handler calls
+        self._recent_calls = deque(maxlen=PROFILE_SIZE)
 
-    def register_event_handler(self, event_name, priority, handler):
-        if event_name in self.handlers:
-            handlers_list = self.handlers[event_name]
-            i = 0
-            for i, h in enumerate(handlers_list):
-                if priority < h[0]:
-                    break
-            else:
-                # no event with smaller prio found, put it at the end
-                i += 1
-
-            handlers_list.insert(i, (priority, handler))
+    @staticmethod
+    def _insert_handler(handlers_list, priority, handler):
+        for i, h in enumerate(handlers_list):
+            if priority < h[0]:
+                break
         else:
-            self.handlers[event_name] = [(priority, handler)]
+            # no event with smaller prio found, put it at the end
+            i = len(handlers_list)
+        handlers_list.insert(i, (priority, handler))
+
+    def register_event_handler(self, event_name, priority, handler, key=None):
+        """
+        Register handler for event_name
+
+        If key, an (account, jid) tuple, is given, the handler is only called
+        for the events raised with that key and for the events raised without
+        a key.
+        """
+        if key is None:
+            handlers_list = self.handlers.setdefault(event_name, [])
+        else:
+            handlers_list = self.keyed_handlers.setdefault(
+                event_name, {}).setdefault(key, [])
+        self._insert_handler(handlers_list, priority, handler)
+
+    def remove_event_handler(self, event_name, priority, handler, key=None):
+        if key is None:
+            handlers_list = self.handlers.get(event_name)
+        else:
+            handlers_list = self.keyed_handlers.get(event_name, {}).get(key)
+        if handlers_list is None:
+            return
+        try:
+            handlers_list.remove((priority, handler))
+        except ValueError as error:
+            log.warning('''Function (%s) with priority "%s" never registered
+            as handler of event "%s". Couldn\'t remove. Error: %s'''
+                              %(handler, priority, event_name, error))
+            return
+        if key is not None and not handlers_list:
+            del self.keyed_handlers[event_name][key]
+            if not self.keyed_handlers[event_name]:
+                del self.keyed_handlers[event_name]
+
+    def _get_handlers(self, event_name, key):
+        handlers_list = self.handlers.get(event_name, [])
+        if event_name not in self.keyed_handlers:
+            return handlers_list
+        keyed_handlers = self.keyed_handlers[event_name]
+        if key is None:
+            # Nobody said who the event is about, everybody gets it
+            keyed_lists = list(keyed_handlers.values())
+        elif key in keyed_handlers:
+            keyed_lists = [keyed_handlers[key]]
+        else:
+            return handlers_list
+        # heapq.merge() is stable, handlers registered without key come first
+        # when they have the same priority
+        return list(heapq.merge(handlers_list, *keyed_lists,
+                                key=lambda h: h[0]))
+
+    def raise_event(self, event_name, *args, key=None, **kwargs):
+        """
+        Call the handlers of event_name with args and kwargs
 
-    def remove_event_handler(self, event_name, priority, handler):
-        if event_name in self.handlers:
+        If key, an (account, jid) tuple, is given, only the handlers
+        registered without key or with that key are called.
+        """
+        log.debug('%s Args: %s', event_name, args)
+        handlers_list = self._get_handlers(event_name, key)
+        if not handlers_list:
+            return
+        profile = self._profile.setdefault(event_name, [0, 0, 0.0])
+        start = time.perf_counter()
+        try:
+            return self._call_handlers(event_name, handlers_list, profile,
+                                       *args, **kwargs)
+        finally:
+            profile[0] += 1
+            profile[2] += time.perf_counter() - start
+
+    def _call_handlers(self, event_name, handlers_list, profile, *args,
+                       **kwargs):
+        node_processed = False
+        for priority, handler in handlers_list:
+            profile[1] += 1
             try:
-                self.handlers[event_name].remove((priority, handler))
-            except ValueError as error:
-                log.warning('''Function (%s) with priority "%s" never registered
-                as handler of event "%s". Couldn\'t remove. Error: %s'''
-                                  %(handler, priority, event_name, error))
-
-    def raise_event(self, event_name, *args, **kwargs):
-        log.debug('%s Args: %s'%(event_name, str(args)))
-        if event_name in self.handlers:
-            node_processed = False
-            for priority, handler in self.handlers[event_name]:
+                if not self.profiling:
+                    if handler(*args, **kwargs):
+                        return True
+                    continue
+                start = time.perf_counter()
                 try:
                     if handler(*args, **kwargs):
                         return True
-                except NodeProcessed:
-                    node_processed = True
-                except Exception:
-                    log.error('Error while running an event handler: %s',
-                              handler)
-                    traceback.print_exc()
-            if node_processed:
-                raise NodeProcessed
+                finally:
+                    self.record(event_name, getattr(handler, '__qualname__',
+                        repr(handler)), time.perf_counter() - start)
+            except NodeProcessed:
+                node_processed = True
+            except Exception:
+                log.error('Error while running an event handler: %s',
+                          handler)
+                traceback.print_exc()
+        if node_processed:
+            raise NodeProcessed
+
+    def get_stats(self):
+        """
+        Return {event_name: {'handlers', 'keyed_handlers', 'raised', 'calls',
+        'time'}} with the number of registered handlers and how often and how
+        long (in seconds) the event was dispatched
+        """
+        stats = {}
+        for event_name in set(self.handlers) | set(self.keyed_handlers) | \
+        set(self._profile):
+            raised, calls, time_ = self._profile.get(event_name, (0, 0, 0.0))
+            stats[event_name] = {
+                'handlers': len(self.handlers.get(event_name, [])),
+                'keyed_handlers': sum(len(handlers_list) for handlers_list in
+                    self.keyed_handlers.get(event_name, {}).values()),
+                'raised': raised,
+                'calls': calls,
+                'time': time_}
+        return stats
+
+    def enable_profiling(self, size=PROFILE_SIZE):
+        """
+        Record how often and how long every handler is called, the last size
+        calls are kept too. See dump_profile()
+        """
+        self.profiling = True
+        self._recent_calls = deque(self._recent_calls, maxlen=size)
+
+    def disable_profiling(self):
+        self.profiling = False
+
+    def record(self, event_name, name, seconds):
+        """
+        Add a call of name (a handler or the generation of the event) which
+        took seconds to the profile of event_name
+        """
+        profile = self._handler_profile.setdefault((event_name, name), [0, 0.0])
+        profile[0] += 1
+        profile[1] += seconds
+        self._recent_calls.append((event_name, name, seconds))
+
+    def dump_profile(self):
+        """
+        Return the profile as text, the slowest events and handlers first
+        """
+        lines = ['Events:']
+        stats = self.get_stats()
+        for event_name in sorted(stats, key=lambda e: stats[e]['time'],
+        reverse=True):
+            event_stats = stats[event_name]
+            if not event_stats['raised']:
+                continue
+            lines.append('  %10.3fs %8d raised %8d calls %4d handlers %s' % (
+                event_stats['time'], event_stats['raised'],
+                event_stats['calls'], event_stats['handlers'] + \
+                event_stats['keyed_handlers'], event_name))
+        lines.append('Handlers:')
+        for (event_name, name), (calls, seconds) in sorted(
+        self._handler_profile.items(), key=lambda i: i[1][1], reverse=True):
+            lines.append('  %10.3fs %8d calls %s (%s)' % (seconds, calls, name,
+                event_name))
+        lines.append('Last %d calls:' % len(self._recent_calls))
+        for event_name, name, seconds in self._recent_calls:
+            lines.append('  %10.6fs %s (%s)' % (seconds, name, event_name))
+        return '\n'.join(lines)
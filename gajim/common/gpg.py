@@ -24,8 +24,88 @@
 
 import os
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from gi.repository import GLib
+
 from gajim.common import app
 
+log = logging.getLogger('gajim.c.gpg')
+
+# Number of threads which verify presence signatures
+VERIFY_WORKERS = 2
+# Number of (status, signature) verification results that are kept
+VERIFY_CACHE_SIZE = 1000
+
+
+class VerificationService:
+    """
+    Verify signatures in a pool of worker threads
+
+    Results are cached by (text, signature), so a signature is only
+    verified once, also if it is requested again while the first
+    verification is still running. Callbacks are called in the main loop
+    with the key id, or '' if the signature is invalid.
+    """
+
+    def __init__(self, verify_func):
+        self._verify = verify_func
+        self._executor = None
+        self._cache = OrderedDict()
+        self._pending = {}
+
+    def get_cached(self, text, signature):
+        """
+        Return the cached key id, or None if the signature was not verified
+        yet
+        """
+        key = (text, signature)
+        key_id = self._cache.get(key)
+        if key_id is not None:
+            self._cache.move_to_end(key)
+        return key_id
+
+    def verify(self, text, signature, callback):
+        key = (text, signature)
+        key_id = self.get_cached(text, signature)
+        if key_id is not None:
+            callback(key_id)
+            return
+
+        if key in self._pending:
+            self._pending[key].append(callback)
+            return
+        self._pending[key] = [callback]
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS)
+        future = self._executor.submit(self._verify, text, signature)
+        future.add_done_callback(
+            lambda future: GLib.idle_add(self._on_verified, key, future))
+
+    def _on_verified(self, key, future):
+        try:
+            key_id = future.result()
+        except Exception:
+            log.exception('Signature verification failed')
+            key_id = ''
+
+        self._cache[key] = key_id
+        if len(self._cache) > VERIFY_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+        for callback in self._pending.pop(key, []):
+            callback(key_id)
+        return False
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._pending.clear()
+
+
 if app.HAVE_GPG:
     import gnupg
     gnupg.logger = logging.getLogger('gajim.c.gnupg')
@@ -40,6 +120,7 @@ if app.HAVE_GPG:
             self.decode_errors = 'replace'
             self.passphrase = None
             self.always_trust = [] # list of keyID to always trust
+            self.verification = VerificationService(self.verify)
 
         def encrypt(self, str_, recipients, always_trust=False):
             trust = always_trust
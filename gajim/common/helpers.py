@@ -34,12 +34,15 @@ import re
 import os
 import subprocess
 import urllib
+import urllib.error
+import urllib.request
 import webbrowser
 import errno
 import select
 import base64
 import hashlib
 import shlex
+import threading
 from gajim.common import caps_cache
 import socket
 import time
@@ -556,7 +559,11 @@ def exec_command(command, use_shell=False, posix=True):
     else:
         args = shlex.split(command, posix=posix)
         p = subprocess.Popen(args)
-        app.thread_interface(p.wait)
+        # The child may run as long as Gajim (a browser, a file manager), so
+        # it is reaped by its own thread and not by an executor worker
+        thread = threading.Thread(target=p.wait, name='wait-%s' % p.pid)
+        thread.daemon = True
+        thread.start()
 
 def build_command(executable, parameter):
     # we add to the parameter (can hold path with spaces)
@@ -734,7 +741,6 @@ def parse_datetime(timestring, check_utc=False, convert='utc', epoch=False):
 from gajim.common import app
 if app.HAVE_PYCURL:
     import pycurl
-    from io import StringIO
 
 def convert_bytes(string):
     suffix = ''
@@ -920,7 +926,7 @@ def play_sound_file(path_to_soundfile):
                 dev.write(sndfile.readframes(nf))
                 sndfile.close()
                 dev.close()
-            app.thread_interface(_oss_play)
+            app.thread_interface(_oss_play, executor='sound')
             return
         player = app.config.get('soundplayer')
         command = build_command(player, path_to_soundfile)
@@ -1471,12 +1477,53 @@ def get_proxy_info(account):
             proxy[key] = proxyptr[key]
         return proxy
 
-def _get_img_direct(attrs):
+# Size of the chunks in which images are downloaded
+IMAGE_CHUNK_SIZE = 16 * 1024
+
+def _img_error(attrs, error):
+    alt = attrs.get('alt', '')
+    if alt:
+        alt += '\n'
+    return alt + error
+
+def _read_img(f, max_size, deadline):
+    """
+    Read the body of the HTTP response f, return (data, error)
+
+    The image is read in chunks into a buffer that is allocated once, from
+    the Content-Length if the server sent one, else big enough for max_size.
+    """
+    capacity = max_size
+    length = f.headers.get('Content-Length')
+    if length is not None and length.isdigit():
+        if int(length) > max_size:
+            return None, _('Image is too big')
+        capacity = int(length)
+    # One more byte, so that we notice if the image is bigger
+    buf = bytearray(capacity + 1)
+    view = memoryview(buf)
+    pos = 0
+    try:
+        while True:
+            if time.time() > deadline:
+                return None, _('Timeout loading image')
+            read = f.readinto(view[pos:pos + IMAGE_CHUNK_SIZE])
+            if not read:
+                return bytes(view[:pos]), None
+            pos += read
+            if pos > capacity:
+                return None, _('Image is too big')
+    finally:
+        view.release()
+
+def _get_img_direct(attrs, entry=None):
     """
     Download an image. This function should be launched in a separated thread.
+
+    If entry is a cached version of the image, the request is conditional.
+    Returns (status, data, alt, headers), status is None if the download
+    failed.
     """
-    mem = b''
-    alt = ''
     max_size = 2*1024*1024
     if 'max_size' in attrs:
         max_size = attrs['max_size']
@@ -1485,62 +1532,62 @@ def _get_img_direct(attrs):
     try:
         req = urllib.request.Request(attrs['src'])
         req.add_header('User-Agent', 'Gajim ' + app.version)
+        if entry is not None:
+            for name, value in entry.get_validators().items():
+                req.add_header(name, value)
         f = urllib.request.urlopen(req)
+    except urllib.error.HTTPError as ex:
+        if ex.code == 304 and entry is not None:
+            return 304, b'', attrs.get('alt', ''), ex.headers
+        log.debug('Error loading image %s ' % attrs['src']  + str(ex))
+        return None, b'', attrs.get('alt', 'Broken image'), None
     except Exception as ex:
         log.debug('Error loading image %s ' % attrs['src']  + str(ex))
-        pixbuf = None
-        alt = attrs.get('alt', 'Broken image')
-    else:
-        # Wait 2s between each byte
-        try:
-            f.fp._sock.fp._sock.settimeout(2)
-        except Exception:
-            pass
-        # On a slow internet connection with ~1000kbps you need ~10 seconds for 1 MB
-        deadline = time.time() + (10 * (max_size / 1048576))
-        while True:
-            if time.time() > deadline:
-                log.debug('Timeout loading image %s ' % attrs['src'])
-                mem = ''
-                alt = attrs.get('alt', '')
-                if alt:
-                    alt += '\n'
-                alt += _('Timeout loading image')
-                break
-            try:
-                temp = f.read(100)
-            except socket.timeout as ex:
-                log.debug('Timeout loading image %s ' % attrs['src'] + str(ex))
-                alt = attrs.get('alt', '')
-                if alt:
-                    alt += '\n'
-                alt += _('Timeout loading image')
-                break
-            if temp:
-                mem += temp
-            else:
-                break
-            if len(mem) > max_size:
-                alt = attrs.get('alt', '')
-                if alt:
-                    alt += '\n'
-                alt += _('Image is too big')
-                break
+        return None, b'', attrs.get('alt', 'Broken image'), None
+
+    # On a slow internet connection with ~1000kbps you need ~10 seconds for 1 MB
+    deadline = time.time() + (10 * (max_size / 1048576))
+    try:
+        mem, error = _read_img(f, max_size, deadline)
+    except socket.timeout as ex:
+        log.debug('Timeout loading image %s ' % attrs['src'] + str(ex))
+        mem, error = None, _('Timeout loading image')
+    except Exception as ex:
+        log.debug('Error loading image %s ' % attrs['src']  + str(ex))
+        mem, error = None, _('Error loading image')
+    finally:
         f.close()
-    return (mem, alt)
+    if error is not None:
+        log.debug('%s: %s', error, attrs['src'])
+        return None, b'', _img_error(attrs, error), None
+    # getcode() is None for non HTTP URLs
+    return f.getcode() or 200, mem, attrs.get('alt', ''), f.headers
 
-def _get_img_proxy(attrs, proxy):
+def _get_img_proxy(attrs, proxy, entry=None):
     """
     Download an image through a proxy. This function should be launched in a
     separated thread.
+
+    Returns (status, data, alt, headers) like _get_img_direct()
     """
     if not app.HAVE_PYCURL:
-        return '', _('PyCURL is not installed')
-    mem, alt, max_size = '', '', 2*1024*1024
+        return None, b'', _('PyCURL is not installed'), None
+    max_size = 2*1024*1024
     if 'max_size' in attrs:
         max_size = attrs['max_size']
+    buf = bytearray()
+    headers = {}
+    def write(data):
+        if len(buf) + len(data) > max_size:
+            # Makes pycurl abort with E_WRITE_ERROR
+            return 0
+        buf.extend(data)
+    def header(line):
+        name, sep, value = line.decode('iso-8859-1').partition(':')
+        if sep:
+            # Header names are case-insensitive, HTTP/2 sends them lowercase
+            headers[name.strip().lower()] = value.strip()
     try:
-        b = StringIO()
         c = pycurl.Curl()
         c.setopt(pycurl.URL, attrs['src'].encode('utf-8'))
         c.setopt(pycurl.FOLLOWLOCATION, 1)
@@ -1549,8 +1596,12 @@ def _get_img_proxy(attrs, proxy):
         # On a slow internet connection with ~1000kbps you need ~10 seconds for 1 MB
         c.setopt(pycurl.TIMEOUT, 10 * (max_size / 1048576))
         c.setopt(pycurl.MAXFILESIZE, max_size)
-        c.setopt(pycurl.WRITEFUNCTION, b.write)
+        c.setopt(pycurl.WRITEFUNCTION, write)
+        c.setopt(pycurl.HEADERFUNCTION, header)
         c.setopt(pycurl.USERAGENT, 'Gajim ' + app.version)
+        if entry is not None:
+            c.setopt(pycurl.HTTPHEADER, ['%s: %s' % item for item in
+                                         entry.get_validators().items()])
         # set proxy
         c.setopt(pycurl.PROXY, proxy['host'].encode('utf-8'))
         c.setopt(pycurl.PROXYPORT, proxy['port'])
@@ -1562,31 +1613,74 @@ def _get_img_proxy(attrs, proxy):
             c.setopt(pycurl.PROXYTYPE, pycurl.PROXYTYPE_HTTP)
         elif proxy['type'] == 'socks5':
             c.setopt(pycurl.PROXYTYPE, pycurl.PROXYTYPE_SOCKS5)
-        x = c.perform()
+        c.perform()
+        status = c.getinfo(pycurl.RESPONSE_CODE)
         c.close()
-        t = b.getvalue()
-        return (t, attrs.get('alt', ''))
+        if status == 304 and entry is not None:
+            return 304, b'', attrs.get('alt', ''), headers
+        if not 200 <= status < 300:
+            return None, b'', _img_error(attrs, _('Error loading image')), None
+        return status, bytes(buf), attrs.get('alt', ''), headers
     except pycurl.error as ex:
-        alt = attrs.get('alt', '')
-        if alt:
-            alt += '\n'
-        if ex.errno == pycurl.E_FILESIZE_EXCEEDED:
-            alt += _('Image is too big')
-        elif ex.errno == pycurl.E_OPERATION_TIMEOUTED:
-            alt += _('Timeout loading image')
+        if ex.args[0] in (pycurl.E_FILESIZE_EXCEEDED, pycurl.E_WRITE_ERROR):
+            error = _('Image is too big')
+        elif ex.args[0] == pycurl.E_OPERATION_TIMEOUTED:
+            error = _('Timeout loading image')
         else:
-            alt += _('Error loading image')
+            error = _('Error loading image')
+        return None, b'', _img_error(attrs, error), None
     except Exception as ex:
         log.debug('Error loading image %s ' % attrs['src']  + str(ex))
-        pixbuf = None
-        alt = attrs.get('alt', 'Broken image')
-    return ('', alt)
+        return None, b'', attrs.get('alt', 'Broken image'), None
+
+def get_cached_image(url):
+    """
+    Return (data, stale) for the image at url, data is None if the image is
+    not cached
+    """
+    if app.image_cache is None:
+        return None, False
+    data, entry = app.image_cache.get(url)
+    if data is None:
+        return None, False
+    return data, entry.stale
 
 def download_image(account, attrs):
+    """
+    Return (data, alt) for the image described by attrs
+
+    Fresh images are taken from the image cache, stale ones are revalidated
+    with a conditional request. This function should be launched in a
+    separated thread.
+    """
+    cache = app.image_cache
+    url = attrs['src']
+    entry = None
+    if cache is not None:
+        entry = cache.get_entry(url)
+        if entry is not None and not entry.stale:
+            data = cache.get_data(entry)
+            if data is not None:
+                return data, attrs.get('alt', '')
+            entry = None
+
     proxy = get_proxy_info(account)
     if proxy and proxy['type'] in ('http', 'socks5'):
-        return _get_img_proxy(attrs, proxy)
-    return _get_img_direct(attrs)
+        status, mem, alt, headers = _get_img_proxy(attrs, proxy, entry)
+    else:
+        status, mem, alt, headers = _get_img_direct(attrs, entry)
+
+    if cache is None or status is None:
+        return mem, alt
+    if status == 304:
+        cache.revalidated(entry, headers)
+        data = cache.get_data(entry)
+        if data is not None:
+            return data, alt
+        # The image was evicted in the meantime
+        return download_image(account, attrs)
+    cache.store(url, mem, headers)
+    return mem, alt
 
 def version_condition(current_version, required_version):
     if V(current_version) < V(required_version):
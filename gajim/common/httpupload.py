@@ -15,6 +15,7 @@
 # along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import time
 import threading
 import ssl
 import urllib
@@ -270,7 +271,6 @@ class ConnectionHTTPUpload:
                         request, cafile=certifi.where(), timeout=30)
                 else:
                     transfer = urlopen(request, timeout=30)
-            file.stream.close()
             log.info('Urllib upload request done, response code: %s',
                      transfer.getcode())
             GLib.idle_add(self.upload_complete, transfer.getcode(), file)
@@ -289,6 +289,8 @@ class ConnectionHTTPUpload:
         except Exception as exc:
             log.exception("Exception during upload")
             error_msg = exc
+        finally:
+            file.stream.close()
         GLib.idle_add(self.raise_progress_event, 'close', file)
         GLib.idle_add(self.on_upload_error, file, error_msg)
 
@@ -330,6 +332,19 @@ class ConnectionHTTPUpload:
 
 
 class File:
+    """
+    A file to upload
+
+    The file is not loaded into memory, StreamFileWithProgress reads it from
+    disk while it is uploaded.
+
+    Encryption plugins can either replace the content with encrypted data
+    (set `data` and `size`, use get_data(full=True) to get the content), or
+    encrypt the stream on the fly by calling set_encryptor(). The encryptor
+    needs an update(data) method which returns the encrypted bytes and a
+    finalize() method which returns the remaining bytes, for example the
+    authentication tag.
+    """
     def __init__(self, path, contact, **kwargs):
         for k, v in kwargs.items():
             setattr(self, k, v)
@@ -343,32 +358,51 @@ class File:
         self.put = None
         self.get = None
         self.data = None
+        self.encryptor = None
         self.user_data = None
         self.size = None
         self.event = threading.Event()
         self.load_data()
 
     def load_data(self):
-        with open(self.path, 'rb') as content:
-            self.data = content.read()
-        self.size = len(self.data)
+        self.size = os.path.getsize(self.path)
 
     def get_data(self, full=False):
         if full:
-            return io.BytesIO(self.data).getvalue()
-        return io.BytesIO(self.data)
+            if self.data is not None:
+                return self.data
+            with open(self.path, 'rb') as content:
+                return content.read()
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def set_encryptor(self, encryptor, size):
+        """
+        Encrypt the file while it is uploaded
+
+        :param encryptor:   Object with update(data) and finalize() methods
+
+        :param size:        The size of the encrypted file
+        """
+        self.encryptor = encryptor
+        self.size = size
+        self.encrypted = True
 
 
 class StreamFileWithProgress:
+    # Minimum time in seconds between two progress updates
+    PROGRESS_INTERVAL = 0.1
+
     def __init__(self, file):
         self.file = file
         self.event = file.event
         self.backing = file.get_data()
-        self.backing.seek(0, os.SEEK_END)
-        self._total = self.backing.tell()
-        self.backing.seek(0)
+        self._encryptor = file.encryptor
+        self._total = file.size
         self._callback = file.update_progress
         self._seen = 0
+        self._last_update = 0
 
     def __len__(self):
         return self._total
@@ -377,13 +411,35 @@ class StreamFileWithProgress:
         if self.event.isSet():
             raise UploadAbortedException
 
-        data = self.backing.read(size)
+        data = self._read(size)
         self._seen += len(data)
         if self._callback:
-            GLib.idle_add(self._callback, 'update',
-                          self.file, self._seen, self._total)
+            now = time.monotonic()
+            if (now - self._last_update >= self.PROGRESS_INTERVAL or
+                    self._seen >= self._total):
+                self._last_update = now
+                GLib.idle_add(self._callback, 'update',
+                              self.file, self._seen, self._total)
         return data
 
+    def _read(self, size):
+        if self._encryptor is None:
+            return self.backing.read(size)
+
+        # An empty result ends the upload, so read until the encryptor
+        # returns something or the file is finished
+        while True:
+            data = self.backing.read(size)
+            if not data:
+                if self._encryptor is None:
+                    return b''
+                data = self._encryptor.finalize()
+                self._encryptor = None
+                return data
+            data = self._encryptor.update(data)
+            if data:
+                return data
+
     def close(self):
         return self.backing.close()
 
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Gajim.
+#
+# Gajim is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; version 3 only.
+#
+# Gajim is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Gajim.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+On-disk cache for images downloaded from XHTML-IM messages
+
+Images are stored under the sha256 of their content in the data directory,
+so an image that is linked under different URLs is stored only once. For
+every URL a small JSON file in the urls directory points to the content and
+holds the validators (ETag, Last-Modified) which are needed to revalidate
+the image with a conditional request.
+
+The size of the data directory is limited, the least recently used images
+are removed first.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger('gajim.c.image_cache')
+
+# Revalidate an image after this many seconds if the server did not send
+# a max-age
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, url, digest, etag=None, last_modified=None,
+                 expires=0):
+        self.url = url
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    @property
+    def stale(self):
+        return time.time() >= self.expires
+
+    def get_validators(self):
+        """
+        Return the headers for a conditional request
+        """
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_dict(self):
+        return {'url': self.url,
+                'digest': self.digest,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'expires': self.expires}
+
+
+class ImageCache:
+    def __init__(self, path, max_size):
+        self._data_path = os.path.join(path, 'data')
+        self._url_path = os.path.join(path, 'urls')
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        # digest: size, least recently used first
+        self._files = None
+        self._size = 0
+
+    def _load(self):
+        # Called with the lock held
+        if self._files is not None:
+            return
+        for path in (self._data_path, self._url_path):
+            if not os.path.isdir(path):
+                os.makedirs(path, 0o700)
+        files = []
+        with os.scandir(self._data_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.endswith('.tmp'):
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        files.sort()
+        self._files = OrderedDict()
+        for _mtime, digest, size in files:
+            self._files[digest] = size
+            self._size += size
+        log.info('%s images in cache, %s bytes', len(self._files), self._size)
+
+    def _get_url_file(self, url):
+        return os.path.join(self._url_path, _hash(url.encode('utf-8')))
+
+    def _get_data_file(self, digest):
+        return os.path.join(self._data_path, digest)
+
+    @staticmethod
+    def _write(path, data):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+
+    def get_entry(self, url):
+        """
+        Return the CacheEntry for url, or None if the image is not cached
+        """
+        with self._lock:
+            self._load()
+            url_file = self._get_url_file(url)
+            try:
+                with open(url_file, 'r') as file:
+                    entry = CacheEntry(**json.load(file))
+            except FileNotFoundError:
+                return None
+            except (OSError, ValueError, TypeError):
+                log.warning('Invalid cache entry for %s', url)
+                self._remove_url_file(url_file)
+                return None
+
+            if entry.digest not in self._files:
+                # The image was evicted
+                self._remove_url_file(url_file)
+                return None
+            return entry
+
+    def get_data(self, entry):
+        """
+        Return the image of entry, or None if it is not cached anymore
+        """
+        with self._lock:
+            self._load()
+            if entry.digest not in self._files:
+                return None
+            data_file = self._get_data_file(entry.digest)
+            try:
+                with open(data_file, 'rb') as file:
+                    data = file.read()
+                os.utime(data_file)
+            except OSError:
+                log.warning('Could not read cached image %s', entry.url)
+                self._remove_data(entry.digest)
+                return None
+            self._files.move_to_end(entry.digest)
+            return data
+
+    def get(self, url):
+        """
+        Return (data, entry) for url, or (None, None) if it is not cached
+        """
+        entry = self.get_entry(url)
+        if entry is None:
+            return None, None
+        data = self.get_data(entry)
+        if data is None:
+            return None, None
+        return data, entry
+
+    def store(self, url, data, headers):
+        """
+        Store the image data downloaded from url
+
+        :param headers: The headers of the HTTP response
+        """
+        if len(data) > self.max_size:
+            return
+        entry = CacheEntry(url, _hash(data))
+        self._update_entry(entry, headers)
+        with self._lock:
+            self._load()
+            try:
+                if entry.digest not in self._files:
+                    self._write(self._get_data_file(entry.digest), data)
+                    self._files[entry.digest] = len(data)
+                    self._size += len(data)
+                self._files.move_to_end(entry.digest)
+                self._write_entry(entry)
+            except OSError:
+                log.exception('Could not store %s in cache', url)
+                return
+            self._evict()
+
+    def revalidated(self, entry, headers):
+        """
+        The server answered a conditional request with 304 Not Modified
+        """
+        self._update_entry(entry, headers)
+        with self._lock:
+            try:
+                self._write_entry(entry)
+            except OSError:
+                log.exception('Could not update cache entry for %s',
+                              entry.url)
+
+    def set_max_size(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            if self._files is not None:
+                self._evict()
+
+    @staticmethod
+    def _update_entry(entry, headers):
+        # Header names are case-insensitive
+        headers = {name.lower(): value for name, value in headers.items()}
+        etag = headers.get('etag')
+        if etag is not None:
+            entry.etag = etag
+        last_modified = headers.get('last-modified')
+        if last_modified is not None:
+            entry.last_modified = last_modified
+        max_age = DEFAULT_MAX_AGE
+        match = re.search(r'max-age=(\d+)', headers.get('cache-control', ''))
+        if match is not None:
+            max_age = int(match.group(1))
+        entry.expires = time.time() + max_age
+
+    def _write_entry(self, entry):
+        self._write(self._get_url_file(entry.url),
+                    json.dumps(entry.to_dict()).encode('utf-8'))
+
+    def _evict(self):
+        while self._size > self.max_size and self._files:
+            digest = next(iter(self._files))
+            self._remove_data(digest)
+
+    def _remove_data(self, digest):
+        size = self._files.pop(digest, None)
+        if size is None:
+            return
+        self._size -= size
+        try:
+            os.remove(self._get_data_file(digest))
+        except OSError:
+            log.warning('Could not remove cached image %s', digest)
+
+    @staticmethod
+    def _remove_url_file(url_file):
+        try:
+            os.remove(url_file)
+        except OSError:
+            pass
@@ -206,6 +206,7 @@ class JingleContent:
                 hash_data = self._compute_hash()
                 if hash_data:
                     file_tag.addChild(node=hash_data)
+                    self.file_props.hash_sent = True
                 pjid = app.get_jid_without_resource(self.session.peerjid)
                 file_info = {'name' : self.file_props.name,
                              'file-name' : self.file_props.file_name,
@@ -22,7 +22,6 @@ Handles  Jingle File Transfer (XEP 0234)
 import hashlib
 import logging
 import os
-import threading
 from enum import IntEnum, unique
 import nbxmpp
 from gajim.common import app
@@ -150,11 +149,17 @@ class JingleFileTransfer(JingleContent):
     def __on_session_initiate_sent(self, stanza, content, error, action):
         pass
 
-    def __send_hash(self):
-        # Send hash in a session info
+    def send_checksum(self):
+        # Send the hash computed while the file was sent in a session info
+        hasher = self.file_props.hasher
+        if hasher is None or hasher.length != self.file_props.size:
+            return
+        self.file_props.hash_ = hasher.get_hash()
+        h = nbxmpp.Hashes2()
+        h.addHash(self.file_props.hash_, hasher.algo)
         checksum = nbxmpp.Node(tag='checksum',
                                payload=[nbxmpp.Node(tag='file',
-                                                    payload=[self._compute_hash()])])
+                                                    payload=[h])])
         checksum.setNamespace(nbxmpp.NS_JINGLE_FILE_TRANSFER_5)
         self.session.__session_info(checksum)
         pjid = app.get_jid_without_resource(self.session.peerjid)
@@ -195,6 +200,7 @@ class JingleFileTransfer(JingleContent):
     def __on_session_accept(self, stanza, content, error, action):
         log.info("__on_session_accept")
         con = self.session.connection
+        self._update_transport(content)
         security = content.getTag('security')
         if not security: # responder can not verify our fingerprint
             self.use_security = False
@@ -223,12 +229,8 @@ class JingleFileTransfer(JingleContent):
             self.__state_changed(State.TRANSFERING)
             raise nbxmpp.NodeProcessed
         self.file_props.streamhosts = self.transport.remote_candidates
-        # Calculate file hash in a new thread
-        # if we haven't sent the hash already.
-        if self.file_props.hash_ is None and self.file_props.algo and \
-                not self.werequest:
-            self.hash_thread = threading.Thread(target=self.__send_hash)
-            self.hash_thread.start()
+        # If we haven't sent the hash already, it is computed while the file
+        # is sent and sent by send_checksum() after the last byte
         for host in self.file_props.streamhosts:
             host['initiator'] = self.session.initiator
             host['target'] = self.session.responder
@@ -256,6 +258,15 @@ class JingleFileTransfer(JingleContent):
 
     def __on_transport_accept(self, stanza, content, error, action):
         log.info("__on_transport_accept")
+        self._update_transport(content)
+
+    def _update_transport(self, content):
+        # The responder may accept IBB with a smaller block size
+        transport = content.getTag('transport')
+        if transport is not None and \
+        transport.getNamespace() == nbxmpp.NS_JINGLE_IBB and \
+        self.transport.type_ == TransportType.IBB:
+            self.transport.update_block_size(transport)
 
     def __on_transport_replace(self, stanza, content, error, action):
         log.info("__on_transport_replace")
@@ -366,7 +377,7 @@ class JingleFileTransfer(JingleContent):
 
     def _store_socks5_sid(self, sid, hash_id):
         # callback from socsk5queue.start_listener
-        self.file_props.hash_ = hash_id
+        self.file_props.socks5_idx = hash_id
 
     def _listen_host(self):
         receiver = self.file_props.receiver
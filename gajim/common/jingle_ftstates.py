@@ -146,7 +146,7 @@ class StateTransfering(JingleFileTransferStates):
         self.jft.file_props.transport_sid = self.jft.transport.sid
         fp = open(self.jft.file_props.file_name, 'rb')
         con.OpenStream(self.jft.file_props.sid, self.jft.session.peerjid, fp,
-                       blocksize=4096)
+                       blocksize=int(self.jft.transport.block_sz))
 
     def _start_sock5_transfer(self):
         # It tells wether we start the transfer as client or server
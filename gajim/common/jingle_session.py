@@ -139,7 +139,7 @@ class JingleSession:
             'transport-info':       [self.__ack, self.__broadcast],
             'transport-replace':    [self.__ack, self.__broadcast,
                                      self.__on_transport_replace], #TODO
-            'transport-accept':     [self.__ack], #TODO
+            'transport-accept':     [self.__ack, self.__broadcast], #TODO
             'transport-reject':     [self.__ack], #TODO
             'iq-result':            [self.__broadcast],
             'iq-error':             [self.__on_error],
@@ -409,7 +409,8 @@ class JingleSession:
                     # Anyway, content's transport is not modifiable yet
                     pass
                 elif transport_ns == nbxmpp.NS_JINGLE_IBB:
-                    transport = JingleTransportIBB()
+                    transport = JingleTransportIBB(
+                        node=content.getTag('transport'))
                     self.modify_content(creator, name, transport)
                     self.state = JingleStates.PENDING
                     self.contents[(creator, name)].state = State.TRANSPORT_REPLACE
@@ -450,6 +451,9 @@ class JingleSession:
                                                        self.sid)
                     file_props.algo = algo
                     file_props.hash_ = hash_.getData()
+                    if file_props.checksum_cb:
+                        # The transfer is over, the file can be checked now
+                        file_props.checksum_cb()
                     raise nbxmpp.NodeProcessed
         self.__send_error(stanza, 'feature-not-implemented', 'unsupported-info',
                           type_='modify')
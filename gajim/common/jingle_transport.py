@@ -385,13 +385,27 @@ class JingleTransportIBB(JingleTransport):
         if block_sz:
             self.block_sz = block_sz
         else:
-            self.block_sz = '4096'
+            self.block_sz = str(app.config.get('ibb_block_size'))
+        if node:
+            self.update_block_size(node)
 
         self.connection = None
         self.sid = None
         if node and node.getAttr('sid'):
             self.sid = node.getAttr('sid')
 
+    def update_block_size(self, node):
+        """
+        Take the block-size of a transport the peer sent, we never use larger
+        blocks than the peer offered or accepted
+        """
+        try:
+            block_sz = int(node.getAttr('block-size'))
+        except (TypeError, ValueError):
+            return
+        if block_sz > 0:
+            self.block_sz = str(min(int(self.block_sz), block_sz))
+
 
     def make_transport(self):
 
@@ -34,7 +34,9 @@ import time
 import datetime
 import calendar
 import json
+import re
 from collections import namedtuple
+from collections import OrderedDict
 from gzip import GzipFile
 from io import BytesIO
 from gi.repository import GLib
@@ -105,10 +107,416 @@ class SubscriptionConstant(IntEnum):
     FROM = 2
     BOTH = 3
 
+class StanzaIdCache:
+    """
+    Remembers the most recently seen stanza-ids of every archive, so
+    duplicates can be detected without a database lookup
+
+    An archive is identified by (account_id, jid_id) for groupchats and by
+    (account_id, None) for the archive of the account.
+    """
+
+    def __init__(self, size=1000):
+        self._size = size
+        self._archives = {}
+
+    def add(self, archive, stanza_id):
+        ids = self._archives.setdefault(archive, OrderedDict())
+        ids[stanza_id] = None
+        ids.move_to_end(stanza_id)
+        if len(ids) > self._size:
+            ids.popitem(last=False)
+
+    def contains(self, archive, stanza_ids):
+        ids = self._archives.get(archive)
+        if not ids:
+            return False
+        for stanza_id in stanza_ids:
+            if stanza_id in ids:
+                ids.move_to_end(stanza_id)
+                return True
+        return False
+
+    def clear(self):
+        self._archives.clear()
+
+
+class RowFactory:
+    """
+    Row factory which returns namedtuples
+
+    The namedtuple class is created once per distinct set of columns and
+    reused for every row with the same cursor description. If a row has an
+    `additional_data` column, the JSON is decoded on first access of the
+    attribute, index access and unpacking return the raw JSON string.
+
+    Usage:
+    con.row_factory = RowFactory()
+    """
+
+    def __init__(self):
+        self._row_types = {}
+        self._description = None
+        self._row_type = None
+
+    def get_row_type(self, fields):
+        """
+        Return the cached row type for a tuple of column names
+        """
+        try:
+            return self._row_types[fields]
+        except KeyError:
+            pass
+
+        row_type = namedtuple('Row', fields)
+        if 'additional_data' in fields:
+            row_type = _make_lazy_row_type(row_type, fields)
+        self._row_types[fields] = row_type
+        return row_type
+
+    def __call__(self, cursor, row):
+        description = cursor.description
+        if description is not self._description:
+            # All rows of a query share the same description object
+            fields = tuple(col[0] for col in description)
+            self._row_type = self.get_row_type(fields)
+            self._description = description
+        return self._row_type._make(row)
+
+
+def _make_lazy_row_type(base, fields):
+    index = fields.index('additional_data')
+
+    class Row(base):
+        """
+        Row with a lazily decoded additional_data column
+        """
+
+        # No __slots__, the decoded value is cached in the instance dict,
+        # which Python only allocates on first use
+        @property
+        def additional_data(self):
+            try:
+                return self.__dict__['_additional_data']
+            except KeyError:
+                value = json.loads(tuple.__getitem__(self, index) or '{}')
+                self.__dict__['_additional_data'] = value
+                return value
+
+    return Row
+
+
+class LogSearchIndex:
+    """
+    Full-text index over the message, subject and contact_name columns of
+    the `logs` table.
+
+    If SQLite is built with FTS5 the index is an external content FTS5 table
+    on `logs`, which is kept up to date by triggers. Otherwise a plain term
+    table (term, log_line_id) is maintained. Rows are keyed by log_line_id in
+    both cases.
+
+    The index does not depend on the row factory of the connection, so it can
+    be used by the history manager which has its own connection.
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, con):
+        self._con = con
+        self.fts5 = self._fts5_available(con)
+
+    @staticmethod
+    def _fts5_available(con):
+        try:
+            options = con.execute('PRAGMA compile_options').fetchall()
+        except sqlite.DatabaseError:
+            return False
+        return any(row[0] == 'ENABLE_FTS5' for row in options)
+
+    @staticmethod
+    def get_terms(*texts):
+        """
+        Split texts into the lowercase terms stored by the fallback index
+        """
+        terms = set()
+        for text in texts:
+            if text:
+                terms.update(re.findall(r'\w+', text.lower()))
+        return terms
+
+    @staticmethod
+    def parse_query(query):
+        """
+        Parse a search string into a list of (text, is_phrase, is_prefix)
+
+        Text in double quotes is a phrase, a trailing * on a word makes it
+        a prefix query.
+        """
+        parsed = []
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+            if phrase:
+                if phrase.strip():
+                    parsed.append((phrase.strip(), True, False))
+                continue
+            prefix = word.endswith('*')
+            word = word.rstrip('*')
+            if word:
+                parsed.append((word, False, prefix))
+        return parsed
+
+    def _table_exists(self, name):
+        sql = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?"
+        return self._con.execute(sql, (name,)).fetchone() is not None
+
+    def _has_own_content(self):
+        """
+        True if logs_search stores a copy of the messages, as the first
+        version of the index did
+        """
+        sql = "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?"
+        row = self._con.execute(sql, ('logs_search',)).fetchone()
+        return row is not None and 'content=' not in row[0].replace(' ', '')
+
+    @property
+    def table(self):
+        return 'logs_search' if self.fts5 else 'logs_search_terms'
+
+    def init_tables(self):
+        """
+        Create the index if it does not exist yet
+
+        If `logs` already contains messages, the range of rows that has to be
+        indexed is stored in `logs_search_backfill` and handled by
+        backfill().
+        """
+        if self.fts5 and self._has_own_content():
+            self._con.execute('DROP TABLE logs_search')
+            log.info('Dropped search index with its own content')
+        if self._table_exists(self.table):
+            return
+
+        if self.fts5:
+            # The triggers must not remove rows the backfill did not add yet
+            sql = '''
+                CREATE VIRTUAL TABLE logs_search
+                USING fts5(message, subject, contact_name,
+                           content='logs', content_rowid='log_line_id');
+                CREATE TRIGGER IF NOT EXISTS logs_search_insert
+                AFTER INSERT ON logs BEGIN
+                    INSERT INTO logs_search (rowid, message, subject,
+                                             contact_name)
+                    VALUES (new.log_line_id, new.message, new.subject,
+                            new.contact_name);
+                END;
+                CREATE TRIGGER IF NOT EXISTS logs_search_delete
+                AFTER DELETE ON logs WHEN NOT EXISTS (
+                    SELECT * FROM logs_search_backfill
+                    WHERE old.log_line_id > next_id AND
+                          old.log_line_id <= end_id) BEGIN
+                    INSERT INTO logs_search (logs_search, rowid, message,
+                                             subject, contact_name)
+                    VALUES ('delete', old.log_line_id, old.message,
+                            old.subject, old.contact_name);
+                END;
+                CREATE TRIGGER IF NOT EXISTS logs_search_update
+                AFTER UPDATE OF message, subject, contact_name ON logs
+                WHEN NOT EXISTS (
+                    SELECT * FROM logs_search_backfill
+                    WHERE old.log_line_id > next_id AND
+                          old.log_line_id <= end_id) BEGIN
+                    INSERT INTO logs_search (logs_search, rowid, message,
+                                             subject, contact_name)
+                    VALUES ('delete', old.log_line_id, old.message,
+                            old.subject, old.contact_name);
+                    INSERT INTO logs_search (rowid, message, subject,
+                                             contact_name)
+                    VALUES (new.log_line_id, new.message, new.subject,
+                            new.contact_name);
+                END;
+                '''
+        else:
+            sql = '''
+                CREATE TABLE logs_search_terms(
+                    term TEXT,
+                    log_line_id INTEGER,
+                    PRIMARY KEY (term, log_line_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX idx_logs_search_terms_log_line_id
+                ON logs_search_terms (log_line_id);
+                '''
+        sql += '''
+            CREATE TABLE IF NOT EXISTS logs_search_backfill(
+                next_id INTEGER,
+                end_id INTEGER
+            );
+            DELETE FROM logs_search_backfill;
+            INSERT INTO logs_search_backfill SELECT 0, MAX(log_line_id) FROM logs;
+            DELETE FROM logs_search_backfill WHERE end_id IS NULL;
+            '''
+        self._con.executescript(sql)
+        log.info('Created search index, fts5: %s', self.fts5)
+
+    def backfill_pending(self):
+        if not self._table_exists('logs_search_backfill'):
+            return False
+        sql = 'SELECT next_id FROM logs_search_backfill'
+        return self._con.execute(sql).fetchone() is not None
+
+    def backfill(self):
+        """
+        Index the next batch of rows that existed before the index was
+        created
+
+        returns True if there are still rows left to index
+        """
+        row = self._con.execute(
+            'SELECT next_id, end_id FROM logs_search_backfill').fetchone()
+        if row is None:
+            return False
+        next_id, end_id = row[0], row[1]
+
+        sql = '''
+            SELECT log_line_id, message, subject, contact_name FROM logs
+            WHERE log_line_id > ? AND log_line_id <= ?
+            ORDER BY log_line_id LIMIT ?
+            '''
+        rows = self._con.execute(
+            sql, (next_id, end_id, self.BATCH_SIZE)).fetchall()
+        if self.fts5:
+            sql = '''
+                INSERT INTO logs_search (rowid, message, subject, contact_name)
+                VALUES (?, ?, ?, ?)
+                '''
+            self._con.executemany(sql, [tuple(row) for row in rows])
+        else:
+            for row in rows:
+                self.add(row[0], row[1], row[2], row[3])
+
+        if len(rows) < self.BATCH_SIZE:
+            self._con.execute('DELETE FROM logs_search_backfill')
+            log.info('Search index backfill finished')
+            return False
+
+        self._con.execute('UPDATE logs_search_backfill SET next_id = ?',
+                          (rows[-1][0],))
+        return True
+
+    def add(self, log_line_id, message, subject, contact_name):
+        if self.fts5:
+            # Done by the logs_search_insert trigger
+            return
+
+        terms = self.get_terms(message, subject, contact_name)
+        self._con.executemany(
+            'INSERT OR IGNORE INTO logs_search_terms VALUES (?, ?)',
+            [(term, log_line_id) for term in terms])
+
+    def add_since(self, log_line_id):
+        """
+        Index all rows with a log_line_id greater than `log_line_id`
+        """
+        if self.fts5:
+            # Done by the logs_search_insert trigger
+            return
+
+        sql = '''
+            SELECT log_line_id, message, subject, contact_name FROM logs
+            WHERE log_line_id > ?
+            '''
+        for row in self._con.execute(sql, (log_line_id,)).fetchall():
+            self.add(row[0], row[1], row[2], row[3])
+
+    def remove(self, log_line_ids):
+        """
+        Remove rows from the index
+
+        :param log_line_ids:    A list of log_line_ids
+        """
+        if self.fts5:
+            # Done by the logs_search_delete trigger
+            return
+        sql = 'DELETE FROM logs_search_terms WHERE log_line_id = ?'
+        self._con.executemany(sql, [(id_,) for id_ in log_line_ids])
+
+    def remove_jid(self, jid_id):
+        """
+        Remove all rows of a jid from the index, this has to be called
+        before the rows are deleted from `logs`
+        """
+        if self.fts5:
+            # Done by the logs_search_delete trigger
+            return
+        sql = '''
+            DELETE FROM logs_search_terms WHERE log_line_id IN
+            (SELECT log_line_id FROM logs WHERE jid_id = ?)
+            '''
+        self._con.execute(sql, (jid_id,))
+
+    def get_search_sql(self, query):
+        """
+        Translate a search string into SQL fragments for a query on `logs`
+
+        returns (join, condition, rank, params) or None if the query
+        contains no searchable terms. `join` has to follow `FROM logs`,
+        `params` belong to `condition`. `rank` is the relevance of a row,
+        lower is better, the term table does not know it.
+        """
+        parsed = self.parse_query(query)
+        if not parsed:
+            return None
+
+        if self.fts5:
+            expression = []
+            for text, _is_phrase, is_prefix in parsed:
+                string = '"%s"' % text.replace('"', '""')
+                if is_prefix:
+                    string += ' *'
+                expression.append(string)
+            join = 'JOIN logs_search ON logs_search.rowid = logs.log_line_id'
+            return (join, 'logs_search MATCH ?', 'bm25(logs_search)',
+                    [' '.join(expression)])
+
+        conditions = []
+        params = []
+        for text, is_phrase, is_prefix in parsed:
+            terms = self.get_terms(text)
+            if not terms:
+                return None
+            if is_prefix:
+                # A prefix query is a single word, but \w+ may split it.
+                # Every part is a prefix of a term of the matching rows,
+                # the longest one finds the fewest rows
+                term = max(sorted(terms), key=len)
+                upper = term[:-1] + chr(ord(term[-1]) + 1)
+                conditions.append('''
+                    logs.log_line_id IN (
+                        SELECT log_line_id FROM logs_search_terms
+                        WHERE term >= ? AND term < ?)''')
+                params.extend((term, upper))
+                continue
+            for term in terms:
+                conditions.append('''
+                    logs.log_line_id IN (
+                        SELECT log_line_id FROM logs_search_terms
+                        WHERE term = ?)''')
+                params.append(term)
+            if is_phrase:
+                # The term table knows nothing about word order
+                conditions.append('''
+                    (logs.message LIKE '%' || ? || '%' OR
+                     logs.subject LIKE '%' || ? || '%')''')
+                params.extend((text, text))
+        return '', ' AND '.join(conditions), '0', params
+
+
 class Logger:
     def __init__(self):
         self._jid_ids = {}
+        self._stanza_ids = StanzaIdCache()
         self.con = None
+        self.search_index = None
+        self._search_backfill_id = None
         self.commit_timout_id = None
 
         if not os.path.exists(LOG_DB_PATH):
@@ -122,19 +530,7 @@ class Logger:
             return
         self.attach_cache_database()
 
-    @staticmethod
-    def namedtuple_factory(cursor, row):
-        """
-        Usage:
-        con.row_factory = namedtuple_factory
-        """
-        fields = [col[0] for col in cursor.description]
-        Row = namedtuple("Row", fields)
-        named_row = Row(*row)
-        if 'additional_data' in fields:
-            named_row = named_row._replace(
-                additional_data=json.loads(named_row.additional_data or '{}'))
-        return named_row
+    namedtuple_factory = RowFactory()
 
     def dispatch(self, event, error):
         app.ged.raise_event(event, None, str(error))
@@ -143,6 +539,7 @@ class Logger:
         if self.con:
             self.con.close()
         self.con = None
+        self._stanza_ids.clear()
         self.cur = None
 
     def open_db(self):
@@ -169,6 +566,8 @@ class Logger:
         self.cur = self.con.cursor()
         self.set_synchronous(False)
 
+        self.search_index = LogSearchIndex(self.con)
+
     def attach_cache_database(self):
         try:
             self.cur.execute("ATTACH DATABASE '%s' AS cache" % \
@@ -188,6 +587,54 @@ class Logger:
     def init_vars(self):
         self.open_db()
         self.get_jid_ids_from_db()
+        self.init_indexes()
+        self.init_search_index()
+
+    def init_indexes(self):
+        """
+        Create the indexes that databases of older versions miss
+        """
+        try:
+            # Stanza-id lookups always filter by account_id
+            self.con.executescript('''
+                DROP INDEX IF EXISTS idx_logs_stanza_id;
+                CREATE INDEX IF NOT EXISTS idx_logs_account_id_stanza_id
+                ON logs (account_id, stanza_id);
+                ''')
+        except sqlite.DatabaseError as error:
+            log.warning('Unable to create indexes: %s', error)
+
+    def init_search_index(self):
+        """
+        Create the full-text index if needed and start indexing the messages
+        that were logged before the index existed
+        """
+        try:
+            self.search_index.init_tables()
+        except sqlite.DatabaseError as error:
+            log.warning('Unable to create search index: %s', error)
+            return
+
+        if self._search_backfill_id is not None:
+            return
+        if self.search_index.backfill_pending():
+            log.info('Start search index backfill')
+            self._search_backfill_id = GLib.idle_add(
+                self._backfill_search_index)
+
+    def _backfill_search_index(self):
+        if self.con is None:
+            self._search_backfill_id = None
+            return False
+        try:
+            pending = self.search_index.backfill()
+        except sqlite.DatabaseError as error:
+            log.warning('Search index backfill failed: %s', error)
+            pending = False
+        self._timeout_commit()
+        if not pending:
+            self._search_backfill_id = None
+        return pending
 
     @staticmethod
     def _get_timeout():
@@ -321,7 +768,7 @@ class Logger:
 
         sql = 'INSERT INTO jids (jid, type) VALUES (?, ?)'
         lastrowid = self.con.execute(sql, (jid, type_)).lastrowid
-        Row = namedtuple('Row', 'jid_id jid type')
+        Row = self.namedtuple_factory.get_row_type(('jid_id', 'jid', 'type'))
         self._jid_ids[jid] = Row(lastrowid, jid, type_)
         self._timeout_commit()
         return lastrowid
@@ -566,7 +1013,7 @@ class Logger:
         jids = self._get_family_jids(account, jid)
 
         sql = '''
-            SELECT time, kind, message, subject, additional_data
+            SELECT log_line_id, time, kind, message, subject, additional_data
             FROM logs NATURAL JOIN jids WHERE jid IN ({jids}) AND
             kind IN ({kinds}) AND time > get_timeout()
             ORDER BY time DESC, log_line_id DESC LIMIT ? OFFSET ?
@@ -584,6 +1031,59 @@ class Logger:
         messages.reverse()
         return messages
 
+    def get_conversation_before(self, account, jid, timestamp, kinds, limit,
+                                log_line_id=None):
+        """
+        Get the messages logged before a message
+
+        Used to load lines again that the conversation textview removed.
+
+        :param account:     The account
+
+        :param jid:         The jid from which we request the conversation lines
+
+        :param timestamp:   The time of the message
+
+        :param kinds:       A list of KindConstant
+
+        :param limit:       How many messages are requested at most
+
+        :param log_line_id: The log_line_id of the message, messages with the
+                            same time and a lower log_line_id are returned
+                            too. If None only older messages are returned.
+
+        returns a list of namedtuples, the oldest message first
+        """
+        jids = self._get_family_jids(account, jid)
+
+        if log_line_id is None:
+            before = 'time < ?'
+            args = (timestamp,)
+        else:
+            before = '(time < ? OR (time = ? AND log_line_id < ?))'
+            args = (timestamp, timestamp, log_line_id)
+
+        sql = '''
+            SELECT log_line_id, contact_name, time, kind, message, subject,
+            additional_data
+            FROM logs NATURAL JOIN jids WHERE jid IN ({jids}) AND
+            kind IN ({kinds}) AND {before}
+            ORDER BY time DESC, log_line_id DESC LIMIT ?
+            '''.format(jids=', '.join('?' * len(jids)),
+                       kinds=', '.join(map(str, kinds)),
+                       before=before)
+
+        try:
+            messages = self.con.execute(
+                sql, tuple(jids) + args + (limit,)).fetchall()
+        except sqlite.DatabaseError:
+            self.dispatch('DB_ERROR',
+                          exceptions.DatabaseMalformed(LOG_DB_PATH))
+            return []
+
+        messages.reverse()
+        return messages
+
     def get_unix_time_from_date(self, year, month, day):
         # year (fe 2005), month (fe 11), day (fe 25)
         # returns time in seconds for the second that starts that date since epoch
@@ -625,14 +1125,25 @@ class Logger:
                                       (date.timestamp(),
                                       (date + delta).timestamp())).fetchall()
 
-    def search_log(self, account, jid, query, date=None):
+    def search_log(self, account, jid, query, date=None, after=0,
+                   limit=None):
         """
-        Search the conversation log for messages containing the `query` string.
+        Search the conversation log for messages matching the `query` string.
 
         The search can either span the complete log for the given
         `account` and `jid` or be restriced to a single day by
         specifying `date`.
 
+        The query uses the full-text index: words have to appear in the
+        message, subject or contact name, text in double quotes is searched
+        as a phrase and a trailing * makes a word a prefix. Until the index
+        is complete a substring search on the message is done instead.
+
+        Rows are fetched in pages of increasing log_line_id, use the highest
+        log_line_id of a page as `after` of the next one. Every page is
+        ordered by time, the `rank` column holds the relevance of a row (lower
+        is better).
+
         :param account: The account
 
         :param jid:     The jid for which we request the conversation
@@ -642,29 +1153,51 @@ class Logger:
         :param date:    datetime.datetime instance
                         example: datetime.datetime(year, month, day)
 
+        :param after:   Only return rows with a log_line_id greater than this
+
+        :param limit:   Maximum number of rows to return
+
         returns a list of namedtuples
         """
         jids = self._get_family_jids(account, jid)
 
+        search = None
+        if not self.search_index.backfill_pending():
+            search = self.search_index.get_search_sql(query)
+        if search is None:
+            join, condition, rank = '', 'logs.message LIKE like(?)', '0'
+            params = [query]
+        else:
+            join, condition, rank, params = search
+
+        between = ''
         if date:
             delta = datetime.timedelta(
                 hours=23, minutes=59, seconds=59, microseconds=999999)
 
             between = '''
-                AND time BETWEEN {start} AND {end}
+                AND logs.time BETWEEN {start} AND {end}
                 '''.format(start=date.timestamp(),
                            end=(date + delta).timestamp())
 
         sql = '''
-        SELECT contact_name, time, kind, show, message, subject,
-               additional_data, log_line_id
-        FROM logs NATURAL JOIN jids WHERE jid IN ({jids})
-        AND message LIKE like(?) {date_search}
+        SELECT * FROM (
+            SELECT logs.contact_name, logs.time, logs.kind, logs.show,
+                   logs.message, logs.subject, logs.additional_data,
+                   logs.log_line_id, {rank} AS rank
+            FROM logs {join} JOIN jids ON jids.jid_id = logs.jid_id
+            WHERE jids.jid IN ({jids}) AND {condition}
+            AND logs.log_line_id > ? {date_search}
+            ORDER BY logs.log_line_id LIMIT ?)
         ORDER BY time, log_line_id
         '''.format(jids=', '.join('?' * len(jids)),
-                   date_search=between if date else '')
+                   join=join,
+                   condition=condition,
+                   rank=rank,
+                   date_search=between)
 
-        return self.con.execute(sql, tuple(jids) + (query,)).fetchall()
+        return self.con.execute(sql, tuple(jids) + tuple(params) +
+                                     (after, limit or -1)).fetchall()
 
     def get_days_with_logs(self, account, jid, year, month):
         """
@@ -971,7 +1504,10 @@ class Logger:
         accout_name is the name of the account to change.
         roster_version is the version of the new roster.
         roster is the new version.
+
+        Only the differences to the stored roster are written.
         """
+        start = time.perf_counter()
         # First we must reset roster_version value to ensure that the server
         # sends back all the roster at the next connexion if the replacement
         # didn't work properly.
@@ -980,22 +1516,23 @@ class Logger:
         account_jid = app.get_jid_from_account(account_name)
         # Execute get_jid_id() because this ensures on new accounts that the
         # jid_id will be created
-        self.get_jid_id(account_jid, type_=JIDConstant.NORMAL_TYPE)
-
-        # Delete old roster
-        self.remove_roster(account_jid)
+        account_jid_id = self.get_jid_id(
+            account_jid, type_=JIDConstant.NORMAL_TYPE)
 
-        # Fill roster tables with the new roster
-        for jid in roster:
-            self.add_or_update_contact(account_jid, jid, roster[jid]['name'],
-                roster[jid]['subscription'], roster[jid]['ask'],
-                roster[jid]['groups'], commit=False)
+        stored = self._get_stored_roster(account_jid_id)
+        added, updated = self._write_roster(account_jid_id, roster, stored)
+        # Only contacts which are not in the new roster are left
+        self._delete_roster_entries(account_jid_id, stored)
         self._timeout_commit()
 
         # At this point, we are sure the replacement works properly so we can
         # set the new roster_version value.
         app.config.set_per('accounts', account_name, 'roster_version',
             roster_version)
+        log.info('Roster of %s replaced in %.3fs: %s contacts, %s added, '
+                 '%s updated, %s removed', account_name,
+                 time.perf_counter() - start, len(roster), added, updated,
+                 len(stored))
 
     def del_contact(self, account_jid, jid):
         """
@@ -1006,12 +1543,7 @@ class Logger:
             jid_id = self.get_jid_id(jid)
         except exceptions.PysqliteOperationalError as e:
             raise exceptions.PysqliteOperationalError(str(e))
-        self.cur.execute(
-                'DELETE FROM roster_group WHERE account_jid_id=? AND jid_id=?',
-                (account_jid_id, jid_id))
-        self.cur.execute(
-                'DELETE FROM roster_entry WHERE account_jid_id=? AND jid_id=?',
-                (account_jid_id, jid_id))
+        self._delete_roster_entries(account_jid_id, [jid_id])
         self._timeout_commit()
 
     def add_or_update_contact(self, account_jid, jid, name, sub, ask, groups,
@@ -1019,83 +1551,177 @@ class Logger:
         """
         Add or update a contact from account_jid roster
         """
-        if sub == 'remove':
-            self.del_contact(account_jid, jid)
-            return
+        self.add_or_update_contacts(account_jid, {jid: {
+            'name': name,
+            'subscription': sub,
+            'ask': ask,
+            'groups': groups}}, commit=commit)
 
+    def add_or_update_contacts(self, account_jid, roster, commit=True):
+        """
+        Add, update or remove contacts from account_jid roster
+
+        :param roster:  dict of jid: {'name', 'subscription', 'ask', 'groups'}
+                        like in replace_roster(). Contacts with the
+                        subscription 'remove' are removed.
+        """
+        start = time.perf_counter()
         try:
             account_jid_id = self.get_jid_id(account_jid)
-            jid_id = self.get_jid_id(jid, type_=JIDConstant.NORMAL_TYPE)
         except exceptions.PysqliteOperationalError as e:
             raise exceptions.PysqliteOperationalError(str(e))
 
-        # Update groups information
-        # First we delete all previous groups information
-        self.cur.execute(
-                'DELETE FROM roster_group WHERE account_jid_id=? AND jid_id=?',
-                (account_jid_id, jid_id))
-        # Then we add all new groups information
-        for group in groups:
-            self.cur.execute('INSERT INTO roster_group VALUES(?, ?, ?)',
-                    (account_jid_id, jid_id, group))
-
-        if name is None:
-            name = ''
+        removed = []
+        contacts = {}
+        for jid, item in roster.items():
+            if item['subscription'] == 'remove':
+                removed.append(self.get_jid_id(jid))
+            else:
+                contacts[jid] = item
 
-        self.cur.execute('''
-            REPLACE INTO roster_entry
-            (account_jid_id, jid_id, name, subscription, ask)
-            VALUES(?, ?, ?, ?, ?)''', (
-                account_jid_id, jid_id, name,
-                self.convert_human_subscription_values_to_db_api_values(sub),
-                bool(ask)))
+        jid_ids = [self.get_jid_id(jid, type_=JIDConstant.NORMAL_TYPE)
+                   for jid in contacts]
+        stored = self._get_stored_roster(account_jid_id, jid_ids)
+        added, updated = self._write_roster(account_jid_id, contacts, stored)
+        self._delete_roster_entries(account_jid_id, removed)
         if commit:
             self._timeout_commit()
+        log.debug('Roster of %s updated in %.3fs: %s added, %s updated, '
+                  '%s removed', account_jid, time.perf_counter() - start,
+                  added, updated, len(removed))
+
+    def _get_stored_roster(self, account_jid_id, jid_ids=None):
+        """
+        Return a dict of jid_id: (name, subscription, ask, groups) with the
+        roster entries of an account, or only the ones in jid_ids
+        """
+        sql = '''
+            SELECT re.jid_id, re.name, re.subscription, re.ask, rg.group_name
+            FROM roster_entry re
+            LEFT JOIN roster_group rg
+            ON rg.account_jid_id = re.account_jid_id AND rg.jid_id = re.jid_id
+            WHERE re.account_jid_id = ?'''
+        if jid_ids is None:
+            rows = self.con.execute(sql, (account_jid_id,)).fetchall()
+        else:
+            rows = []
+            # Stay below the SQLite limit for host parameters
+            for start in range(0, len(jid_ids), 500):
+                chunk = jid_ids[start:start + 500]
+                rows += self.con.execute(
+                    sql + ' AND re.jid_id IN ({values})'.format(
+                        values=', '.join('?' * len(chunk))),
+                    (account_jid_id,) + tuple(chunk)).fetchall()
+
+        stored = {}
+        for row in rows:
+            entry = stored.get(row.jid_id)
+            if entry is None:
+                entry = (row.name or '', row.subscription, bool(row.ask),
+                         set())
+                stored[row.jid_id] = entry
+            if row.group_name is not None:
+                entry[3].add(row.group_name)
+        return stored
+
+    def _write_roster(self, account_jid_id, roster, stored):
+        """
+        Write the differences between roster and the stored roster
+
+        The entries of roster are removed from stored.
+        Return the number of added and updated contacts.
+        """
+        new_entries = []
+        changed_entries = []
+        new_groups = []
+        old_groups = []
+        for jid, item in roster.items():
+            jid_id = self.get_jid_id(jid, type_=JIDConstant.NORMAL_TYPE)
+            entry = (item['name'] or '',
+                     self.convert_human_subscription_values_to_db_api_values(
+                         item['subscription']),
+                     bool(item['ask']))
+            groups = set(item['groups'])
+
+            stored_entry = stored.pop(jid_id, None)
+            if stored_entry is None:
+                new_entries.append((account_jid_id, jid_id) + entry)
+                stored_groups = set()
+            else:
+                if stored_entry[:3] != entry:
+                    changed_entries.append(entry + (account_jid_id, jid_id))
+                stored_groups = stored_entry[3]
+
+            new_groups.extend((account_jid_id, jid_id, group)
+                              for group in groups - stored_groups)
+            old_groups.extend((account_jid_id, jid_id, group)
+                              for group in stored_groups - groups)
+
+        self.con.executemany('''
+            INSERT INTO roster_entry
+            (account_jid_id, jid_id, name, subscription, ask)
+            VALUES(?, ?, ?, ?, ?)''', new_entries)
+        self.con.executemany('''
+            UPDATE roster_entry SET name = ?, subscription = ?, ask = ?
+            WHERE account_jid_id = ? AND jid_id = ?''', changed_entries)
+        self.con.executemany('''
+            DELETE FROM roster_group
+            WHERE account_jid_id = ? AND jid_id = ? AND group_name = ?''',
+            old_groups)
+        self.con.executemany(
+            'INSERT INTO roster_group VALUES(?, ?, ?)', new_groups)
+        return len(new_entries), len(changed_entries)
+
+    def _delete_roster_entries(self, account_jid_id, jid_ids):
+        params = [(account_jid_id, jid_id) for jid_id in jid_ids]
+        self.con.executemany(
+            'DELETE FROM roster_group WHERE account_jid_id=? AND jid_id=?',
+            params)
+        self.con.executemany(
+            'DELETE FROM roster_entry WHERE account_jid_id=? AND jid_id=?',
+            params)
 
     def get_roster(self, account_jid):
         """
         Return the accound_jid roster in NonBlockingRoster format
         """
+        start = time.perf_counter()
         data = {}
         account_jid_id = self.get_jid_id(account_jid, type_=JIDConstant.NORMAL_TYPE)
 
-        # First we fill data with roster_entry informations
-        self.cur.execute('''
-                SELECT j.jid, re.jid_id, re.name, re.subscription, re.ask, re.avatar_sha
-                FROM roster_entry re, jids j
-                WHERE re.account_jid_id=? AND j.jid_id=re.jid_id''', (account_jid_id,))
-        for row in self.cur:
-            #jid, jid_id, name, subscription, ask
-            jid = row.jid
-            name = row.name
-            data[jid] = {}
-            data[jid]['avatar_sha'] = row.avatar_sha
-            if name:
-                data[jid]['name'] = name
-            else:
-                data[jid]['name'] = None
-            data[jid]['subscription'] = \
-                    self.convert_db_api_values_to_human_subscription_values(
-                    row.subscription)
-            data[jid]['groups'] = []
-            data[jid]['resources'] = {}
-            if row.ask:
-                data[jid]['ask'] = 'subscribe'
-            else:
-                data[jid]['ask'] = None
-            data[jid]['id'] = row.jid_id
-
-        # Then we add group for roster entries
-        for jid in data:
-            self.cur.execute('''
-                    SELECT group_name FROM roster_group
-                    WHERE account_jid_id=? AND jid_id=?''',
-                    (account_jid_id, data[jid]['id']))
-            for row in self.cur:
-                group_name = row.group_name
-                data[jid]['groups'].append(group_name)
-            del data[jid]['id']
-
+        # Entries with more than one group are returned once per group
+        rows = self.con.execute('''
+                SELECT j.jid, re.name, re.subscription, re.ask, re.avatar_sha,
+                       rg.group_name
+                FROM roster_entry re
+                JOIN jids j ON j.jid_id = re.jid_id
+                LEFT JOIN roster_group rg
+                ON rg.account_jid_id = re.account_jid_id
+                AND rg.jid_id = re.jid_id
+                WHERE re.account_jid_id=?''', (account_jid_id,))
+        convert = self.convert_db_api_values_to_human_subscription_values
+        subscriptions = {}
+        for row in rows:
+            item = data.get(row.jid)
+            if item is None:
+                subscription = subscriptions.get(row.subscription)
+                if subscription is None:
+                    subscription = convert(row.subscription)
+                    subscriptions[row.subscription] = subscription
+                item = {
+                    'avatar_sha': row.avatar_sha,
+                    'name': row.name or None,
+                    'subscription': subscription,
+                    'groups': [],
+                    'resources': {},
+                    'ask': 'subscribe' if row.ask else None,
+                }
+                data[row.jid] = item
+            if row.group_name is not None:
+                item['groups'].append(row.group_name)
+
+        log.info('Roster of %s loaded in %.3fs: %s contacts', account_jid,
+                 time.perf_counter() - start, len(data))
         return data
 
     def remove_roster(self, account_jid):
@@ -1184,6 +1810,13 @@ class Logger:
         archive_id = self.get_jid_id(archive_jid)
         account_id = self.get_account_id(account)
 
+        archive = (account_id, archive_id if groupchat else None)
+        if self._stanza_ids.contains(archive, ids):
+            log.info('Found duplicated message in cache, stanza-id: %s, '
+                     'origin-id: %s, archive-jid: %s, account: %s',
+                     stanza_id, origin_id, archive_jid, account_id)
+            return True
+
         if groupchat:
             # Stanza ID is only unique within a specific archive.
             # So a Stanza ID could be repeated in different MUCs, so we
@@ -1206,6 +1839,7 @@ class Logger:
         if result is not None:
             log.info('Found duplicated message, stanza-id: %s, origin-id: %s, '
                      'archive-jid: %s, account: %s', stanza_id, origin_id, archive_jid, account_id)
+            self._stanza_ids.add(archive, result.stanza_id)
             return True
         return False
 
@@ -1257,9 +1891,22 @@ class Logger:
         lastrowid = self.con.execute(
             sql, (account_id, jid_id, time_, kind) + tuple(kwargs.values())).lastrowid
 
+        if any(kwargs.get(key) for key in ('message', 'subject', 'contact_name')):
+            self.search_index.add(lastrowid,
+                                  kwargs.get('message'),
+                                  kwargs.get('subject'),
+                                  kwargs.get('contact_name'))
+
         log.info('Insert into DB: jid: %s, time: %s, kind: %s, stanza_id: %s',
                  jid, time_, kind, kwargs.get('stanza_id', None))
 
+        if kwargs.get('stanza_id'):
+            if kind == KindConstant.GC_MSG:
+                archive = (account_id, jid_id)
+            else:
+                archive = (account_id, None)
+            self._stanza_ids.add(archive, kwargs['stanza_id'])
+
         if unread and kind == KindConstant.CHAT_MSG_RECV:
             sql = '''INSERT INTO unread_messages (message_id, jid_id)
                      VALUES (?, (SELECT jid_id FROM jids WHERE jid = ?))'''
@@ -1269,6 +1916,107 @@ class Logger:
 
         return lastrowid
 
+    def insert_many_into_logs(self, account, messages):
+        """
+        Insert messages into the `logs` table with one statement
+
+        Messages with a stanza-id that is already in the database or that
+        appears twice in `messages` are skipped. No message is added to the
+        `unread_messages` table.
+
+        :param account:     The account
+
+        :param messages:    A list of dicts with the keys jid, time, kind,
+                            message, contact_name, additional_data and
+                            stanza_id
+
+        returns the number of inserted messages
+        """
+        if not messages:
+            return 0
+
+        account_id = self.get_account_id(account)
+
+        # Group stanza-ids by archive, see find_stanza_id()
+        archives = {}
+        for msg in messages:
+            msg['jid_id'] = self.get_jid_id(msg['jid'], kind=msg['kind'])
+            if msg['kind'] == KindConstant.GC_MSG:
+                msg['archive'] = (account_id, msg['jid_id'])
+            else:
+                msg['archive'] = (account_id, None)
+            if msg['stanza_id'] is not None:
+                archives.setdefault(msg['archive'], set()).add(msg['stanza_id'])
+
+        known = set()
+        for archive, stanza_ids in archives.items():
+            known.update((archive, stanza_id) for stanza_id in
+                         self._get_known_stanza_ids(archive, stanza_ids))
+
+        rows = []
+        for msg in messages:
+            stanza_id = msg['stanza_id']
+            if stanza_id is not None:
+                if (msg['archive'], stanza_id) in known:
+                    log.info('Skip duplicated message, stanza-id: %s',
+                             stanza_id)
+                    continue
+                known.add((msg['archive'], stanza_id))
+                self._stanza_ids.add(msg['archive'], stanza_id)
+
+            additional_data = msg['additional_data']
+            if additional_data:
+                additional_data = json.dumps(additional_data)
+            else:
+                additional_data = None
+            rows.append((account_id, msg['jid_id'], msg['time'], msg['kind'],
+                         msg['message'], msg['contact_name'], additional_data,
+                         stanza_id))
+
+        last_id = self.con.execute(
+            'SELECT MAX(log_line_id) AS id FROM logs').fetchone().id
+
+        sql = '''
+            INSERT INTO logs (account_id, jid_id, time, kind, message,
+                              contact_name, additional_data, stanza_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            '''
+        self.con.executemany(sql, rows)
+        self.search_index.add_since(last_id or 0)
+        self._timeout_commit()
+
+        log.info('Insert %s messages into DB, %s duplicates skipped',
+                 len(rows), len(messages) - len(rows))
+        return len(rows)
+
+    def _get_known_stanza_ids(self, archive, stanza_ids):
+        """
+        Return the subset of `stanza_ids` which is already in the archive
+        """
+        account_id, archive_id = archive
+        stanza_ids = list(stanza_ids)
+        known = set()
+        # Stay below the SQLite limit for host parameters
+        for start in range(0, len(stanza_ids), 500):
+            chunk = stanza_ids[start:start + 500]
+            if archive_id is not None:
+                sql = '''
+                    SELECT stanza_id FROM logs
+                    WHERE stanza_id IN ({values})
+                    AND jid_id = ? AND account_id = ?
+                    '''.format(values=', '.join('?' * len(chunk)))
+                params = tuple(chunk) + (archive_id, account_id)
+            else:
+                sql = '''
+                    SELECT stanza_id FROM logs
+                    WHERE stanza_id IN ({values})
+                    AND account_id = ? AND kind != ?
+                    '''.format(values=', '.join('?' * len(chunk)))
+                params = tuple(chunk) + (account_id, KindConstant.GC_MSG)
+            rows = self.con.execute(sql, params).fetchall()
+            known.update(row.stanza_id for row in rows)
+        return known
+
     def set_avatar_sha(self, account_jid, jid, sha=None):
         """
         Set the avatar sha of a jid on an account
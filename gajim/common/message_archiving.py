@@ -18,7 +18,9 @@
 ## along with Gajim. If not, see <http://www.gnu.org/licenses/>.
 ##
 
+import time
 import logging
+from collections import deque
 from datetime import datetime, timedelta
 
 import nbxmpp
@@ -33,13 +35,29 @@ import gajim.common.connection_handlers_events as ev
 
 log = logging.getLogger('gajim.c.message_archiving')
 
+# If a page arrives faster than this (in seconds) the next page is
+# requested with twice the size, if it takes twice as long the size is halved
+MAM_TARGET_RTT = 1.0
+MAM_MIN_PAGE_SIZE = 10
+
 
 class ConnectionArchive313:
     def __init__(self):
         self.archiving_313_supported = False
         self.mam_awaiting_disco_result = {}
         self.iq_answer = []
-        self.mam_query_ids = []
+        self.mam_query_ids = MamQueryTracker()
+        # Page size per archive jid, adapted after every page
+        self._mam_page_sizes = {}
+        # Highest page size a server returned per archive jid
+        self._mam_server_limits = {}
+        # Groupchat archives which are currently synced and the ones
+        # waiting for a free slot
+        self._mam_running_archives = set()
+        self._mam_queued_archives = deque()
+        # Messages of the current RSM page per query id, they are
+        # written to the DB when the page is finished
+        self._mam_buffer = {}
         app.nec.register_incoming_event(ev.MamMessageReceivedEvent)
         app.nec.register_incoming_event(ev.MamGcMessageReceivedEvent)
         app.ged.register_event_handler('agent-info-error-received', ged.CORE,
@@ -52,7 +70,20 @@ class ConnectionArchive313:
             'archiving-313-preferences-changed-received', ged.CORE,
             self._nec_archiving_313_preferences_changed_received)
 
+    def reset_mam_queries(self):
+        """
+        Forget all running queries, called on disconnect as no results
+        will arrive for them anymore
+        """
+        for query_id in list(self._mam_buffer):
+            self._flush_mam_buffer(query_id)
+        self.mam_query_ids = MamQueryTracker()
+        self._mam_running_archives.clear()
+        self._mam_queued_archives.clear()
+
     def cleanup(self):
+        for query_id in list(self._mam_buffer):
+            self._flush_mam_buffer(query_id)
         app.ged.remove_event_handler('agent-info-error-received', ged.CORE,
             self._nec_agent_info_error)
         app.ged.remove_event_handler('agent-info-received', ged.CORE,
@@ -124,42 +155,94 @@ class ConnectionArchive313:
             jid = jid.getStripped()
         return jid
 
+    def _flush_mam_buffer(self, query_id):
+        messages = self._mam_buffer.pop(query_id, None)
+        if messages:
+            app.logger.insert_many_into_logs(self.name, messages)
+
     def _result_finished(self, conn, stanza, query_id, start_date, groupchat):
+        self._flush_mam_buffer(query_id)
+        query = self.mam_query_ids.remove(query_id)
         try:
             fin, set_ = self.parse_iq(stanza)
         except InvalidMamIQ:
+            self._archive_finished(query, groupchat)
             return
 
         last = set_.getTagData('last')
         if last is None:
             log.info('End of MAM query, no items retrieved')
+            self._archive_finished(query, groupchat)
             return
 
         jid = self.parse_from_jid(stanza)
         complete = fin.getAttr('complete')
         app.logger.set_archive_timestamp(jid, last_mam_id=last)
         if complete != 'true':
-            self.mam_query_ids.remove(query_id)
+            self._adapt_page_size(jid, query)
             query_id = self.get_query_id()
-            query = self.get_archive_query(query_id, jid=jid, after=last)
+            query = self.get_archive_query(query_id, jid=jid, after=last,
+                                           max_=self.get_page_size(jid))
             self._send_archive_query(query, query_id, groupchat=groupchat)
         else:
-            self.mam_query_ids.remove(query_id)
             if start_date is not None:
                 app.logger.set_archive_timestamp(
                     jid,
                     last_mam_id=last,
                     oldest_mam_timestamp=start_date.timestamp())
             log.info('End of MAM query, last mam id: %s', last)
+            self._archive_finished(query, groupchat)
+
+    def get_page_size(self, jid):
+        return self._mam_page_sizes.get(jid, app.config.get('mam_page_size'))
+
+    def _adapt_page_size(self, jid, query):
+        """
+        Compute the size of the next page of an archive from the round trip
+        time of the last incomplete page
+        """
+        if query is None or not query.max:
+            return
+
+        if query.messages < query.max:
+            # The page is not complete, but the server sent less than we
+            # asked for, so this is the limit of the server
+            self._mam_server_limits[jid] = max(query.messages,
+                                               MAM_MIN_PAGE_SIZE)
+
+        size = query.max
+        if query.rtt < MAM_TARGET_RTT and query.messages >= query.max:
+            size *= 2
+        elif query.rtt > 2 * MAM_TARGET_RTT:
+            size //= 2
+
+        limit = min(app.config.get('mam_max_page_size'),
+                    self._mam_server_limits.get(jid, size))
+        size = max(min(size, limit), MAM_MIN_PAGE_SIZE)
+        if size != query.max:
+            log.info('MAM page size for %s: %s (rtt: %.2fs)',
+                     jid, size, query.rtt)
+        self._mam_page_sizes[jid] = size
+
+    def _archive_finished(self, query, groupchat):
+        if not groupchat or query is None:
+            return
+        self._mam_running_archives.discard(query.jid)
+        while self._mam_queued_archives:
+            jid = self._mam_queued_archives.popleft()
+            if app.in_groupchat(self.name, jid):
+                self._request_muc_archive(jid)
+                break
 
     def _intervall_result_finished(self, conn, stanza, query_id,
                                    start_date, end_date, event_id):
+        self._flush_mam_buffer(query_id)
         try:
             fin, set_ = self.parse_iq(stanza)
         except InvalidMamIQ:
             return
 
-        self.mam_query_ids.remove(query_id)
+        query = self.mam_query_ids.remove(query_id)
         jid = self.parse_from_jid(stanza)
         if start_date:
             timestamp = start_date.timestamp()
@@ -177,6 +260,7 @@ class ConnectionArchive313:
 
         complete = fin.getAttr('complete')
         if complete != 'true':
+            self._adapt_page_size(jid, query)
             self.request_archive_interval(event_id, start_date, end_date, last)
         else:
             log.info('query finished')
@@ -216,6 +300,22 @@ class ConnectionArchive313:
                 # dont propagate the event further
                 return True
 
+        query_id = obj.result.getAttr('queryid')
+        if query_id in self.mam_query_ids:
+            # Written together with the rest of the page, see
+            # _flush_mam_buffer()
+            self._mam_buffer.setdefault(query_id, []).append({
+                'jid': obj.with_,
+                'time': obj.timestamp,
+                'kind': obj.kind,
+                'message': obj.msgtxt,
+                'contact_name': obj.nick,
+                'additional_data': obj.additional_data,
+                'stanza_id': obj.unique_id})
+            return
+
+        # The query is already finished, this happens if the message
+        # had to wait for a disco result
         app.logger.insert_into_logs(self.name,
                                     obj.with_,
                                     obj.timestamp,
@@ -228,7 +328,7 @@ class ConnectionArchive313:
 
     def get_query_id(self):
         query_id = self.connection.getAnID()
-        self.mam_query_ids.append(query_id)
+        self.mam_query_ids.add(query_id)
         return query_id
 
     def request_archive_on_signin(self):
@@ -245,15 +345,29 @@ class ConnectionArchive313:
         query_id = self.get_query_id()
         if mam_id:
             log.info('MAM query after: %s', mam_id)
-            query = self.get_archive_query(query_id, after=mam_id)
+            query = self.get_archive_query(query_id, after=mam_id,
+                                           max_=self.get_page_size(own_jid))
         else:
             # First Start, we request the last week
             start_date = datetime.utcnow() - timedelta(days=7)
             log.info('First start: query archive start: %s', start_date)
-            query = self.get_archive_query(query_id, start=start_date)
+            query = self.get_archive_query(query_id, start=start_date,
+                                           max_=self.get_page_size(own_jid))
         self._send_archive_query(query, query_id, start_date)
 
     def request_archive_on_muc_join(self, jid):
+        if jid in self._mam_running_archives:
+            return
+        limit = app.config.get('mam_max_parallel_queries')
+        if limit > 0 and len(self._mam_running_archives) >= limit:
+            if jid not in self._mam_queued_archives:
+                log.info('Queue MAM query for %s', jid)
+                self._mam_queued_archives.append(jid)
+            return
+        self._request_muc_archive(jid)
+
+    def _request_muc_archive(self, jid):
+        self._mam_running_archives.add(jid)
         archive = app.logger.get_archive_timestamp(
             jid, type_=JIDConstant.ROOM_TYPE)
         query_id = self.get_query_id()
@@ -262,14 +376,16 @@ class ConnectionArchive313:
             log.info('Query Groupchat MAM Archive %s after %s:',
                      jid, archive.last_mam_id)
             query = self.get_archive_query(
-                query_id, jid=jid, after=archive.last_mam_id)
+                query_id, jid=jid, after=archive.last_mam_id,
+                max_=self.get_page_size(jid))
         else:
             # First Start, we dont request history
             # Depending on what a MUC saves, there could be thousands
             # of Messages even in just one day.
             start_date = datetime.utcnow() - timedelta(days=1)
             log.info('First join: query archive %s from: %s', jid, start_date)
-            query = self.get_archive_query(query_id, jid=jid, start=start_date)
+            query = self.get_archive_query(query_id, jid=jid, start=start_date,
+                                           max_=self.get_page_size(jid))
         self._send_archive_query(query, query_id, start_date, groupchat=True)
 
     def request_archive_count(self, event_id, start_date, end_date):
@@ -282,9 +398,11 @@ class ConnectionArchive313:
 
     def request_archive_interval(self, event_id, start_date,
                                  end_date, after=None):
+        own_jid = self.get_own_jid().getStripped()
         query_id = self.get_query_id()
         query = self.get_archive_query(query_id, start=start_date,
-                                       end=end_date, after=after, max_=30)
+                                       end=end_date, after=after,
+                                       max_=self.get_page_size(own_jid))
         app.nec.push_incoming_event(ev.ArchivingQueryID(
             None, event_id=event_id, query_id=query_id))
         self.connection.SendAndCallForResponse(
@@ -301,7 +419,9 @@ class ConnectionArchive313:
                                            'groupchat': groupchat})
 
     def get_archive_query(self, query_id, jid=None, start=None, end=None, with_=None,
-                          after=None, max_=30):
+                          after=None, max_=None):
+        if max_ is None:
+            max_ = self.get_page_size(jid or self.get_own_jid().getStripped())
         # Muc archive query?
         namespace = muc_caps_cache.get_mam_namespace(jid)
         if namespace is None:
@@ -329,6 +449,8 @@ class ConnectionArchive313:
             field = nbxmpp.DataField(typ='jid-single', name='with', value=with_)
             form.addChild(node=field)
 
+        self.mam_query_ids.set_page(query_id, jid, max_)
+
         set_ = query.setTag('set', namespace=nbxmpp.NS_RSM)
         set_.setTagData('max', max_)
         if after:
@@ -369,5 +491,72 @@ class ConnectionArchive313:
         raise nbxmpp.NodeProcessed
 
 
+class MamQuery:
+    """
+    Timing statistics of a single MAM query (one RSM page)
+    """
+
+    def __init__(self, query_id):
+        self.query_id = query_id
+        self.jid = None
+        self.max = None
+        self.messages = 0
+        self.start = time.monotonic()
+        self.end = None
+
+    @property
+    def rtt(self):
+        end = self.end if self.end is not None else time.monotonic()
+        return end - self.start
+
+
+class MamQueryTracker:
+    """
+    Set of the ids of all running MAM queries, with timing statistics
+    for every query
+
+    The statistics of the last finished queries are kept in `finished`.
+    """
+
+    def __init__(self, history=100):
+        self._queries = {}
+        self.finished = deque(maxlen=history)
+
+    def __contains__(self, query_id):
+        return query_id in self._queries
+
+    def __len__(self):
+        return len(self._queries)
+
+    def add(self, query_id):
+        self._queries[query_id] = MamQuery(query_id)
+
+    def set_page(self, query_id, jid, max_):
+        query = self._queries.get(query_id)
+        if query is None:
+            return
+        query.jid = jid
+        query.max = max_
+        query.start = time.monotonic()
+
+    def message_received(self, query_id):
+        query = self._queries.get(query_id)
+        if query is not None:
+            query.messages += 1
+
+    def remove(self, query_id):
+        """
+        Remove a query and return its statistics, None if it is unknown
+        """
+        query = self._queries.pop(query_id, None)
+        if query is None:
+            return None
+        query.end = time.monotonic()
+        self.finished.append(query)
+        log.info('MAM query %s (%s) finished: %s messages in %.2fs',
+                 query_id, query.jid, query.messages, query.rtt)
+        return query
+
+
 class InvalidMamIQ(Exception):
     pass
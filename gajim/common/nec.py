@@ -25,6 +25,8 @@ Network Events Controller.
 :license: GPL
 '''
 
+import time
+
 #from plugins.helpers import log
 from gajim.common import app
 
@@ -70,14 +72,28 @@ class NetworkEventsController(object):
                 self.outgoing_events_generators[base_event_name].remove(
                     event_class)
 
+    @staticmethod
+    def _generate(event_object):
+        if not app.ged.profiling:
+            return event_object.generate()
+        start = time.perf_counter()
+        try:
+            return event_object.generate()
+        finally:
+            app.ged.record(event_object.name,
+                type(event_object).__qualname__ + '.generate',
+                time.perf_counter() - start)
+
     def push_incoming_event(self, event_object):
-        if event_object.generate():
-            if not app.ged.raise_event(event_object.name, event_object):
+        if self._generate(event_object):
+            if not app.ged.raise_event(event_object.name, event_object,
+            key=event_object.get_routing_key()):
                 self._generate_events_based_on_incoming_event(event_object)
 
     def push_outgoing_event(self, event_object):
-        if event_object.generate():
-            if not app.ged.raise_event(event_object.name, event_object):
+        if self._generate(event_object):
+            if not app.ged.raise_event(event_object.name, event_object,
+            key=event_object.get_routing_key()):
                 self._generate_events_based_on_outgoing_event(event_object)
 
     def _generate_events_based_on_incoming_event(self, event_object):
@@ -95,9 +111,9 @@ class NetworkEventsController(object):
             base_event_name]:
                 new_event_object = new_event_class(None,
                     base_event=event_object)
-                if new_event_object.generate():
+                if self._generate(new_event_object):
                     if not app.ged.raise_event(new_event_object.name,
-                    new_event_object):
+                    new_event_object, key=new_event_object.get_routing_key()):
                         self._generate_events_based_on_incoming_event(
                             new_event_object)
 
@@ -116,9 +132,9 @@ class NetworkEventsController(object):
             base_event_name]:
                 new_event_object = new_event_class(None,
                     base_event=event_object)
-                if new_event_object.generate():
+                if self._generate(new_event_object):
                     if not app.ged.raise_event(new_event_object.name,
-                    new_event_object):
+                    new_event_object, key=new_event_object.get_routing_key()):
                         self._generate_events_based_on_outgoing_event(
                             new_event_object)
 
@@ -152,6 +168,14 @@ class NetworkEvent(object):
         '''
         return True
 
+    def get_routing_key(self):
+        '''
+        :return: (account, jid) of the conversation the event is about. Only
+        the handlers registered for that key or without key get the event.
+        None sends it to all handlers.
+        '''
+        return None
+
     def _set_kwargs_as_attributes(self, **kwargs):
         for k, v in kwargs.items():
             if k not in ('name', 'base_network_events'):
@@ -44,6 +44,10 @@ from gajim.common.socks5 import Socks5SenderClient
 import logging
 log = logging.getLogger('gajim.c.p.bytestream')
 
+# XEP-0047 limits of the block size
+IBB_MIN_BLOCK_SIZE = 4096
+IBB_MAX_BLOCK_SIZE = 65535
+
 def is_transfer_paused(file_props):
     if file_props.stopped:
         return False
@@ -334,8 +338,8 @@ class ConnectionSocks5Bytestream(ConnectionBytestream):
     def disconnect_transfer(self, file_props):
         if file_props is None:
             return
-        if file_props.hash_:
-            app.socks5queue.remove_sender(file_props.hash_)
+        if file_props.socks5_idx:
+            app.socks5queue.remove_sender(file_props.socks5_idx)
 
         if file_props.streamhosts:
             for host in file_props.streamhosts:
@@ -554,7 +558,7 @@ class ConnectionSocks5Bytestream(ConnectionBytestream):
         Store the result of SHA message from auth
         """
         file_props = FilesProp.getFilePropBySid(sid)
-        file_props.hash_ = hash_id
+        file_props.socks5_idx = hash_id
         return
 
     def _connect_error(self, sid, error, error_type, msg=None):
@@ -763,6 +767,8 @@ class ConnectionIBBytestream(ConnectionBytestream):
     def __init__(self):
         ConnectionBytestream.__init__(self)
         self._streams = {}
+        # {iq id: file_props} of the IBB open and data iqs we sent
+        self._ibb_iq_ids = {}
 
     def IBBIqHandler(self, conn, stanza):
         """
@@ -808,6 +814,8 @@ class ConnectionIBBytestream(ConnectionBytestream):
             err = nbxmpp.ERR_BAD_REQUEST
         if not sid or not blocksize:
             err = nbxmpp.ERR_BAD_REQUEST
+        elif blocksize > IBB_MAX_BLOCK_SIZE:
+            err = nbxmpp.ERR_RESOURCE_CONSTRAINT
         elif not file_props:
             err = nbxmpp.ERR_UNEXPECTED_REQUEST
         if err:
@@ -829,12 +837,21 @@ class ConnectionIBBytestream(ConnectionBytestream):
             file_props.continue_cb = None
             file_props.syn_id = stanza.getID()
             file_props.fp = open(file_props.file_name, 'wb')
+            file_props.start_hash()
         conn.send(rep)
 
     def CloseIBBStream(self, file_props):
         file_props.connected = False
         file_props.fp.close()
         file_props.stopped = True
+        self._forget_ibb_iqs(file_props)
+        if file_props.direction == '>':
+            log.info('IBB stream %s closed: %s bytes in %.1fs (%.1f KiB/s), '
+                '%s blocks acknowledged in %.3fs on average',
+                file_props.transport_sid, file_props.received_len,
+                file_props.elapsed_time, file_props.get_throughput() / 1024,
+                file_props.ibb_acked, file_props.ibb_round_trip_time / \
+                max(file_props.ibb_acked, 1))
         to = file_props.receiver
         if file_props.direction == '<':
             to = file_props.sender
@@ -853,17 +870,27 @@ class ConnectionIBBytestream(ConnectionBytestream):
             if session.weinitiate:
                 session.cancel_session()
 
-    def OpenStream(self, sid, to, fp, blocksize=4096):
+    def _forget_ibb_iqs(self, file_props):
+        """
+        Ignore the replies to the iqs of a stream that is closed or failed
+        """
+        for id_ in file_props.ibb_pending:
+            self._ibb_iq_ids.pop(id_, None)
+        file_props.ibb_pending.clear()
+        self._ibb_iq_ids.pop(file_props.syn_id, None)
+
+    def OpenStream(self, sid, to, fp, blocksize=None):
         """
         Start new stream. You should provide stream id 'sid', the endpoind jid
         'to', the file object containing info for send 'fp'. Also the desired
-        blocksize can be specified.
+        blocksize can be specified, ibb_block_size is used by default.
         Take into account that recommended stanza size is 4k and IBB uses
         base64 encoding that increases size of data by 1/3.
         """
+        if blocksize is None:
+            blocksize = app.config.get('ibb_block_size')
         file_props = FilesProp.getFilePropBySid(sid)
         file_props.direction = '>'
-        file_props.block_size = blocksize
         file_props.fp = fp
         file_props.seq = 0
         file_props.error = 0
@@ -874,27 +901,48 @@ class ConnectionIBBytestream(ConnectionBytestream):
         file_props.completed = False
         file_props.disconnect_cb = None
         file_props.continue_cb = None
+        file_props.ibb_pending = {}
+        file_props.ibb_acked = 0
+        file_props.ibb_round_trip_time = 0.0
+        file_props.start_hash(fp.tell())
+        self._send_ibb_open(file_props, to, blocksize)
+        return file_props
+
+    def _send_ibb_open(self, file_props, to, blocksize):
+        file_props.block_size = blocksize
+        # Blocks are read into this buffer, see SendHandler()
+        file_props.ibb_buffer = bytearray(blocksize)
         syn = nbxmpp.Protocol('iq', to, 'set', payload=[nbxmpp.Node(
             nbxmpp.NS_IBB + ' open', {'sid': file_props.transport_sid,
             'block-size': blocksize, 'stanza': 'iq'})])
         self.connection.send(syn)
         file_props.syn_id = syn.getID()
-        return file_props
+        self._ibb_iq_ids[file_props.syn_id] = file_props
 
     def SendHandler(self, file_props):
         """
-        Send next portion of data if it is time to do it. Used internally.
+        Send the next blocks until ibb_window_size blocks wait for their
+        acknowledgement. Used internally.
         """
         log.debug('SendHandler called')
         if file_props.completed:
-            self.CloseIBBStream(file_props)
+            if not file_props.ibb_pending:
+                self.CloseIBBStream(file_props)
+            return
         if file_props.paused:
             return
         if not file_props.connected:
             #TODO: Reply with out of order error
             return
-        chunk = file_props.fp.read(file_props.block_size)
-        if chunk:
+        window_size = max(app.config.get('ibb_window_size'), 1)
+        buffer_ = memoryview(file_props.ibb_buffer)
+        sent = False
+        while len(file_props.ibb_pending) < window_size:
+            length = file_props.fp.readinto(file_props.ibb_buffer)
+            if not length:
+                log.debug('Nothing to read, but file not completed')
+                break
+            chunk = buffer_[:length]
             datanode = nbxmpp.Node(nbxmpp.NS_IBB + ' data', {
                 'sid': file_props.transport_sid,
                 'seq': file_props.seq},
@@ -903,19 +951,25 @@ class ConnectionIBBytestream(ConnectionBytestream):
             file_props.started = True
             if file_props.seq == 65536:
                 file_props.seq = 0
-            file_props.syn_id = self.connection.send(
+            id_ = self.connection.send(
                 nbxmpp.Protocol(name='iq', to=file_props.receiver,
                 typ='set', payload=[datanode]))
+            file_props.syn_id = id_
+            file_props.ibb_pending[id_] = time.time()
+            self._ibb_iq_ids[id_] = file_props
+            if file_props.hasher is not None:
+                file_props.hasher.update(chunk)
+            file_props.received_len += length
+            sent = True
+            if file_props.size == file_props.received_len:
+                file_props.completed = True
+                break
+        if sent:
             current_time = time.time()
             file_props.elapsed_time += current_time - file_props.last_time
             file_props.last_time = current_time
-            file_props.received_len += len(chunk)
-            if file_props.size == file_props.received_len:
-                file_props.completed = True
             app.socks5queue.progress_transfer_cb(self.name,
                 file_props)
-        else:
-            log.debug('Nothing to read, but file not completed')
 
     def IBBMessageHandler(self, conn, stanza):
         """
@@ -947,6 +1001,8 @@ class ConnectionIBBytestream(ConnectionBytestream):
                 file_props.seq += 1
                 file_props.started = True
                 file_props.fp.write(data)
+                if file_props.hasher is not None:
+                    file_props.hasher.update(data)
                 current_time = time.time()
                 file_props.elapsed_time += current_time - file_props.last_time
                 file_props.last_time = current_time
@@ -975,6 +1031,7 @@ class ConnectionIBBytestream(ConnectionBytestream):
             reply = stanza.buildReply('result')
             reply.delChild('close')
             conn.send(reply)
+            self._forget_ibb_iqs(file_props)
             # look in receiving files
             file_props.fp.close()
             file_props.completed = file_props.received_len >= file_props.size
@@ -993,21 +1050,29 @@ class ConnectionIBBytestream(ConnectionBytestream):
         is agreed upon.
         """
         syn_id = stanza.getID()
-        log.debug('IBBAllIqHandler called syn_id->%s' % syn_id)
-        for file_props in FilesProp.getAllFileProp():
-            if not file_props.direction or not file_props.connected:
-                # It's socks5 bytestream
-                # Or we closed the IBB stream
-                continue
-            if file_props.syn_id == syn_id:
-                if stanza.getType() == 'error':
-                    if file_props.direction[0] == '<':
-                        conn.Event('IBB', 'ERROR ON RECEIVE', file_props)
-                    else:
-                        conn.Event('IBB', 'ERROR ON SEND', file_props)
-                elif stanza.getType() == 'result':
-                    self.SendHandler(file_props)
-                break
+        log.debug('IBBAllIqHandler called syn_id->%s', syn_id)
+        file_props = self._ibb_iq_ids.pop(syn_id, None)
+        if file_props is None:
+            return
+        sent_time = file_props.ibb_pending.pop(syn_id, None)
+        if not file_props.connected:
+            # We closed the IBB stream
+            return
+        if stanza.getType() == 'error':
+            if sent_time is None and not file_props.started and \
+            stanza.getError() == 'resource-constraint' and \
+            file_props.block_size > IBB_MIN_BLOCK_SIZE:
+                # The receiver wants smaller blocks, open the stream again
+                self._send_ibb_open(file_props, stanza.getFrom(),
+                    max(file_props.block_size // 2, IBB_MIN_BLOCK_SIZE))
+            else:
+                self._forget_ibb_iqs(file_props)
+                conn.Event('IBB', 'ERROR ON SEND', file_props)
+        elif stanza.getType() == 'result':
+            if sent_time is not None:
+                file_props.ibb_acked += 1
+                file_props.ibb_round_trip_time += time.time() - sent_time
+            self.SendHandler(file_props)
 
 
 class ConnectionSocks5BytestreamZeroconf(ConnectionSocks5Bytestream):
@@ -585,6 +585,7 @@ class Socks5(object):
                     self.size = self.file_props.offset
                     self.file.seek(self.size)
                     self.file_props.received_len = self.size
+                self.file_props.start_hash(self.size)
             except IOError as e:
                 self.close_file()
                 raise IOError(str(e))
@@ -619,6 +620,7 @@ class Socks5(object):
                 offset = self.file_props.offset
                 opt = 'ab'
             fd = open(self.file_props.file_name, opt)
+            self.file_props.start_hash(offset)
             self.file_props.fd = fd
             self.file_props.elapsed_time = 0
             self.file_props.last_time = time.time()
@@ -694,6 +696,8 @@ class Socks5(object):
                     self.file_props.error = -1
                     return -1
             self.size += lenn
+            if self.file_props.hasher is not None:
+                self.file_props.hasher.update(buff[:lenn])
             current_time = time.time()
             self.file_props.elapsed_time += current_time - \
                 self.file_props.last_time
@@ -734,6 +738,8 @@ class Socks5(object):
                 self.file_props.error = -6 # file system error
                 return 0
             fd.write(self.remaining_buff)
+            if self.file_props.hasher is not None:
+                self.file_props.hasher.update(self.remaining_buff)
             lenn = len(self.remaining_buff)
             current_time = time.time()
             self.file_props.elapsed_time += current_time - \
@@ -781,6 +787,8 @@ class Socks5(object):
                 self.disconnect()
                 self.file_props.error = -6 # file system error
                 return 0
+            if self.file_props.hasher is not None:
+                self.file_props.hasher.update(buff)
             if self.file_props.received_len >= self.file_props.size:
                 # transfer completed
                 self.rem_fd(fd)
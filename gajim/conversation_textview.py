@@ -34,8 +34,9 @@ from gi.repository import GObject
 from gi.repository import GLib
 import time
 import os
+import bisect
+from collections import deque
 from gajim import dialogs
-import queue
 import urllib
 
 from gajim import gtkgui_helpers
@@ -52,6 +53,10 @@ NOT_SHOWN = 0
 ALREADY_RECEIVED = 1
 SHOWN = 2
 
+# How many messages printed in a batch are scanned for special text per idle
+# callback
+DEFERRED_TEXTS_PER_IDLE = 20
+
 import logging
 log = logging.getLogger('gajim.conversation_textview')
 
@@ -177,7 +182,12 @@ class ConversationTextview(GObject.GObject):
         GObject.GObject.__init__(self)
         self.used_in_history_window = used_in_history_window
         self.line = 0
+        # [(timestamp, line_start_mark, msg_stanza_id)], sorted by timestamp
         self.message_list = []
+        # The timestamps of message_list, to search it with bisect
+        self._message_times = []
+        # msg_stanza_id: message_list entry of the message
+        self._message_ids = {}
         self.corrected_text_list = {}
         self.fc = FuzzyClock()
 
@@ -297,10 +307,19 @@ class ConversationTextview(GObject.GObject):
         tag = buffer_.create_tag('xep0184-received')
         tag.set_property('foreground', '#73d216')
 
-        # One mark at the begining then 2 marks between each lines
-        size = app.config.get('max_conversation_lines')
-        size = 2 * size - 1
-        self.marks_queue = queue.Queue(size)
+        # True if the oldest lines were removed because there were more than
+        # max_conversation_lines, they can be loaded again from the logs
+        self.history_evicted = False
+        # {mark: log_line_id} of the lines that are in the logs
+        self._log_line_ids = {}
+
+        # True between begin_batch() and end_batch()
+        self._batch = False
+        # (mark, printed_text, text, text_tags, graphics, additional_data) of
+        # the messages printed in a batch that are not yet scanned for special
+        # text
+        self._deferred_texts = deque()
+        self._deferred_source_id = None
 
         self.allow_focus_out_line = True
         # holds a mark at the end of --- line
@@ -349,6 +368,9 @@ class ConversationTextview(GObject.GObject):
         return False
 
     def del_handlers(self):
+        if self._deferred_source_id is not None:
+            GLib.source_remove(self._deferred_source_id)
+            self._deferred_source_id = None
         for i in self.handlers.keys():
             if self.handlers[i].handler_is_connected(i):
                 self.handlers[i].disconnect(i)
@@ -372,6 +394,68 @@ class ConversationTextview(GObject.GObject):
         if self.autoscroll or force:
             gtkgui_helpers.scroll_to_end(self.tv.get_parent())
 
+    def begin_batch(self):
+        """
+        Start printing many messages at once, like restored history
+
+        Until end_batch() is called the messages are printed in one user
+        action, the textview is not scrolled and links, emoticons and
+        formatting are detected later in idle callbacks.
+        """
+        self.tv.get_buffer().begin_user_action()
+        self._batch = True
+
+    def end_batch(self):
+        self._batch = False
+        self.tv.get_buffer().end_user_action()
+        self.scroll_to_end()
+        if self._deferred_texts and self._deferred_source_id is None:
+            self._deferred_source_id = GLib.idle_add(
+                self._print_deferred_texts)
+
+    def _defer_special_text(self, text, text_tags, graphics, iter_,
+                            additional_data):
+        """
+        Print text as it is, it is scanned for special text later
+        """
+        if not text:
+            return
+        buffer_ = self.tv.get_buffer()
+        printed_text = self._add_oob_text(text, additional_data)
+        mark = buffer_.create_mark(None, iter_, left_gravity=True)
+        if text_tags:
+            buffer_.insert_with_tags_by_name(iter_, printed_text, *text_tags)
+        else:
+            buffer_.insert(iter_, printed_text)
+        self._deferred_texts.append((mark, printed_text, text, text_tags,
+                                     graphics, additional_data))
+        return iter_
+
+    def _print_deferred_texts(self):
+        buffer_ = self.tv.get_buffer()
+        buffer_.begin_user_action()
+        for _i in range(DEFERRED_TEXTS_PER_IDLE):
+            if not self._deferred_texts:
+                break
+            mark, printed_text, text, text_tags, graphics, additional_data = \
+                self._deferred_texts.popleft()
+            start_iter = buffer_.get_iter_at_mark(mark)
+            end_iter = start_iter.copy()
+            end_iter.forward_chars(len(printed_text))
+            # The text is gone if the conversation was cleared or the line
+            # was removed meanwhile
+            if buffer_.get_text(start_iter, end_iter, True) == printed_text:
+                buffer_.delete(start_iter, end_iter)
+                self.detect_and_print_special_text(text, text_tags,
+                    graphics=graphics, iter_=start_iter,
+                    additional_data=additional_data)
+            buffer_.delete_mark(mark)
+        buffer_.end_user_action()
+        if self._deferred_texts:
+            return True
+        self._deferred_source_id = None
+        return False
+
     def correct_message(self, correct_id, kind, name):
         allowed = True
         if kind == 'incoming':
@@ -395,7 +479,7 @@ class ConversationTextview(GObject.GObject):
             return None
 
         end_mark, index = self.get_end_mark(correct_id, start_mark)
-        if not index:
+        if index is None:
             log.debug('Could not find line to correct')
             return None
 
@@ -505,10 +589,29 @@ class ConversationTextview(GObject.GObject):
         buffer_ = self.tv.get_buffer()
         start, end = buffer_.get_bounds()
         buffer_.delete(start, end)
-        size = app.config.get('max_conversation_lines')
-        size = 2 * size - 1
-        self.marks_queue = queue.Queue(size)
+        for deferred in self._deferred_texts:
+            buffer_.delete_mark(deferred[0])
+        self._deferred_texts.clear()
+        for _tim, mark, _id in self.message_list:
+            buffer_.delete_mark(mark)
+        self.message_list.clear()
+        self._message_times.clear()
+        self._message_ids.clear()
+        tag_table = buffer_.get_tag_table()
+        for msg_stanza_id in self.corrected_text_list:
+            tag = tag_table.lookup(msg_stanza_id)
+            if tag is not None:
+                tag_table.remove(tag)
+        self.corrected_text_list.clear()
+        # The cleared messages can't be corrected anymore
+        self.last_received_message_id.clear()
+        self.last_sent_message_id = None
+        for mark in self.xep0184_marks.values():
+            buffer_.delete_mark(mark)
+        self.xep0184_marks.clear()
+        self._log_line_ids.clear()
         self.focus_out_end_mark = None
+        self.history_evicted = False
         self.just_cleared = True
 
     def visit_url_from_menuitem(self, widget, link):
@@ -831,17 +934,7 @@ class ConversationTextview(GObject.GObject):
         # We impose an arbitrary limit of 100 specials per message.
         specials_limit = 100
 
-        # add oob text to the end
-        try:
-            gajim_data = additional_data['gajim']
-            oob_url = gajim_data['oob_url']
-        except KeyError:
-            pass
-        else:
-            oob_desc = additional_data['gajim'].get('oob_desc', None)
-            if oob_desc is None:
-                oob_desc = _('URL:')
-            otext += '\n{} {}'.format(oob_desc, oob_url)
+        otext = self._add_oob_text(otext, additional_data)
 
         # basic: links + mail + formatting is always checked (we like that)
         if app.config.get('emoticons_theme') and graphics:
@@ -879,6 +972,21 @@ class ConversationTextview(GObject.GObject):
 
         return end_iter
 
+    @staticmethod
+    def _add_oob_text(otext, additional_data):
+        """
+        Add the out of band data url to the end of the text
+        """
+        try:
+            gajim_data = additional_data['gajim']
+            oob_url = gajim_data['oob_url']
+        except KeyError:
+            return otext
+        oob_desc = gajim_data.get('oob_desc', None)
+        if oob_desc is None:
+            oob_desc = _('URL:')
+        return otext + '\n{} {}'.format(oob_desc, oob_url)
+
     def print_special_text(self, special_text, other_tags, graphics=True,
     iter_=None, additional_data=None):
         """
@@ -1025,49 +1133,82 @@ class ConversationTextview(GObject.GObject):
         buffer_.insert_with_tags_by_name(iter_, '\n', 'eol')
         self.just_cleared = False
 
-    def get_end_mark(self, msg_stanza_id, start_mark):
-        for index, msg in enumerate(self.message_list):
-            if msg[2] == msg_stanza_id and msg[1] == start_mark:
-                try:
-                    end_mark = self.message_list[index + 1][1]
-                    end_mark_name = end_mark.get_name()
-                except IndexError:
-                    # We are at the last message
-                    end_mark = None
-                    end_mark_name = None
-
-                log.debug('start mark: %s, end mark: %s, '
-                          'replace message-list index: %s',
-                          start_mark.get_name(), end_mark_name, index)
-
-                return end_mark, index
-        log.debug('stanza-id not in message list')
-        return None, None
+    def _get_message_index(self, entry):
+        """
+        Return the index of a message_list entry or None
+        """
+        index = bisect.bisect_left(self._message_times, entry[0])
+        while index < len(self.message_list) and \
+        self._message_times[index] == entry[0]:
+            if self.message_list[index] is entry:
+                return index
+            index += 1
+        return None
+
+    def _add_message(self, index, entry):
+        """
+        Insert an entry into message_list at index
+        """
+        self.message_list.insert(index, entry)
+        self._message_times.insert(index, entry[0])
+        if entry[2] is not None:
+            self._message_ids[entry[2]] = entry
+
+    def _replace_message(self, index, entry):
+        old_entry = self.message_list[index]
+        if self._message_ids.get(old_entry[2]) is old_entry:
+            del self._message_ids[old_entry[2]]
+        self.message_list[index] = entry
+        if entry[2] is not None:
+            self._message_ids[entry[2]] = entry
 
-    def get_insert_mark(self, timestamp):
-        # message_list = [(timestamp, line_start_mark, msg_stanza_id)]
-        # We check if this is a new Message
+    def get_end_mark(self, msg_stanza_id, start_mark):
+        entry = self._message_ids.get(msg_stanza_id)
+        if entry is None or entry[1] != start_mark:
+            log.debug('stanza-id not in message list')
+            return None, None
+        index = self._get_message_index(entry)
+        if index is None:
+            log.debug('stanza-id not in message list')
+            return None, None
         try:
-            if self.message_list[-1][0] <= timestamp:
-                return None, None
+            end_mark = self.message_list[index + 1][1]
+            end_mark_name = end_mark.get_name()
         except IndexError:
-            # We have no Messages in the TextView
-            return None, None
+            # We are at the last message
+            end_mark = None
+            end_mark_name = None
 
-        # Not a new Message
-        # Search for insertion point
-        for index, msg in enumerate(self.message_list):
-            if msg[0] > timestamp:
-                return msg[1], index
+        log.debug('start mark: %s, end mark: %s, '
+                  'replace message-list index: %s',
+                  start_mark.get_name(), end_mark_name, index)
 
-        # Should not happen, but who knows
-        return None, None
+        return end_mark, index
+
+    def get_insert_mark(self, timestamp):
+        """
+        Return the mark and message_list index of the first message newer
+        than timestamp, or (None, None) if the message is the newest
+        """
+        index = bisect.bisect_right(self._message_times, timestamp)
+        if index == len(self.message_list):
+            # A new message or the TextView is empty
+            return None, None
+        return self.message_list[index][1], index
+
+    def get_oldest_line(self):
+        """
+        Return the time and the log_line_id of the oldest line, the
+        log_line_id is None if the line is not from the logs
+        """
+        tim, mark, _id = self.message_list[0]
+        return tim, self._log_line_ids.get(mark)
 
     def print_conversation_line(self, text, jid, kind, name, tim,
     other_tags_for_name=None, other_tags_for_time=None, other_tags_for_text=None,
     subject=None, old_kind=None, xhtml=None, simple=False, graphics=True,
     displaymarking=None, msg_stanza_id=None, correct_id=None, additional_data=None,
-    encrypted=None):
+    encrypted=None, msg_log_id=None):
         """
         Print 'chat' type messages
         """
@@ -1201,23 +1342,35 @@ class ConversationTextview(GObject.GObject):
         buffer_.delete_mark(temp_mark)
         new_mark = buffer_.create_mark(
             str(self.line), temp_iter, left_gravity=False)
+        if msg_log_id is not None:
+            self._log_line_ids[new_mark] = msg_log_id
 
-        if not index:
+        if corrected:
+            self._log_line_ids.pop(self.message_list[index][1], None)
+            # Replace the corrected message, it keeps its place in the
+            # conversation and so its timestamp
+            self._replace_message(index, (self.message_list[index][0],
+                                          new_mark, msg_stanza_id))
+        elif index is None:
             # New Message
-            self.message_list.append((tim, new_mark, msg_stanza_id))
-        elif corrected:
-            # Replace the corrected message
-            self.message_list[index] = (tim, new_mark, msg_stanza_id)
+            self._add_message(len(self.message_list),
+                              (tim, new_mark, msg_stanza_id))
         else:
             # We insert the message at index
-            self.message_list.insert(index, (tim, new_mark, msg_stanza_id))
+            self._add_message(index, (tim, new_mark, msg_stanza_id))
 
         if kind == 'incoming':
             self.last_received_message_id[name] = (msg_stanza_id, new_mark)
         elif kind == 'outgoing':
             self.last_sent_message_id = (msg_stanza_id, new_mark)
 
-        if not insert_mark:
+        if not insert_mark and self.autoscroll and \
+        not self.used_in_history_window:
+            # Only while we follow the conversation, don't remove the lines
+            # the user scrolled up to
+            self.remove_oldest_lines()
+
+        if not insert_mark and not self._batch:
             if self.autoscroll or kind == 'outgoing':
                 # we are at the end or we are sending something
                 self.scroll_to_end(force=True)
@@ -1228,6 +1381,65 @@ class ConversationTextview(GObject.GObject):
         self.line += 1
         return iter_
 
+    def remove_oldest_lines(self):
+        """
+        Remove the oldest lines if there are more than max_conversation_lines,
+        together with their marks, tags and images
+        """
+        max_lines = app.config.get('max_conversation_lines')
+        if max_lines <= 0 or len(self.message_list) <= max_lines:
+            return
+        count = len(self.message_list) - max_lines
+        evicted = self.message_list[:count]
+        del self.message_list[:count]
+        del self._message_times[:count]
+
+        buffer_ = self.tv.get_buffer()
+        tag_table = buffer_.get_tag_table()
+        end_iter = buffer_.get_iter_at_mark(self.message_list[0][1])
+        end_offset = end_iter.get_offset()
+
+        def _is_evicted(mark):
+            return buffer_.get_iter_at_mark(mark).get_offset() < end_offset
+
+        evicted_marks = set()
+        for entry in evicted:
+            _tim, mark, msg_stanza_id = entry
+            evicted_marks.add(mark)
+            self._log_line_ids.pop(mark, None)
+            if self._message_ids.get(msg_stanza_id) is entry:
+                del self._message_ids[msg_stanza_id]
+            if msg_stanza_id in self.corrected_text_list:
+                del self.corrected_text_list[msg_stanza_id]
+                tag = tag_table.lookup(msg_stanza_id)
+                if tag is not None:
+                    tag_table.remove(tag)
+
+        # Evicted messages can't be corrected anymore
+        for name, (_id, mark) in list(self.last_received_message_id.items()):
+            if mark in evicted_marks:
+                del self.last_received_message_id[name]
+        if self.last_sent_message_id is not None and \
+        self.last_sent_message_id[1] in evicted_marks:
+            self.last_sent_message_id = None
+
+        for id_, mark in list(self.xep0184_marks.items()):
+            if _is_evicted(mark):
+                buffer_.delete_mark(mark)
+                del self.xep0184_marks[id_]
+        if self.focus_out_end_mark is not None and \
+        _is_evicted(self.focus_out_end_mark):
+            buffer_.delete_mark(self.focus_out_end_mark)
+            self.focus_out_end_mark = None
+
+        buffer_.delete(buffer_.get_start_iter(), end_iter)
+        for mark in evicted_marks:
+            buffer_.delete_mark(mark)
+        self.images = [img for img in self.images
+                       if not img.anchor.get_deleted()]
+        self.history_evicted = True
+        log.debug('Removed the %s oldest lines', count)
+
     def get_time_to_show(self, tim, direction_mark=''):
         """
         Get the time, with the day before if needed and return it. It DOESN'T
@@ -1385,6 +1597,10 @@ class ConversationTextview(GObject.GObject):
         else:
             iter_ = buffer_.get_iter_at_mark(mark)
 
+        if self._batch:
+            return self._defer_special_text(text, text_tags, graphics, iter_,
+                additional_data)
+
         # detect urls formatting and if the user has it on emoticons
         return self.detect_and_print_special_text(text, text_tags, graphics=graphics,
             iter_=iter_, additional_data=additional_data)
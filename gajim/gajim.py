@@ -95,6 +95,10 @@ class GajimApplication(Gtk.Application):
         self.add_main_option('warnings', ord('w'), GLib.OptionFlags.NONE,
                              GLib.OptionArg.NONE,
                              _('Show all warnings'))
+        self.add_main_option('profile-events', 0, GLib.OptionFlags.NONE,
+                             GLib.OptionArg.NONE,
+                             _('Measure the event handlers and print the '
+                               'statistics on exit'))
         self.add_main_option('ipython', ord('i'), GLib.OptionFlags.NONE,
                              GLib.OptionArg.NONE,
                              _('Open IPython shell'))
@@ -115,6 +119,7 @@ class GajimApplication(Gtk.Application):
         self.profile = ''
         self.config_path = None
         self.profile_separation = False
+        self.profile_events = False
         self.interface = None
 
         GLib.set_prgname('gajim')
@@ -162,6 +167,8 @@ class GajimApplication(Gtk.Application):
             self.config_path, self.profile, self.profile_separation)
 
         from gajim.common import app
+        if self.profile_events:
+            app.ged.enable_profiling()
         from gajim.common import check_paths
         from gajim.common import exceptions
         from gajim.common import logger
@@ -318,6 +325,9 @@ class GajimApplication(Gtk.Application):
         from gajim.common import app
         app.logger.commit()
 
+        if self.profile_events:
+            print(app.ged.dump_profile())
+
     def _handle_remote_options(self, application, command_line):
         # Parse all options that should be executed on a remote instance
         options = command_line.get_options_dict()
@@ -371,6 +381,8 @@ class GajimApplication(Gtk.Application):
             logging_helpers.set_loglevels(loglevel)
         if options.contains('warnings'):
             self.show_warnings()
+        if options.contains('profile-events'):
+            self.profile_events = True
 
         return -1
 
@@ -46,6 +46,7 @@ from gajim import vcard
 from gajim import dataforms_widget
 from gajim import adhoc_commands
 from gajim.common.const import AvatarSize
+from gajim.common.logger import KindConstant
 from gajim.common.caps_cache import muc_caps_cache
 import nbxmpp
 
@@ -164,7 +165,8 @@ class PrivateChatControl(ChatControl):
         app.ged.register_event_handler('caps-received', ged.GUI1,
             self._nec_caps_received_pm)
         app.ged.register_event_handler('gc-presence-received', ged.GUI1,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received,
+            key=(self.account, self.gc_contact.room_jid))
 
     def get_our_nick(self):
         return self.room_ctrl.nick
@@ -176,7 +178,8 @@ class PrivateChatControl(ChatControl):
         app.ged.remove_event_handler('caps-received', ged.GUI1,
             self._nec_caps_received_pm)
         app.ged.remove_event_handler('gc-presence-received', ged.GUI1,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received,
+            key=(self.account, self.gc_contact.room_jid))
 
     def _nec_caps_received_pm(self, obj):
         if obj.conn.name != self.account or \
@@ -296,6 +299,7 @@ class PrivateChatControl(ChatControl):
 
 class GroupchatControl(ChatControlBase):
     TYPE_ID = message_control.TYPE_GC
+    history_kinds = (KindConstant.GC_MSG,)
 
     # Set a command host to bound to. Every command given through a group chat
     # will be processed with this command host.
@@ -420,7 +424,14 @@ class GroupchatControl(ChatControlBase):
         self.columns = [Gtk.Image, str, str, str, Gtk.Image]
         self.model = Gtk.TreeStore(*self.columns)
         self.model.set_sort_func(Column.NICK, self.tree_compare_iters)
-        self.model.set_sort_column_id(Column.NICK, Gtk.SortType.ASCENDING)
+        # {nick: Gtk.TreeRowReference} and {role: Gtk.TreeRowReference} of the
+        # rows in self.model
+        self._contact_refs = {}
+        self._role_refs = {}
+        # True while the occupants are received when joining the room, see
+        # _begin_join()
+        self._joining = False
+        self._begin_join()
 
         # columns
         column = Gtk.TreeViewColumn()
@@ -509,9 +520,11 @@ class GroupchatControl(ChatControlBase):
         settings_menu.set_menu_model(self.control_menu)
 
         app.ged.register_event_handler('gc-presence-received', ged.GUI1,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received,
+            key=(self.account, self.room_jid))
         app.ged.register_event_handler('gc-message-received', ged.GUI1,
-            self._nec_gc_message_received)
+            self._nec_gc_message_received,
+            key=(self.account, self.room_jid))
         app.ged.register_event_handler('mam-decrypted-message-received',
             ged.GUI1, self._nec_mam_decrypted_message_received)
         app.ged.register_event_handler('vcard-published', ged.GUI1,
@@ -1267,19 +1280,11 @@ class GroupchatControl(ChatControlBase):
             app.interface.roster.draw_contact(self.room_jid, self.account)
 
     def get_contact_iter(self, nick):
-        role_iter = self.model.get_iter_first()
-        while role_iter:
-            user_iter = self.model.iter_children(role_iter)
-            while user_iter:
-                if nick == self.model[user_iter][Column.NICK]:
-                    return user_iter
-                else:
-                    user_iter = self.model.iter_next(user_iter)
-            role_iter = self.model.iter_next(role_iter)
-        return None
+        return self._get_iter(self._contact_refs, nick)
 
     def print_old_conversation(self, text, contact='', tim=None, xhtml = None,
-    displaymarking=None, msg_stanza_id=None, encrypted=None, additional_data=None):
+    displaymarking=None, msg_stanza_id=None, encrypted=None, additional_data=None,
+    msg_log_id=None):
         if additional_data is None:
             additional_data = {}
 
@@ -1299,7 +1304,16 @@ class GroupchatControl(ChatControlBase):
             small_attr, small_attr + ['restored_message'],
             small_attr + ['restored_message'], count_as_new=False, xhtml=xhtml,
             displaymarking=displaymarking, msg_stanza_id=msg_stanza_id,
-            encrypted=encrypted, additional_data=additional_data)
+            encrypted=encrypted, additional_data=additional_data,
+            msg_log_id=msg_log_id)
+
+    def print_history_rows(self, rows):
+        for row in rows:
+            if not row.message:
+                continue
+            self.print_old_conversation(row.message, row.contact_name,
+                row.time, additional_data=row.additional_data,
+                msg_log_id=row.log_line_id)
 
     def print_conversation(self, text, contact='', tim=None, xhtml=None,
     graphics=True, displaymarking=None, correct_id=None, msg_stanza_id=None,
@@ -1566,6 +1580,7 @@ class GroupchatControl(ChatControlBase):
 
         app.gc_connected[self.account][self.room_jid] = True
         ChatControlBase.got_connected(self)
+        self._end_join()
         self.list_treeview.set_model(self.model)
         self.list_treeview.expand_all()
         # We don't redraw the whole banner here, because only icon change
@@ -1582,7 +1597,8 @@ class GroupchatControl(ChatControlBase):
         formattings_button = self.xml.get_object('formattings_button')
         formattings_button.set_sensitive(False)
         self.list_treeview.set_model(None)
-        self.model.clear()
+        self.clear_model()
+        self._begin_join()
         nick_list = app.contacts.get_nick_list(self.account, self.room_jid)
         for nick in nick_list:
             # Update pm chat window
@@ -1624,8 +1640,32 @@ class GroupchatControl(ChatControlBase):
             password, rejoin=True)
         return True
 
-    def draw_roster(self):
+    def _begin_join(self):
+        """
+        The server sends the presences of all occupants before our own
+        presence when we join the room. Until then the rows are not sorted and
+        the roles are not drawn, it is done once in _end_join()
+        """
+        if self._joining:
+            return
+        self._joining = True
+        self.model.set_sort_column_id(
+            Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, Gtk.SortType.ASCENDING)
+
+    def _end_join(self):
+        if not self._joining:
+            return
+        self._joining = False
+        self.model.set_sort_column_id(Column.NICK, Gtk.SortType.ASCENDING)
+        self.draw_all_roles()
+
+    def clear_model(self):
         self.model.clear()
+        self._contact_refs.clear()
+        self._role_refs.clear()
+
+    def draw_roster(self):
+        self.clear_model()
         for nick in app.contacts.get_nick_list(self.account, self.room_jid):
             gc_contact = app.contacts.get_gc_contact(self.account,
                 self.room_jid, nick)
@@ -1706,6 +1746,8 @@ class GroupchatControl(ChatControlBase):
         self.model[iter_][Column.AVATAR_IMG] = image
 
     def draw_role(self, role):
+        if self._joining:
+            return
         role_iter = self.get_role_iter(role)
         if not role_iter:
             return
@@ -1751,6 +1793,8 @@ class GroupchatControl(ChatControlBase):
         # init
         if obj.status_code:
             if '110' in obj.status_code:
+                # This is our own presence, all occupants have been received
+                self._end_join()
                 # We just join the room
                 if self.room_jid in app.automatic_rooms[self.account] and \
                 app.automatic_rooms[self.account][self.room_jid]['invities']:
@@ -2014,19 +2058,22 @@ class GroupchatControl(ChatControlBase):
             image = gtkgui_helpers.get_image_from_icon_name('closed', self.scale_factor)
             role_iter = self.model.append(None,
                 [image, role, 'role', role_name,  None] + [None] * self.nb_ext_renderers)
+            self._role_refs[role] = Gtk.TreeRowReference.new(self.model,
+                self.model.get_path(role_iter))
             self.draw_all_roles()
         iter_ = self.model.append(role_iter, [None, nick, 'contact', name, None] + \
                 [None] * self.nb_ext_renderers)
-        if not nick in app.contacts.get_nick_list(self.account,
-        self.room_jid):
+        self._contact_refs[nick] = Gtk.TreeRowReference.new(self.model,
+            self.model.get_path(iter_))
+        gc_contact = app.contacts.get_gc_contact(self.account, self.room_jid,
+            nick)
+        if gc_contact is None:
             gc_contact = app.contacts.create_gc_contact(
                 room_jid=self.room_jid, account=self.account,
                 name=nick, show=show, status=status, role=role,
                 affiliation=affiliation, jid=j, resource=resource,
                 avatar_sha=avatar_sha)
             app.contacts.add_gc_contact(self.account, gc_contact)
-        else:
-            gc_contact = app.contacts.get_gc_contact(self.account, self.room_jid, nick)
         self.draw_contact(nick)
         self.draw_avatar(gc_contact)
 
@@ -2039,13 +2086,16 @@ class GroupchatControl(ChatControlBase):
         return iter_
 
     def get_role_iter(self, role):
-        role_iter = self.model.get_iter_first()
-        while role_iter:
-            role_name = self.model[role_iter][Column.NICK]
-            if role == role_name:
-                return role_iter
-            role_iter = self.model.iter_next(role_iter)
-        return None
+        return self._get_iter(self._role_refs, role)
+
+    def _get_iter(self, refs, key):
+        ref = refs.get(key)
+        if ref is None:
+            return None
+        if not ref.valid():
+            del refs[key]
+            return None
+        return self.model.get_iter(ref.get_path())
 
     def remove_contact(self, nick):
         """
@@ -2058,9 +2108,11 @@ class GroupchatControl(ChatControlBase):
                 nick)
         if gc_contact:
             app.contacts.remove_gc_contact(self.account, gc_contact)
+        del self._contact_refs[nick]
         parent_iter = self.model.iter_parent(iter_)
         self.model.remove(iter_)
         if self.model.iter_n_children(parent_iter) == 0:
+            del self._role_refs[self.model[parent_iter][Column.NICK]]
             self.model.remove(parent_iter)
 
     def _message_sent(self, obj):
@@ -2225,9 +2277,11 @@ class GroupchatControl(ChatControlBase):
         self.autorejoin = False
 
         app.ged.remove_event_handler('gc-presence-received', ged.GUI1,
-            self._nec_gc_presence_received)
+            self._nec_gc_presence_received,
+            key=(self.account, self.room_jid))
         app.ged.remove_event_handler('gc-message-received', ged.GUI1,
-            self._nec_gc_message_received)
+            self._nec_gc_message_received,
+            key=(self.account, self.room_jid))
         app.ged.remove_event_handler('vcard-published', ged.GUI1,
             self._nec_vcard_published)
         app.ged.remove_event_handler('update-gc-avatar', ged.GUI1,
@@ -42,6 +42,7 @@ try:
 except:
     pass
 from io import BytesIO
+from collections import OrderedDict
 
 import logging
 log = logging.getLogger('gajim.gtkgui_helpers')
@@ -443,6 +444,102 @@ def scale_with_ratio(size, width, height):
         ratio = width / float(height)
         return size, int(size / ratio)
 
+class AvatarCache:
+    """
+    LRU cache for avatar pixbufs
+
+    The cache is bounded by the memory the pixel data of all pixbufs uses.
+    If an avatar is requested in a size that is not cached, it is scaled
+    down from the largest cached size of the same avatar.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.scaled = 0
+        self.evictions = 0
+        # (filename, size): pixbuf, least recently used first
+        self._pixbufs = OrderedDict()
+        # filename: set of cached sizes
+        self._sizes = {}
+
+    def __len__(self):
+        return len(self._pixbufs)
+
+    def get(self, filename, size):
+        """
+        Return the avatar filename in size, or None if it is not cached
+        """
+        key = (filename, size)
+        pixbuf = self._pixbufs.get(key)
+        if pixbuf is not None:
+            self._pixbufs.move_to_end(key)
+            self.hits += 1
+            return pixbuf
+
+        if size is not None:
+            pixbuf = self._scale_from_cache(filename, size)
+            if pixbuf is not None:
+                self.scaled += 1
+                self.set(filename, size, pixbuf)
+                return pixbuf
+
+        self.misses += 1
+        return None
+
+    def _scale_from_cache(self, filename, size):
+        largest = None
+        for cached_size in self._sizes.get(filename, ()):
+            pixbuf = self._pixbufs[(filename, cached_size)]
+            if max(pixbuf.get_width(), pixbuf.get_height()) < size:
+                continue
+            if largest is None or pixbuf.get_width() > largest.get_width():
+                largest = pixbuf
+        if largest is None:
+            return None
+        width, height = scale_with_ratio(
+            size, largest.get_width(), largest.get_height())
+        return largest.scale_simple(
+            width, height, GdkPixbuf.InterpType.BILINEAR)
+
+    def set(self, filename, size, pixbuf):
+        key = (filename, size)
+        old = self._pixbufs.pop(key, None)
+        if old is not None:
+            self.bytes -= old.get_byte_length()
+        self._pixbufs[key] = pixbuf
+        self._sizes.setdefault(filename, set()).add(size)
+        self.bytes += pixbuf.get_byte_length()
+        self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self):
+        self._pixbufs.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        evicted = False
+        # Keep at least the pixbuf that was just added
+        while self.bytes > self.max_bytes and len(self._pixbufs) > 1:
+            (filename, size), pixbuf = self._pixbufs.popitem(last=False)
+            sizes = self._sizes[filename]
+            sizes.discard(size)
+            if not sizes:
+                del self._sizes[filename]
+            self.bytes -= pixbuf.get_byte_length()
+            self.evictions += 1
+            evicted = True
+        if not evicted:
+            return
+        log.debug('Avatar cache: %s pixbufs, %s bytes, %s hits, %s misses, '
+                  '%s scaled, %s evictions', len(self._pixbufs), self.bytes,
+                  self.hits, self.misses, self.scaled, self.evictions)
+
 def on_avatar_save_as_menuitem_activate(widget, avatar, default_name=''):
     from gajim import dialogs
     def on_continue(response, file_path):
@@ -82,12 +82,15 @@ from gajim.common import sleepy
 
 from nbxmpp import idlequeue
 from nbxmpp import Hashes2
+from nbxmpp import NS_HASHES_2
 from gajim.common.zeroconf import connection_zeroconf
 from gajim.common import resolver
 from gajim.common import caps_cache
 from gajim.common import proxy65_manager
 from gajim.common import socks5
 from gajim.common import helpers
+from gajim.common import executor
+from gajim.common.image_cache import ImageCache
 from gajim.common import passwords
 from gajim.common import logging_helpers
 from gajim.common.connection_handlers_events import (
@@ -109,6 +112,10 @@ from gajim.common.caps_cache import muc_caps_cache
 from gajim.common.configpaths import gajimpaths
 config_filename = gajimpaths['CONFIG_FILE']
 
+# Seconds we wait for the hash of a received file when the sender sends it
+# after the transfer
+CHECKSUM_TIMEOUT = 10
+
 from gajim.common import optparser
 parser = optparser.OptionsParser(config_filename)
 
@@ -938,17 +945,18 @@ class Interface:
             self.instances['file_transfers'].set_progress(file_props.type_,
                     file_props.sid, file_props.received_len)
 
-    def __compare_hashes(self, account, file_props):
+    def __compare_hashes(self, account, file_props, hash_=None):
         session = app.connections[account].get_jingle_session(jid=None,
             sid=file_props.sid)
         ft_win = self.instances['file_transfers']
-        h = Hashes2()
-        try:
-            file_ = open(file_props.file_name, 'rb')
-        except:
-            return
-        hash_ = h.calculateHash(file_props.algo, file_)
-        file_.close()
+        if hash_ is None:
+            h = Hashes2()
+            try:
+                file_ = open(file_props.file_name, 'rb')
+            except:
+                return
+            hash_ = h.calculateHash(file_props.algo, file_)
+            file_.close()
         # If the hash we received and the hash of the file are the same,
         # then the file is not corrupt
         jid = file_props.sender
@@ -981,27 +989,77 @@ class Interface:
             app.socks5queue.remove_receiver(file_props.sid, True, True)
             if file_props.session_type == 'jingle':
                 if file_props.hash_ and file_props.error == 0:
-                    # We compare hashes in a new thread
-                    self.hashThread = Thread(target=self.__compare_hashes,
-                        args=(account, file_props))
-                    self.hashThread.start()
+                    self.__check_received_hash(account, file_props)
+                elif file_props.error == 0 and file_props.hasher and \
+                self.__sender_sends_hash(account, file_props):
+                    self.__wait_for_checksum(account, file_props)
                 else:
-                    # We disn't get the hash, sender probably don't support that
-                    jid = file_props.sender
-                    self.popup_ft_result(account, jid, file_props)
-                    if file_props.error == 0:
-                        ft.set_status(file_props, 'ok')
-                    session = app.connections[account].get_jingle_session(jid=None,
-                        sid=file_props.sid)
-                    # End jingle session
-                    # TODO: only if there are no other parallel downloads in this session
-                    if session:
-                        session.end_session()
+                    self.__end_unchecked_transfer(account, file_props)
         else: # we send a file
             jid = file_props.receiver
             app.socks5queue.remove_sender(file_props.sid, True, True)
+            if file_props.session_type == 'jingle' and \
+            file_props.error == 0 and file_props.hasher:
+                self.__send_checksum(account, file_props)
             self.popup_ft_result(account, jid, file_props)
 
+    def __check_received_hash(self, account, file_props):
+        hash_ = file_props.get_received_hash()
+        if hash_ is not None:
+            # The data was hashed while it was received
+            self.__compare_hashes(account, file_props, hash_)
+            return
+        # We compare hashes in a new thread
+        self.hashThread = Thread(target=self.__compare_hashes,
+            args=(account, file_props))
+        self.hashThread.start()
+
+    def __end_unchecked_transfer(self, account, file_props):
+        # We disn't get the hash, sender probably don't support that
+        jid = file_props.sender
+        self.popup_ft_result(account, jid, file_props)
+        if file_props.error == 0:
+            self.instances['file_transfers'].set_status(file_props, 'ok')
+        session = app.connections[account].get_jingle_session(jid=None,
+            sid=file_props.sid)
+        # End jingle session
+        # TODO: only if there are no other parallel downloads in this session
+        if session:
+            session.end_session()
+
+    @staticmethod
+    def __sender_sends_hash(account, file_props):
+        contact = app.contacts.get_contact_from_full_jid(account,
+            file_props.sender)
+        return contact is not None and contact.supports(NS_HASHES_2)
+
+    def __wait_for_checksum(self, account, file_props):
+        """
+        The sender sends the hash in a session info after the last byte, see
+        JingleFileTransfer.send_checksum()
+        """
+        def _on_checksum():
+            GLib.source_remove(timeout_id)
+            file_props.checksum_cb = None
+            self.__check_received_hash(account, file_props)
+
+        def _on_timeout():
+            file_props.checksum_cb = None
+            self.__end_unchecked_transfer(account, file_props)
+
+        timeout_id = GLib.timeout_add_seconds(CHECKSUM_TIMEOUT, _on_timeout)
+        file_props.checksum_cb = _on_checksum
+
+    @staticmethod
+    def __send_checksum(account, file_props):
+        session = app.connections[account].get_jingle_session(jid=None,
+            sid=file_props.sid)
+        if session is None:
+            return
+        for content in session.contents.values():
+            if content.media == 'file' and content.file_props is file_props:
+                content.send_checksum()
+
     def popup_ft_result(self, account, jid, file_props):
         ft = self.instances['file_transfers']
         if helpers.allow_popup_window(account):
@@ -2474,13 +2532,11 @@ class Interface:
                 data = file.read()
             return data
 
-        try:
-            pixbuf = app.avatar_cache[filename][size]
+        pixbuf = app.avatar_cache.get(filename, size)
+        if pixbuf is not None:
             if scale is None:
                 return pixbuf
             return Gdk.cairo_surface_create_from_pixbuf(pixbuf, scale)
-        except KeyError:
-            pass
 
         path = os.path.join(app.AVATAR_PATH, filename)
         if not os.path.isfile(path):
@@ -2516,9 +2572,7 @@ class Interface:
                 pixbuf = pixbuf.scale_simple(
                     width, height, GdkPixbuf.InterpType.BILINEAR)
 
-        if filename not in app.avatar_cache:
-            app.avatar_cache[filename] = {}
-        app.avatar_cache[filename][size] = pixbuf
+        app.avatar_cache.set(filename, size, pixbuf)
 
         if scale is None:
             return pixbuf
@@ -2746,7 +2800,12 @@ class Interface:
 
     def __init__(self):
         app.interface = self
-        app.thread_interface = ThreadInterface
+        app.thread_interface = executor.run_in_thread
+        app.avatar_cache = gtkgui_helpers.AvatarCache(
+            app.config.get('avatar_cache_size') * 1024 * 1024)
+        app.image_cache = ImageCache(
+            app.IMAGE_CACHE_PATH,
+            app.config.get('image_cache_size') * 1024 * 1024)
         # This is the manager and factory of message windows set by the module
         self.msg_win_mgr = None
         self.jabber_state_images = {'16': {}, '24': {}, '32': {}, 'opened': {},
@@ -3047,17 +3106,3 @@ class PassphraseRequest:
         self.dialog = dialogs.PassphraseDialog(title, second, ok_handler=(_ok,
             1), cancel_handler=_cancel)
         self.dialog_created = True
-
-
-class ThreadInterface:
-    def __init__(self, func, func_args=(), callback=None, callback_args=()):
-        """
-        Call a function in a thread
-        """
-        def thread_function(func, func_args, callback, callback_args):
-            output = func(*func_args)
-            if callback:
-                GLib.idle_add(callback, output, *callback_args)
-
-        Thread(target=thread_function, args=(func, func_args, callback,
-                callback_args)).start()
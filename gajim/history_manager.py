@@ -73,6 +73,7 @@ del config_path
 from gajim.common import app
 from gajim import gtkgui_helpers
 from gajim.common.logger import LOG_DB_PATH, JIDConstant, KindConstant
+from gajim.common.logger import LogSearchIndex
 from gajim.common import helpers
 from gajim import dialogs
 
@@ -122,6 +123,8 @@ class HistoryManager:
         self.con = sqlite.connect(LOG_DB_PATH, timeout=20.0,
                 isolation_level='IMMEDIATE')
         self.cur = self.con.cursor()
+        self.search_index = LogSearchIndex(self.con)
+        self.search_index.init_tables()
 
         self._init_jids_listview()
         self._init_logs_listview()
@@ -558,6 +561,7 @@ class HistoryManager:
                 jid_id = liststore[path][1]
                 del liststore[path]  # remove from UI
                 # remove from db
+                self.search_index.remove_jid(jid_id)
                 self.cur.execute('''
                         DELETE FROM logs
                         WHERE jid_id = ?
@@ -607,6 +611,7 @@ class HistoryManager:
                 log_line_id = liststore[path][0]
                 del liststore[path]  # remove from UI
                 # remove from db
+                self.search_index.remove([log_line_id])
                 self.cur.execute('''
                         DELETE FROM logs
                         WHERE log_line_id = ?
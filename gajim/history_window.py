@@ -60,6 +60,9 @@ class Column(IntEnum):
     TIME = 4
     LOG_LINE_ID = 5
 
+# Number of search results fetched from the database at once
+SEARCH_PAGE_SIZE = 200
+
 class HistoryWindow:
     """
     Class for browsing logs of conversations with contacts
@@ -124,6 +127,7 @@ class HistoryWindow:
         self.completion_dict = {}
         self.accounts_seen_online = [] # Update dict when new accounts connect
         self.jids_to_search = []
+        self._search_source_id = None
 
         # This will load history too
         task = self._fill_completion_dict()
@@ -252,6 +256,8 @@ class HistoryWindow:
         return account
 
     def on_history_window_destroy(self, widget):
+        if self._search_source_id is not None:
+            GLib.source_remove(self._search_source_id)
         # PluginSystem: removing GUI extension points connected with
         # HistoryWindow instance object
         app.plugin_manager.remove_gui_extension_point(
@@ -595,6 +601,10 @@ class HistoryWindow:
         self.history_textview.print_real_text('\n', text_tags=['eol'])
 
     def on_search_entry_activate(self, widget):
+        if self._search_source_id is not None:
+            GLib.source_remove(self._search_source_id)
+            self._search_source_id = None
+
         text = self.search_entry.get_text()
         model = self.results_treeview.get_model()
         model.clear()
@@ -604,6 +614,25 @@ class HistoryWindow:
         else:
             self.results_window.set_property('visible', True)
 
+        date = None
+        if self.search_in_date.get_active():
+            year, month, day = self.calendar.get_date() # integers
+            month = gtkgui_helpers.make_gtk_month_python_month(month)
+            date = datetime.datetime(year, month, day)
+
+        task = self._search(text, date)
+        self._search_source_id = GLib.idle_add(next, task, False)
+
+    def _search(self, text, date):
+        """
+        Fill the results treeview with the search results, one page of
+        results per iteration
+
+        This is a generator and does pseudo-threading via idle_add().
+        """
+        model = self.results_treeview.get_model()
+        show_status = self.show_status_checkbutton.get_active()
+
         # perform search in preselected jids
         # jids are preselected with the query_entry
         for jid in self.jids_to_search:
@@ -615,35 +644,39 @@ class HistoryWindow:
                 # This may leed to wrong self nick in the displayed history (Uggh!)
                 account = list(app.contacts.get_accounts())[0]
 
-            date = None
-            if self.search_in_date.get_active():
-                year, month, day = self.calendar.get_date() # integers
-                month = gtkgui_helpers.make_gtk_month_python_month(month)
-                date = datetime.datetime(year, month, day)
-
-            show_status = self.show_status_checkbutton.get_active()
-
-            results = app.logger.search_log(account, jid, text, date)
-            #FIXME:
-            # add "subject:  | message: " in message column if kind is single
-            # also do we need show at all? (we do not search on subject)
-            for row in results:
-                if not show_status and row.kind in (KindConstant.GCSTATUS,
-                                                    KindConstant.STATUS):
-                    continue
-
-                contact_name = row.contact_name
-                if not contact_name:
-                    if row.kind == KindConstant.CHAT_MSG_SENT: # it's us! :)
-                        contact_name = app.nicks[account]
-                    else:
-                        contact_name = self.completion_dict[jid][InfoColumn.NAME]
-
-                local_time = time.localtime(row.time)
-                date = time.strftime('%Y-%m-%d', local_time)
-
-                model.append((jid, contact_name, date, row.message,
-                              str(row.time), row.log_line_id))
+            last_log_line_id = 0
+            while True:
+                results = app.logger.search_log(
+                    account, jid, text, date, after=last_log_line_id,
+                    limit=SEARCH_PAGE_SIZE)
+                #FIXME:
+                # add "subject:  | message: " in message column if kind is single
+                # also do we need show at all? (we do not search on subject)
+                for row in results:
+                    if not show_status and row.kind in (KindConstant.GCSTATUS,
+                                                        KindConstant.STATUS):
+                        continue
+
+                    contact_name = row.contact_name
+                    if not contact_name:
+                        if row.kind == KindConstant.CHAT_MSG_SENT: # it's us! :)
+                            contact_name = app.nicks[account]
+                        else:
+                            contact_name = self.completion_dict[jid][InfoColumn.NAME]
+
+                    local_time = time.localtime(row.time)
+                    date_ = time.strftime('%Y-%m-%d', local_time)
+
+                    model.append((jid, contact_name, date_, row.message,
+                                  str(row.time), row.log_line_id))
+
+                if len(results) < SEARCH_PAGE_SIZE:
+                    break
+                # Pages are ordered by time
+                last_log_line_id = max(row.log_line_id for row in results)
+                yield True
+        self._search_source_id = None
+        yield False
 
     def on_results_treeview_row_activated(self, widget, path, column):
         """
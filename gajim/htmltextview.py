@@ -54,6 +54,7 @@ from gajim.common import app
 from gajim import gtkgui_helpers
 from gajim.gtkgui_helpers import get_icon_pixmap
 from gajim.common import helpers
+from gajim.common import executor
 from gajim import dialogs
 
 import logging
@@ -545,7 +546,15 @@ class HtmlHandler(xml.sax.handler.ContentHandler):
                 (mem, alt, replace_mark, replace_tags) = loaded
                 update = True
             else:
-                if self.conv_textview:
+                mem, stale = helpers.get_cached_image(attrs['src'])
+                if mem is not None:
+                    if stale and self.conv_textview:
+                        # Show the cached image and revalidate it for the
+                        # next time
+                        app.thread_interface(helpers.download_image, [
+                            self.conv_textview.account, attrs],
+                            priority=executor.PRIORITY_LOW)
+                elif self.conv_textview:
                     img_mark = self.textbuf.create_mark(None, self.iter, True)
                     app.thread_interface(helpers.download_image, [
                         self.conv_textview.account, attrs], self._update_img,
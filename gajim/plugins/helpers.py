@@ -98,21 +98,18 @@ class log_calls(object):
         '''
 
         self.full_func_name += f.__name__
-        if self.log_this_class:
-            @functools.wraps(f)
-            def wrapper(*args, **kwargs):
-
-                log.debug('%(funcname)s() <entered>'%{
-                    'funcname': self.full_func_name})
-                result = f(*args, **kwargs)
-                log.debug('%(funcname)s() <left>'%{
-                    'funcname': self.full_func_name})
-                return result
-        else:
-            @functools.wraps(f)
-            def wrapper(*args, **kwargs):
-                result = f(*args, **kwargs)
-                return result
+        if not self.log_this_class:
+            # Nothing to log, do not add a call to every call of f
+            return f
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not log.isEnabledFor(logging.DEBUG):
+                return f(*args, **kwargs)
+            log.debug('%s() <entered>', self.full_func_name)
+            result = f(*args, **kwargs)
+            log.debug('%s() <left>', self.full_func_name)
+            return result
 
         return wrapper
 
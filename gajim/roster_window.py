@@ -43,6 +43,7 @@ import os
 import sys
 import time
 import locale
+import logging
 
 from enum import IntEnum, unique
 
@@ -62,6 +63,7 @@ from gajim.common.const import AvatarSize
 
 from gajim.common import app
 from gajim.common import helpers
+from gajim.common import executor
 from gajim.common.exceptions import GajimGeneralException
 from gajim.common import i18n
 if app.HAVE_GEOCLUE:
@@ -70,6 +72,8 @@ from gajim.common import ged
 from gajim.message_window import MessageWindowMgr
 from nbxmpp.protocol import NS_FILE, NS_ROSTERX, NS_CONFERENCE
 
+log = logging.getLogger('gajim.roster')
+
 
 @unique
 class Column(IntEnum):
@@ -85,11 +89,142 @@ class Column(IntEnum):
     AVATAR_IMG = 9  # avatar_sha
     PADLOCK_PIXBUF = 10  # use for account row only
     VISIBLE = 11
+    SORT_KEY = 12  # see _get_sort_key()
+
+# Filter the roster this many milliseconds after the last change of the
+# filter entry
+RFILTER_DELAY = 150
 
 empty_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 1, 1)
 empty_pixbuf.fill(0xffffff00)
 
 
+class RedrawScheduler:
+    """
+    Collects the rows of the roster that have to be redrawn
+
+    Contacts, groups and accounts that are queued several times before the
+    next flush are drawn only once. The flush runs in an idle callback, so a
+    burst of presences is drawn once after the main loop handled all of them.
+    """
+
+    KINDS = ('contact', 'pep', 'avatar', 'group', 'account')
+
+    def __init__(self, roster):
+        self._roster = roster
+        # (account, jid): {'contact': bool, 'avatar': bool, 'pep': set()}
+        self._contacts = {}
+        # (account, group): None, dicts keep the order in which rows got dirty
+        self._groups = {}
+        self._accounts = {}
+        # (account, group): None, groups to expand or collapse after drawing
+        self._expands = {}
+        self._source_id = None
+        self.requested = dict.fromkeys(self.KINDS, 0)
+        self.performed = dict.fromkeys(self.KINDS, 0)
+
+    def queue_contact(self, jid, account, contact=True, pep_types=(),
+                      avatar=False):
+        dirty = self._contacts.setdefault(
+            (account, jid), {'contact': False, 'avatar': False, 'pep': set()})
+        if contact:
+            self.requested['contact'] += 1
+            dirty['contact'] = True
+        if avatar:
+            self.requested['avatar'] += 1
+            dirty['avatar'] = True
+        self.requested['pep'] += len(pep_types)
+        dirty['pep'].update(pep_types)
+        self._schedule()
+
+    def queue_group(self, group, account):
+        self.requested['group'] += 1
+        self._groups[(account, group)] = None
+        self._schedule()
+
+    def queue_account(self, account):
+        self.requested['account'] += 1
+        self._accounts[account] = None
+        self._schedule()
+
+    def queue_expand(self, group, account):
+        """
+        Expand or collapse the group once the queued rows are drawn, it may
+        only become visible then
+        """
+        self._expands[(account, group)] = None
+        self._schedule()
+
+    def contact_drawn(self, jid, account):
+        """
+        The contact row was drawn right away, it needs no queued redraw
+        """
+        dirty = self._contacts.get((account, jid))
+        if dirty is not None:
+            dirty['contact'] = False
+
+    def _schedule(self):
+        if self._source_id is None:
+            self._source_id = GLib.idle_add(self._on_idle)
+
+    def _on_idle(self):
+        self._source_id = None
+        self.flush()
+        return False
+
+    def flush(self):
+        """
+        Draw everything that was queued
+        """
+        if self._source_id is not None:
+            GLib.source_remove(self._source_id)
+            self._source_id = None
+        contacts, self._contacts = self._contacts, {}
+        groups, self._groups = self._groups, {}
+        accounts, self._accounts = self._accounts, {}
+        expands, self._expands = self._expands, {}
+
+        # Contacts first, drawing a contact can make its groups visible
+        roster = self._roster
+        for (account, jid), dirty in contacts.items():
+            if dirty['contact']:
+                self.performed['contact'] += 1
+                roster.draw_contact(jid, account)
+            for pep_type in dirty['pep']:
+                self.performed['pep'] += 1
+                roster.draw_pep(jid, account, pep_type)
+            if dirty['avatar']:
+                self.performed['avatar'] += 1
+                roster.draw_avatar(jid, account)
+        for account, group in groups:
+            self.performed['group'] += 1
+            roster._really_draw_group(group, account)
+        for account in accounts:
+            self.performed['account'] += 1
+            roster._really_draw_account(account)
+        for account, group in expands:
+            roster._adjust_group_expand_collapse_state(group, account)
+
+        log.debug('Redrawn %s contacts, %s groups, %s accounts',
+                  len(contacts), len(groups), len(accounts))
+
+    def clear(self):
+        if self._source_id is not None:
+            GLib.source_remove(self._source_id)
+            self._source_id = None
+        self._contacts.clear()
+        self._groups.clear()
+        self._accounts.clear()
+        self._expands.clear()
+
+    def get_stats(self):
+        """
+        Return a dict of kind: (requested, performed) redraws
+        """
+        return {kind: (self.requested[kind], self.performed[kind])
+                for kind in self.KINDS}
+
+
 class RosterWindow:
     """
     Class for main window of the GTK+ interface
@@ -271,7 +406,8 @@ class RosterWindow:
             it = self.model.append(None, [
                 app.interface.jabber_state_images['16'][show],
                 _('Merged accounts'), 'account', '', 'all', None, None, None,
-                None, None, None, True] + [None] * self.nb_ext_renderers)
+                None, None, None, True, self._get_sort_key('account', 'all')] +
+                [None] * self.nb_ext_renderers)
             self._iters['MERGED']['account'] = it
         else:
             show = app.SHOW_LIST[app.connections[account].connected]
@@ -284,7 +420,8 @@ class RosterWindow:
             it = self.model.append(None, [
                 app.interface.jabber_state_images['16'][show],
                 GLib.markup_escape_text(account), 'account', our_jid,
-                account, None, None, None, None, None, tls_pixbuf, True] +
+                account, None, None, None, None, None, tls_pixbuf, True,
+                self._get_sort_key('account', account)] +
                 [None] * self.nb_ext_renderers)
             self._iters[account]['account'] = it
 
@@ -344,7 +481,9 @@ class RosterWindow:
         iter_group = self.model.append(iter_parent,
             [app.interface.jabber_state_images['16']['closed'],
             GLib.markup_escape_text(group), 'group', group, account, None,
-            None, None, None, None, None, False] + [None] * self.nb_ext_renderers)
+            None, None, None, None, None, False,
+            self._get_sort_key('group', account, group)] +
+            [None] * self.nb_ext_renderers)
         self.draw_group(group, account)
         self._iters[account_group]['groups'][group] = iter_group
         return iter_group
@@ -379,10 +518,11 @@ class RosterWindow:
             # Do not confuse get_contact_iter: Sync groups of family members
             contact.groups = big_brother_contact.groups[:]
 
+            sort_key = self._get_sort_key('contact', account, contact.jid)
             for child_iter in parent_iters:
                 it = self.model.append(child_iter, [None,
                     contact.get_shown_name(), 'contact', contact.jid, account,
-                    None, None, None, None, None, None, visible] + \
+                    None, None, None, None, None, None, visible, sort_key] + \
                     [None] * self.nb_ext_renderers)
                 added_iters.append(it)
                 if contact.jid in self._iters[account]['contacts']:
@@ -411,7 +551,8 @@ class RosterWindow:
                 # for more
                 i_ = self.model.append(child_iterG, [None,
                     contact.get_shown_name(), typestr, contact.jid, account,
-                    None, None, None, None, None, None, visible] + \
+                    None, None, None, None, None, None, visible,
+                    self._get_sort_key(typestr, account, contact.jid)] + \
                     [None] * self.nb_ext_renderers)
                 added_iters.append(i_)
                 if contact.jid in self._iters[account]['contacts']:
@@ -491,6 +632,8 @@ class RosterWindow:
             self.model.remove(to_be_removed)
 
         del self._iters[account]['contacts'][contact.jid]
+        self._search_names.pop((account, contact.jid), None)
+        self._rfilter_matches.discard((account, contact.jid))
         return True
 
     def _add_metacontact_family(self, family, account):
@@ -671,7 +814,9 @@ class RosterWindow:
         child_iterA = self._get_account_iter(account, self.model)
         self._iters[account]['contacts'][jid] = [self.model.append(child_iterA,
             [None, app.nicks[account], 'self_contact', jid, account, None,
-            None, None, None, None, None, True] + [None] * self.nb_ext_renderers)]
+            None, None, None, None, None, True,
+            self._get_sort_key('self_contact', account, jid)] +
+            [None] * self.nb_ext_renderers)]
 
         self.draw_completely(jid, account)
         self.draw_account(account)
@@ -697,6 +842,8 @@ class RosterWindow:
         jid -- the contact's jid or SelfJid to add SelfContact
         account -- the corresponding account.
         """
+        # Groups may have been changed in place, recount the contact
+        app.contacts.contact_changed(account, jid)
         contact = app.contacts.get_contact_with_highest_priority(account, jid)
         if len(self._get_contact_iter(jid, account, contact, self.model)):
             # If contact already in roster, do nothing
@@ -1118,18 +1265,8 @@ class RosterWindow:
         else:
             self.model[child_iter][Column.LOCATION_PIXBUF] = empty_pixbuf
 
-    def _really_draw_accounts(self):
-        for acct in self.accounts_to_draw:
-            self._really_draw_account(acct)
-        self.accounts_to_draw = []
-        return False
-
     def draw_account(self, account):
-        if account in self.accounts_to_draw:
-            return
-        self.accounts_to_draw.append(account)
-        if len(self.accounts_to_draw) == 1:
-            GLib.timeout_add(200, self._really_draw_accounts)
+        self.redraw.queue_account(account)
 
     def _really_draw_group(self, group, account):
         child_iter = self._get_group_iter(group, account, model=self.model)
@@ -1169,21 +1306,8 @@ class RosterWindow:
         for iter_ in to_hide:
             self.modelfilter[iter_][Column.VISIBLE] = False
 
-    def _really_draw_groups(self):
-        for ag in self.groups_to_draw.values():
-            acct = ag['account']
-            grp = ag['group']
-            self._really_draw_group(grp, acct)
-        self.groups_to_draw = {}
-        return False
-
     def draw_group(self, group, account):
-        ag = account + group
-        if ag in self.groups_to_draw:
-            return
-        self.groups_to_draw[ag] = {'group': group, 'account': account}
-        if len(self.groups_to_draw) == 1:
-            GLib.timeout_add(200, self._really_draw_groups)
+        self.redraw.queue_group(group, account)
 
     def draw_parent_contact(self, jid, account):
         child_iters = self._get_contact_iter(jid, account, model=self.model)
@@ -1218,7 +1342,10 @@ class RosterWindow:
         if not child_iters:
             return False
 
+        self._search_names[(account, jid)] = contact.get_shown_name().lower()
         name = GLib.markup_escape_text(contact.get_shown_name())
+        sort_key = self._get_sort_key(
+            self.model[child_iters[0]][Column.TYPE], account, jid)
 
         # gets number of unread gc marked messages
         if jid in app.interface.minimized_controls[account] and \
@@ -1325,11 +1452,15 @@ class RosterWindow:
                 # Expand/collapse icon might differ per iter
                 # (group)
                 img = state_images[icon_name]
-                self.model[child_iter][Column.IMG] = img
-                self.model[child_iter][Column.NAME] = name
                 #TODO: compute visible
                 visible = True
-                self.model[child_iter][Column.VISIBLE] = visible
+                values = {Column.IMG: img, Column.NAME: name,
+                          Column.VISIBLE: visible, Column.SORT_KEY: sort_key}
+                if not self._update_row(child_iter, values):
+                    # While filtering the children decide if the row is
+                    # shown, so let the modelfilter look at it again
+                    self.model.row_changed(self.model.get_path(child_iter),
+                                           child_iter)
         else:
             # A normal contact or little brother
             state_images = self.get_appropriate_state_images(jid,
@@ -1339,12 +1470,13 @@ class RosterWindow:
             # All iters have the same icon (no expand/collapse)
             img = state_images[icon_name]
             for child_iter in child_iters:
-                self.model[child_iter][Column.IMG] = img
-                self.model[child_iter][Column.NAME] = name
-                self.model[child_iter][Column.VISIBLE] = visible
+                self._update_row(child_iter, {Column.IMG: img,
+                                              Column.NAME: name,
+                                              Column.VISIBLE: visible,
+                                              Column.SORT_KEY: sort_key})
                 if visible:
                     parent_iter = self.model.iter_parent(child_iter)
-                    self.model[parent_iter][Column.VISIBLE] = True
+                    self._update_row(parent_iter, {Column.VISIBLE: True})
 
             # We are a little brother
             if family and not is_big_brother and not self.starting:
@@ -1360,14 +1492,30 @@ class RosterWindow:
                     iterG = self._get_group_iter(g, account, model=self.model)
                     if iterG:
                         # it's not self contact
-                        self.model[iterG][Column.VISIBLE] = True
+                        self._update_row(iterG, {Column.VISIBLE: True})
                     i += 1
 
+        self.redraw.contact_drawn(jid, account)
         app.plugin_manager.gui_extension_point('roster_draw_contact', self,
             jid, account, contact)
 
         return False
 
+    def _update_row(self, child_iter, values):
+        """
+        Set the columns in values that changed, all in one go so the row is
+        refiltered and resorted only once
+
+        Return True if a column changed
+        """
+        row = self.model[child_iter]
+        changed = {column: value for column, value in values.items()
+                   if row[column] != value}
+        if not changed:
+            return False
+        self.model.set(child_iter, changed)
+        return True
+
     def _is_pep_shown_in_roster(self, pep_type):
         if pep_type == 'mood':
             return app.config.get('show_mood_in_roster')
@@ -1440,12 +1588,12 @@ class RosterWindow:
         if family:
             # There might be a new big brother
             self._recalibrate_metacontact_family(family, account)
-        self.draw_contact(jid, account)
+        self.redraw.queue_contact(jid, account)
         self.draw_account(account)
 
         for group in contact.get_shown_groups():
             self.draw_group(group, account)
-            self._adjust_group_expand_collapse_state(group, account)
+            self.redraw.queue_expand(group, account)
 
     def _idle_draw_jids_of_account(self, jids, account):
         """
@@ -1631,6 +1779,7 @@ class RosterWindow:
         for account in app.connections:
             for jid in app.contacts.get_jid_list(account):
                 self.adjust_and_draw_contact_context(jid, account)
+        self.redraw.flush()
         self.filtering = False
 
     def contact_has_pending_roster_events(self, contact, account):
@@ -1647,9 +1796,27 @@ class RosterWindow:
                 return True
         return False
 
+    def _get_search_name(self, account, jid):
+        """
+        Return the lowercase name the roster filter matches against
+        """
+        name = self._search_names.get((account, jid))
+        if name is None:
+            contact = app.contacts.get_first_contact_from_jid(account, jid)
+            if not contact:
+                return ''
+            name = contact.get_shown_name().lower()
+            self._search_names[(account, jid)] = name
+        return name
+
     def contact_is_visible(self, contact, account):
         if self.rfilter_enabled:
-            return self.rfilter_string in contact.get_shown_name().lower()
+            key = (account, contact.jid)
+            if self.rfilter_string in self._get_search_name(*key):
+                self._rfilter_matches.add(key)
+                return True
+            self._rfilter_matches.discard(key)
+            return False
         if self.contact_has_pending_roster_events(contact, account):
             return True
         if app.config.get('showoffline'):
@@ -1696,139 +1863,77 @@ class RosterWindow:
         if type_ == 'group':
             group = jid
             if group == _('Transports'):
-                if self.regroup:
-                    accounts = app.contacts.get_accounts()
-                else:
-                    accounts = [account]
-                for _acc in accounts:
-                    for contact in app.contacts.iter_contacts(_acc):
-                        if group in contact.get_shown_groups():
-                            if self.rfilter_string in \
-                            contact.get_shown_name().lower():
-                                return True
-                        elif self.contact_has_pending_roster_events(contact,
-                        _acc):
-                            return True
-                    # No transport has been found
-                    return False
+                # Visible if one of the transports in it matches
+                iter_c = model.iter_children(titer)
+                while iter_c:
+                    account_c = model[iter_c][Column.ACCOUNT]
+                    jid_c = model[iter_c][Column.JID]
+                    if self.rfilter_string in self._get_search_name(account_c,
+                    jid_c):
+                        return True
+                    contact = app.contacts.get_first_contact_from_jid(
+                        account_c, jid_c)
+                    if contact and self.contact_has_pending_roster_events(
+                    contact, account_c):
+                        return True
+                    iter_c = model.iter_next(iter_c)
+                return False
 
         if type_ == 'contact':
             if model.iter_has_child(titer):
                 iter_c = model.iter_children(titer)
                 while iter_c:
-                    if self.rfilter_string in model[iter_c][Column.NAME].lower():
+                    if self.rfilter_string in self._get_search_name(
+                    model[iter_c][Column.ACCOUNT], model[iter_c][Column.JID]):
                         return True
                     iter_c = model.iter_next(iter_c)
-            return self.rfilter_string in model[titer][Column.NAME].lower()
+            return self.rfilter_string in self._get_search_name(account, jid)
 
-        if type_ == 'agent':
-            return self.rfilter_string in model[titer][Column.NAME].lower()
-
-        if type_ == 'groupchat':
-            return self.rfilter_string in model[titer][Column.NAME].lower()
+        if type_ in ('agent', 'groupchat'):
+            return self.rfilter_string in self._get_search_name(account, jid)
 
         return visible
 
+    def _get_sort_key(self, type_, account, jid=None):
+        """
+        Return the key the row is sorted by, see _compareIters()
+
+        Keys of rows of different types start with a different rank: the
+        SelfContact and accounts first, then groups, contacts and the special
+        groups at the end. Contacts are sorted by show, if
+        sort_by_show_in_roster is set, then by name, account and jid.
+        """
+        if type_ == 'self_contact':
+            return (0,)
+        if type_ == 'account':
+            return (0, locale.strxfrm(account))
+        if type_ == 'group':
+            return (self._special_group_rank.get(jid, 1),
+                    locale.strxfrm(jid.lower()))
+
+        contact = app.contacts.get_first_contact_from_jid(account, jid)
+        if not contact:
+            return None
+        show_key = (0, 0, 0)
+        if type_ == 'contact' and app.config.get('sort_by_show_in_roster'):
+            show = self.get_show(app.contacts.get_contacts(account, jid))
+            show_rank = self._show_rank.get(show, 9)
+            # Contacts going offline, then none and from subscriptions go
+            # after
+            removing = show == 'offline' and jid in app.to_be_removed[account]
+            show_key = (removing, contact.sub in ('none', 'from'), show_rank)
+        return (2, show_key, locale.strxfrm(contact.get_shown_name().lower()),
+                locale.strxfrm(account.lower()), locale.strxfrm(jid.lower()))
+
     def _compareIters(self, model, iter1, iter2, data=None):
         """
         Compare two iters to sort them
         """
-        name1 = model[iter1][Column.NAME]
-        name2 = model[iter2][Column.NAME]
-        if not name1 or not name2:
-            return 0
-        type1 = model[iter1][Column.TYPE]
-        type2 = model[iter2][Column.TYPE]
-        if type1 == 'self_contact':
-            return -1
-        if type2 == 'self_contact':
-            return 1
-        if type1 == 'group':
-            name1 = model[iter1][Column.JID]
-            name2 = model[iter2][Column.JID]
-            if name1 == _('Transports'):
-                return 1
-            if name2 == _('Transports'):
-                return -1
-            if name1 == _('Not in Roster'):
-                return 1
-            if name2 == _('Not in Roster'):
-                return -1
-            if name1 == _('Groupchats'):
-                return 1
-            if name2 == _('Groupchats'):
-                return -1
-        account1 = model[iter1][Column.ACCOUNT]
-        account2 = model[iter2][Column.ACCOUNT]
-        if not account1 or not account2:
+        key1 = model.get_value(iter1, Column.SORT_KEY)
+        key2 = model.get_value(iter2, Column.SORT_KEY)
+        if key1 is None or key2 is None:
             return 0
-        if type1 == 'account':
-            return locale.strcoll(account1, account2)
-        jid1 = model[iter1][Column.JID]
-        jid2 = model[iter2][Column.JID]
-        if type1 == 'contact':
-            lcontact1 = app.contacts.get_contacts(account1, jid1)
-            contact1 = app.contacts.get_first_contact_from_jid(account1, jid1)
-            if not contact1:
-                return 0
-            name1 = contact1.get_shown_name()
-        if type2 == 'contact':
-            lcontact2 = app.contacts.get_contacts(account2, jid2)
-            contact2 = app.contacts.get_first_contact_from_jid(account2, jid2)
-            if not contact2:
-                return 0
-            name2 = contact2.get_shown_name()
-        # We first compare by show if sort_by_show_in_roster is True or if it's
-        # a child contact
-        if type1 == 'contact' and type2 == 'contact' and \
-        app.config.get('sort_by_show_in_roster'):
-            cshow = {'chat':0, 'online': 1, 'away': 2, 'xa': 3, 'dnd': 4,
-                'invisible': 5, 'offline': 6, 'not in roster': 7, 'error': 8}
-            s = self.get_show(lcontact1)
-            show1 = cshow.get(s, 9)
-            s = self.get_show(lcontact2)
-            show2 = cshow.get(s, 9)
-            removing1 = False
-            removing2 = False
-            if show1 == 6 and jid1 in app.to_be_removed[account1]:
-                removing1 = True
-            if show2 == 6 and jid2 in app.to_be_removed[account2]:
-                removing2 = True
-            if removing1 and not removing2:
-                return 1
-            if removing2 and not removing1:
-                return -1
-            sub1 = contact1.sub
-            sub2 = contact2.sub
-            # none and from goes after
-            if sub1 not in ['none', 'from'] and sub2 in ['none', 'from']:
-                return -1
-            if sub1 in ['none', 'from'] and sub2 not in ['none', 'from']:
-                return 1
-            if show1 < show2:
-                return -1
-            elif show1 > show2:
-                return 1
-        # We compare names
-        cmp_result = locale.strcoll(name1.lower(), name2.lower())
-        if cmp_result < 0:
-            return -1
-        if cmp_result > 0:
-            return 1
-        if type1 == 'contact' and type2 == 'contact':
-            # We compare account names
-            cmp_result = locale.strcoll(account1.lower(), account2.lower())
-            if cmp_result < 0:
-                return -1
-            if cmp_result > 0:
-                return 1
-            # We compare jids
-            cmp_result = locale.strcoll(jid1.lower(), jid2.lower())
-            if cmp_result < 0:
-                return -1
-            if cmp_result > 0:
-                return 1
-        return 0
+        return (key1 > key2) - (key1 < key2)
 
 ################################################################################
 ### FIXME: Methods that don't belong to roster window...
@@ -2448,6 +2553,8 @@ class RosterWindow:
         for account in app.connections:
             app.connections[account].quit(True)
             self.close_all(account)
+        executor.shutdown()
+        self.redraw.clear()
         if app.interface.systray_enabled:
             app.interface.hide_systray()
         self.save_done = True
@@ -2547,6 +2654,9 @@ class RosterWindow:
         else:
             on_continue('', None)
 
+    def _nec_gpg_presence_verified(self, obj):
+        self.redraw.queue_contact(obj.jid, obj.conn.name)
+
     def _nec_presence_received(self, obj):
         account = obj.conn.name
         jid = obj.jid
@@ -2566,12 +2676,12 @@ class RosterWindow:
                         jid, account)
 
         if obj.need_redraw:
-            self.draw_contact(jid, account)
+            self.redraw.queue_contact(jid, account)
 
         if app.jid_is_transport(jid) and jid in jid_list:
             # It must be an agent
             # Update existing iter and group counting
-            self.draw_contact(jid, account)
+            self.redraw.queue_contact(jid, account)
             self.draw_group(_('Transports'), account)
 
         if obj.contact and obj.need_redraw:
@@ -2672,13 +2782,15 @@ class RosterWindow:
             self.draw_account(obj.conn.name)
 
         if obj.pep_type == 'nickname':
-            self.draw_contact(obj.jid, obj.conn.name)
+            self.redraw.queue_contact(obj.jid, obj.conn.name)
         else:
-            self.draw_pep(obj.jid, obj.conn.name, obj.pep_type)
+            self.redraw.queue_contact(obj.jid, obj.conn.name, contact=False,
+                                      pep_types=(obj.pep_type,))
 
     def _nec_update_avatar(self, obj):
         app.log('avatar').debug('Draw roster avatar: %s', obj.jid)
-        self.draw_avatar(obj.jid, obj.account)
+        self.redraw.queue_contact(obj.jid, obj.account, contact=False,
+                                  avatar=True)
 
     def _nec_gc_subject_received(self, obj):
         contact = app.contacts.get_contact_with_highest_priority(
@@ -4043,19 +4155,70 @@ class RosterWindow:
 
     def on_rfilter_entry_changed(self, widget):
         """ When we update the content of the filter """
-        self.rfilter_string = widget.get_text().lower()
-        if self.rfilter_string == '':
+        if self._rfilter_timeout_id is not None:
+            GLib.source_remove(self._rfilter_timeout_id)
+            self._rfilter_timeout_id = None
+        if widget.get_text() == '':
+            self.rfilter_string = ''
             self.disable_rfilter()
-        self.refilter_shown_roster_items()
+            return
+        # Wait until the user stops typing
+        self._rfilter_timeout_id = GLib.timeout_add(RFILTER_DELAY,
+            self._apply_rfilter)
+
+    def _apply_rfilter(self):
+        self._rfilter_timeout_id = None
+        if not self.rfilter_enabled:
+            return False
+        old_string = self._rfilter_applied
+        new_string = self.rfilter_entry.get_text().lower()
+        self.rfilter_string = new_string
+        if old_string is None:
+            # Visibility was not computed by the filter yet, draw everything
+            self._rfilter_matches.clear()
+            self.refilter_shown_roster_items()
+        else:
+            if old_string in new_string:
+                # Only contacts that matched so far can stop matching
+                candidates = set(self._rfilter_matches)
+            elif new_string in old_string:
+                # Only contacts that did not match can match now
+                candidates = None
+            else:
+                candidates = self._get_rfilter_candidates()
+            if candidates is None:
+                candidates = self._get_rfilter_candidates() - \
+                    self._rfilter_matches
+            for account, jid in candidates:
+                matches = new_string in self._get_search_name(account, jid)
+                if matches == ((account, jid) in self._rfilter_matches):
+                    continue
+                if app.contacts.get_first_contact_from_jid(account, jid):
+                    # Updates self._rfilter_matches
+                    self.adjust_and_draw_contact_context(jid, account)
+                else:
+                    self._rfilter_matches.discard((account, jid))
+        self._rfilter_applied = new_string
+        self.redraw.flush()
+
         # select first row
         self.tree.get_selection().unselect_all()
         def _func(model, path, iter_, param):
-            if model[iter_][Column.TYPE] == 'contact' and self.rfilter_string in \
-            model[iter_][Column.NAME].lower():
+            if model[iter_][Column.TYPE] == 'contact' and new_string in \
+            self._get_search_name(model[iter_][Column.ACCOUNT],
+            model[iter_][Column.JID]):
                 col = self.tree.get_column(0)
                 self.tree.set_cursor_on_cell(path, col, None, False)
                 return True
         self.modelfilter.foreach(_func, None)
+        return False
+
+    def _get_rfilter_candidates(self):
+        candidates = set()
+        for account in app.connections:
+            for jid in app.contacts.get_jid_list(account):
+                candidates.add((account, jid))
+        return candidates
 
     def on_rfilter_entry_icon_press(self, widget, icon, event):
         """
@@ -4096,6 +4259,11 @@ class RosterWindow:
 
     def disable_rfilter(self):
         self.rfilter_enabled = False
+        if self._rfilter_timeout_id is not None:
+            GLib.source_remove(self._rfilter_timeout_id)
+            self._rfilter_timeout_id = None
+        self._rfilter_applied = None
+        self._rfilter_matches.clear()
         self.rfilter_entry.set_text('')
         self.rfilter_entry.set_visible(False)
         self.rfilter_entry.set_editable(False)
@@ -5648,10 +5816,10 @@ class RosterWindow:
 
         # [icon, name, type, jid, account, editable, mood_pixbuf,
         # activity_pixbuf, tune_pixbuf, location_pixbuf, avatar_img,
-        # padlock_pixbuf, visible]
+        # padlock_pixbuf, visible, sort_key]
         self.columns = [Gtk.Image, str, str, str, str,
             GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf, GdkPixbuf.Pixbuf,
-            Gtk.Image, str, bool]
+            Gtk.Image, str, bool, object]
 
         self.xml = gtkgui_helpers.get_gtk_builder('roster_window.ui')
         self.window = self.xml.get_object('roster_window')
@@ -5716,10 +5884,16 @@ class RosterWindow:
         # before quitting
         self.quit_on_next_offline = -1
 
-        # groups to draw next time we draw groups.
-        self.groups_to_draw = {}
-        # accounts to draw next time we draw accounts.
-        self.accounts_to_draw = []
+        # contacts, groups and accounts to draw in the next idle callback
+        self.redraw = RedrawScheduler(self)
+        # The filter string the shown rows were computed for, None if they
+        # were not computed by the filter
+        self._rfilter_applied = None
+        # (account, jid) of the contacts matching the filter string
+        self._rfilter_matches = set()
+        self._rfilter_timeout_id = None
+        # (account, jid): lowercase shown name, see _get_search_name()
+        self._search_names = {}
 
         # StatusComboBox
         self.status_combobox = self.xml.get_object('status_combobox')
@@ -5753,6 +5927,12 @@ class RosterWindow:
         # cell_data_func, func_arg)
         self.renderers_list = []
         self.renderers_propertys ={}
+        self._show_rank = {'chat': 0, 'online': 1, 'away': 2, 'xa': 3,
+            'dnd': 4, 'invisible': 5, 'offline': 6, 'not in roster': 7,
+            'error': 8}
+        self._special_group_rank = {_('Groupchats'): 3, _('Not in Roster'): 4,
+            _('Transports'): 5}
+
         self._pep_type_to_model_column = {'mood': Column.MOOD_PIXBUF,
             'activity': Column.ACTIVITY_PIXBUF, 'tune': Column.TUNE_PIXBUF,
             'location': Column.LOCATION_PIXBUF}
@@ -5892,6 +6072,8 @@ class RosterWindow:
 
         app.ged.register_event_handler('presence-received', ged.GUI1,
             self._nec_presence_received)
+        app.ged.register_event_handler('gpg-presence-verified', ged.GUI1,
+            self._nec_gpg_presence_verified)
         # presence has to be fully handled so that contact is added to occupant
         # list before roster can be correctly updated
         app.ged.register_event_handler('gc-presence-received', ged.GUI2,
@@ -58,8 +58,8 @@ class StatusIcon:
         """
         Register listeners to the events class
         """
-        app.events.event_added_subscribe(self.on_event_added)
-        app.events.event_removed_subscribe(self.on_event_removed)
+        app.events.event_added_subscribe(self.on_event_added, delta=True)
+        app.events.event_removed_subscribe(self.on_event_removed, delta=True)
 
     def unsubscribe_events(self):
         """
@@ -68,18 +68,22 @@ class StatusIcon:
         app.events.event_added_unsubscribe(self.on_event_added)
         app.events.event_removed_unsubscribe(self.on_event_removed)
 
-    def on_event_added(self, event):
+    def on_event_added(self, event, delta):
         """
         Called when an event is added to the event list
         """
-        if event.show_in_systray:
-            self.set_img()
+        self._on_events_changed(delta)
 
-    def on_event_removed(self, event_list):
+    def on_event_removed(self, event_list, delta):
         """
         Called when one or more events are removed from the event list
         """
-        self.set_img()
+        self._on_events_changed(delta)
+
+    def _on_events_changed(self, delta):
+        # Only the number of systray events changes the icon
+        if any(attribute == 'systray' for _account, attribute, _type in delta):
+            self.set_img()
 
     def show_icon(self):
         if not self.status_icon:
@@ -39,10 +39,15 @@ modules = ( 'unit.test_protocol_caps',
             'unit.test_caps_cache',
             'unit.test_contacts',
             'unit.test_account',
+            'unit.test_ged',
+            'unit.test_image_cache',
+            'unit.test_log_search',
+            'unit.test_logger_rows',
           )
 
 if use_x:
     modules += ( 'unit.test_sessions',
+                 'unit.test_conversation_textview',
                  #'integration.test_gui_event_integration',
                  'integration.test_roster',
                  'integration.test_resolver',
@@ -8,7 +8,9 @@ lib.setup_env()
 
 from gajim.common.contacts import CommonContact, Contact, GC_Contact, LegacyContactsAPI
 from nbxmpp import NS_MUC
+from mock import Mock
 
+from gajim.common import app
 from gajim.common import caps_cache
 
 class TestCommonContact(unittest.TestCase):
@@ -87,6 +89,27 @@ class TestContacts(unittest.TestCase):
                 msg="Contact must not be known any longer")
 
 
+    def test_create_add_get_gc_contact(self):
+        room_jid = 'room@conference.gajim.org'
+        account = "account"
+        self.contacts.add_account(account)
+
+        self.assertIsNone(self.contacts.get_gc_contact(account, room_jid,
+                'nick'), msg="Room must not be known yet")
+
+        gc_contact = self.contacts.create_gc_contact(room_jid=room_jid,
+                account=account, name='nick')
+        self.contacts.add_gc_contact(account, gc_contact)
+
+        self.assertEqual(gc_contact, self.contacts.get_gc_contact(account,
+                room_jid, 'nick'), msg="GC contact must be known")
+        self.assertIsNone(self.contacts.get_gc_contact(account, room_jid,
+                'other'), msg="Other nick must not be known")
+
+        self.contacts.remove_gc_contact(account, gc_contact)
+        self.assertIsNone(self.contacts.get_gc_contact(account, room_jid,
+                'nick'), msg="GC contact must not be known any longer")
+
     def test_copy_contact(self):
         jid = 'test@gajim.org'
         account = "account"
@@ -124,6 +147,138 @@ class TestContacts(unittest.TestCase):
         self.assertEqual(2, len(self.contacts.get_contacts_from_group(account, group)))
         self.assertEqual(0, len(self.contacts.get_contacts_from_group(account, '')))
 
+    def test_nb_online_total_contacts(self):
+        account = "account"
+        get_jid_from_account = app.get_jid_from_account
+        app.get_jid_from_account = lambda account: 'me@gajim.org'
+        try:
+            contact1 = self.contacts.create_contact(jid="test1@gajim.org",
+                    account=account, groups=["GroupA"], show='online',
+                    sub='both')
+            self.contacts.add_contact(account, contact1)
+            contact2 = self.contacts.create_contact(jid="test2@gajim.org",
+                    account=account, groups=["GroupA", "GroupB"],
+                    show='offline', sub='both')
+            self.contacts.add_contact(account, contact2)
+
+            self.assertEqual((1, 2),
+                    self.contacts.get_nb_online_total_contacts([account]))
+            self.assertEqual((0, 1), self.contacts.get_nb_online_total_contacts(
+                    [account], ["GroupB"]))
+
+            contact2.show = 'away'
+            contact1.groups.remove("GroupA")
+            self.contacts.contact_changed(account, contact1.jid)
+            self.assertEqual((2, 2),
+                    self.contacts.get_nb_online_total_contacts([account]))
+            self.assertEqual((1, 1), self.contacts.get_nb_online_total_contacts(
+                    [account], ["GroupA"]))
+
+            self.contacts.remove_contact(account, contact2)
+            self.assertEqual((1, 1),
+                    self.contacts.get_nb_online_total_contacts([account]))
+        finally:
+            app.get_jid_from_account = get_jid_from_account
+
+
+class TestMetacontacts(unittest.TestCase):
+
+    def setUp(self):
+        self.contacts = LegacyContactsAPI()
+        self.account = 'account'
+        self.contacts.add_account(self.account)
+        self.contacts.define_metacontacts(self.account, {
+            'tag1': [{'jid': 'a@gajim.org', 'tag': 'tag1'},
+                     {'jid': 'b@gajim.org', 'tag': 'tag1'}],
+            'tag2': [{'jid': 'c@gajim.org', 'tag': 'tag2'}]})
+        self.connections = app.connections
+        app.connections = {self.account: Mock()}
+
+    def tearDown(self):
+        app.connections = self.connections
+
+    def add_contact(self, jid, show):
+        contact = self.contacts.create_contact(jid=jid, account=self.account,
+                show=show, sub='both')
+        self.contacts.add_contact(self.account, contact)
+        return contact
+
+    def get_family_jids(self, jid):
+        family = self.contacts.get_metacontacts_family(self.account, jid)
+        return sorted(data['jid'] for data in family)
+
+    def test_tag_index(self):
+        self.assertEqual('tag1', self.contacts._get_metacontacts_tag(
+                self.account, 'b@gajim.org'))
+        self.assertIsNone(self.contacts._get_metacontacts_tag(
+                self.account, 'd@gajim.org'))
+        self.assertIsNone(self.contacts._get_metacontacts_tag(
+                'other', 'a@gajim.org'))
+
+        self.contacts.add_metacontact(self.account, 'c@gajim.org',
+                self.account, 'b@gajim.org')
+        self.assertEqual('tag2', self.contacts._get_metacontacts_tag(
+                self.account, 'b@gajim.org'))
+
+        self.contacts.remove_metacontact(self.account, 'b@gajim.org')
+        self.assertIsNone(self.contacts._get_metacontacts_tag(
+                self.account, 'b@gajim.org'))
+
+        self.contacts.change_account_name(self.account, 'new')
+        self.assertEqual('tag1', self.contacts._get_metacontacts_tag(
+                'new', 'a@gajim.org'))
+
+    def test_family(self):
+        self.assertEqual(['a@gajim.org', 'b@gajim.org'],
+                self.get_family_jids('a@gajim.org'))
+        self.assertEqual([], self.get_family_jids('d@gajim.org'))
+
+        # Callers get a copy of the cached family
+        family = self.contacts.get_metacontacts_family(self.account,
+                'a@gajim.org')
+        family.pop()
+        self.assertEqual(['a@gajim.org', 'b@gajim.org'],
+                self.get_family_jids('a@gajim.org'))
+
+        self.contacts.add_metacontact(self.account, 'a@gajim.org',
+                self.account, 'c@gajim.org')
+        self.assertEqual(['a@gajim.org', 'b@gajim.org', 'c@gajim.org'],
+                self.get_family_jids('a@gajim.org'))
+
+        self.contacts.remove_metacontact(self.account, 'a@gajim.org')
+        self.assertEqual(['b@gajim.org', 'c@gajim.org'],
+                self.get_family_jids('b@gajim.org'))
+
+        self.contacts.define_metacontacts(self.account, {})
+        self.assertEqual([], self.get_family_jids('b@gajim.org'))
+
+    def test_big_brother(self):
+        contact_a = self.add_contact('a@gajim.org', 'away')
+        self.add_contact('b@gajim.org', 'online')
+        family = self.contacts.get_metacontacts_family(self.account,
+                'a@gajim.org')
+
+        _family, jid, _account = \
+            self.contacts.get_nearby_family_and_big_brother(family,
+                    self.account)
+        self.assertEqual('b@gajim.org', jid)
+
+        # A change of a contact invalidates the cached big brother
+        contact_a.show = 'chat'
+        contact_a.priority = 10
+        _family, jid, _account = \
+            self.contacts.get_nearby_family_and_big_brother(family,
+                    self.account)
+        self.assertEqual('b@gajim.org', jid)
+        contact_a.show = 'online'
+        _family, jid, _account = \
+            self.contacts.get_nearby_family_and_big_brother(family,
+                    self.account)
+        self.assertEqual('a@gajim.org', jid)
+
+        self.assertEqual(['b@gajim.org'], self.contacts.get_hidden_brothers(
+                self.account, [self.account]))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,130 @@
+'''
+Tests for the message list of the ConversationTextview
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common import app
+from gajim.conversation_textview import ConversationTextview
+
+class TestMessageList(unittest.TestCase):
+
+    def setUp(self):
+        self.textview = ConversationTextview('account')
+        self.buffer = self.textview.tv.get_buffer()
+        self.max_lines = app.config.get('max_conversation_lines')
+
+    def tearDown(self):
+        app.config.set('max_conversation_lines', self.max_lines)
+
+    def add_line(self, tim, msg_stanza_id=None):
+        '''
+        Add a line like print_conversation_line() does and return its mark
+        '''
+        insert_mark, index = self.textview.get_insert_mark(tim)
+        if insert_mark is None:
+            iter_ = self.buffer.get_end_iter()
+            index = len(self.textview.message_list)
+        else:
+            iter_ = self.buffer.get_iter_at_mark(insert_mark)
+        offset = iter_.get_offset()
+        self.buffer.insert(iter_, 'line %s\n' % tim)
+        # Line start marks have right gravity, text inserted before a line
+        # moves its mark
+        mark = self.buffer.create_mark(
+            None, self.buffer.get_iter_at_offset(offset), False)
+        entry = (tim, mark, msg_stanza_id)
+        self.textview._add_message(index, entry)
+        return mark
+
+    def get_times(self):
+        return [entry[0] for entry in self.textview.message_list]
+
+    def test_insert_order(self):
+        for tim in (10, 30, 20, 5, 20, 40):
+            self.add_line(tim)
+        self.assertEqual([5, 10, 20, 20, 30, 40], self.get_times())
+        self.assertEqual(self.get_times(), self.textview._message_times)
+
+        # A message with the same time goes after the existing ones
+        mark = self.add_line(20)
+        self.assertIs(mark, self.textview.message_list[4][1])
+
+        # The buffer is in the same order as message_list
+        offsets = [self.buffer.get_iter_at_mark(entry[1]).get_offset()
+                   for entry in self.textview.message_list]
+        self.assertEqual(sorted(offsets), offsets)
+
+    def test_insert_before_first(self):
+        self.add_line(10)
+        self.add_line(20)
+        mark, index = self.textview.get_insert_mark(5)
+        self.assertEqual(0, index)
+        self.assertIs(self.textview.message_list[0][1], mark)
+        self.assertEqual((None, None), self.textview.get_insert_mark(20))
+
+    def test_get_end_mark(self):
+        mark1 = self.add_line(10, 'id1')
+        mark2 = self.add_line(20, 'id2')
+        mark3 = self.add_line(30, 'id3')
+
+        # The first line can be corrected
+        self.assertEqual((mark2, 0), self.textview.get_end_mark('id1', mark1))
+        self.assertEqual((mark3, 1), self.textview.get_end_mark('id2', mark2))
+        self.assertEqual((None, 2), self.textview.get_end_mark('id3', mark3))
+
+        self.assertEqual((None, None),
+                         self.textview.get_end_mark('id1', mark2))
+        self.assertEqual((None, None),
+                         self.textview.get_end_mark('unknown', mark1))
+
+    def test_replace_message(self):
+        mark1 = self.add_line(10, 'id1')
+        self.add_line(20, 'id2')
+        mark = self.buffer.create_mark(None, self.buffer.get_start_iter(),
+                                       True)
+        self.textview._replace_message(0, (10, mark, 'id3'))
+
+        self.assertNotIn('id1', self.textview._message_ids)
+        self.assertEqual((10, mark, 'id3'), self.textview._message_ids['id3'])
+        self.assertEqual([10, 20], self.textview._message_times)
+        self.assertEqual((None, None),
+                         self.textview.get_end_mark('id1', mark1))
+
+    def test_remove_oldest_lines(self):
+        app.config.set('max_conversation_lines', 2)
+        self.add_line(10, 'id1')
+        self.add_line(20, 'dup')
+        self.add_line(30, 'id3')
+        mark = self.add_line(40, 'dup')
+
+        self.textview.remove_oldest_lines()
+
+        self.assertEqual([30, 40], self.get_times())
+        self.assertEqual([30, 40], self.textview._message_times)
+        self.assertEqual(['dup', 'id3'], sorted(self.textview._message_ids))
+        # The newer message with the same id is kept
+        self.assertIs(mark, self.textview._message_ids['dup'][1])
+        self.assertTrue(self.textview.history_evicted)
+        self.assertEqual('line 30\nline 40\n', self.buffer.get_text(
+            self.buffer.get_start_iter(), self.buffer.get_end_iter(), True))
+
+    def test_clear(self):
+        self.add_line(10, 'id1')
+        self.add_line(20, 'id2')
+        self.textview.clear()
+
+        self.assertEqual([], self.textview.message_list)
+        self.assertEqual([], self.textview._message_times)
+        self.assertEqual({}, self.textview._message_ids)
+
+        # New messages are not placed by the marks of cleared ones
+        self.assertEqual((None, None), self.textview.get_insert_mark(5))
+        mark = self.add_line(5, 'id1')
+        self.assertEqual((None, 0), self.textview.get_end_mark('id1', mark))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+'''
+Tests for the Global Events Dispatcher
+'''
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common import ged
+from gajim.common.ged import GlobalEventsDispatcher
+
+class TestGlobalEventsDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.ged = GlobalEventsDispatcher()
+        self.called = []
+
+    def handler(self, name, result=None):
+        def _handler(*args):
+            self.called.append(name)
+            return result
+        return _handler
+
+    def test_priority_order(self):
+        self.ged.register_event_handler('event', ged.GUI1,
+            self.handler('gui1'))
+        self.ged.register_event_handler('event', ged.CORE,
+            self.handler('core'))
+        self.ged.register_event_handler('event', ged.GUI1,
+            self.handler('gui1 bis'))
+        self.ged.raise_event('event')
+        self.assertEqual(['core', 'gui1', 'gui1 bis'], self.called)
+
+    def test_keyed_handlers(self):
+        self.ged.register_event_handler('event', ged.GUI1,
+            self.handler('room1'), key=('account', 'room1@server'))
+        self.ged.register_event_handler('event', ged.GUI1,
+            self.handler('room2'), key=('account', 'room2@server'))
+        self.ged.register_event_handler('event', ged.CORE,
+            self.handler('all'))
+
+        self.ged.raise_event('event', key=('account', 'room2@server'))
+        self.assertEqual(['all', 'room2'], self.called)
+
+        self.called = []
+        self.ged.raise_event('event', key=('account', 'room3@server'))
+        self.assertEqual(['all'], self.called)
+
+        self.called = []
+        self.ged.raise_event('event')
+        self.assertEqual(['all', 'room1', 'room2'], self.called,
+            msg="Events without key must reach all handlers")
+
+    def test_handler_stops_event(self):
+        self.ged.register_event_handler('event', ged.GUI1,
+            self.handler('keyed'), key=('account', 'room@server'))
+        self.ged.register_event_handler('event', ged.CORE,
+            self.handler('core', True))
+        self.assertTrue(self.ged.raise_event('event',
+            key=('account', 'room@server')))
+        self.assertEqual(['core'], self.called)
+
+    def test_remove_keyed_handler(self):
+        handler = self.handler('room')
+        self.ged.register_event_handler('event', ged.GUI1, handler,
+            key=('account', 'room@server'))
+        self.ged.remove_event_handler('event', ged.GUI1, handler,
+            key=('account', 'room@server'))
+        self.ged.raise_event('event', key=('account', 'room@server'))
+        self.assertEqual([], self.called)
+        self.assertEqual({}, self.ged.keyed_handlers)
+
+    def test_stats(self):
+        self.ged.register_event_handler('event', ged.GUI1,
+            self.handler('room'), key=('account', 'room@server'))
+        self.ged.register_event_handler('event', ged.CORE,
+            self.handler('core'))
+        self.ged.raise_event('event', key=('account', 'room@server'))
+        self.ged.raise_event('event', key=('account', 'other@server'))
+        stats = self.ged.get_stats()['event']
+        self.assertEqual(1, stats['handlers'])
+        self.assertEqual(1, stats['keyed_handlers'])
+        self.assertEqual(2, stats['raised'])
+        self.assertEqual(3, stats['calls'])
+
+    def test_profiling(self):
+        self.ged.register_event_handler('event', ged.CORE,
+            self.handler('core'))
+        self.ged.raise_event('event')
+        self.assertEqual({}, self.ged._handler_profile,
+            msg="Handlers must not be measured before enable_profiling()")
+
+        self.ged.enable_profiling(size=2)
+        for i in range(3):
+            self.ged.raise_event('event')
+        self.assertEqual(3, self.ged._handler_profile[
+            ('event', 'TestGlobalEventsDispatcher.handler.<locals>._handler')][0])
+        self.assertEqual(2, len(self.ged._recent_calls))
+        self.assertIn('Last 2 calls:', self.ged.dump_profile())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+'''
+Tests for the image cache
+'''
+import time
+import unittest
+from email.message import Message
+
+import lib
+lib.setup_env()
+
+from gajim.common.image_cache import CacheEntry, ImageCache
+
+class TestUpdateEntry(unittest.TestCase):
+
+    def setUp(self):
+        self.entry = CacheEntry('http://example.org/image.png', 'digest')
+
+    def test_lowercase_headers(self):
+        # pycurl passes the names as the server sends them, HTTP/2 servers
+        # send them lowercase
+        ImageCache._update_entry(self.entry, {
+            'etag': '"abc"',
+            'last-modified': 'Wed, 21 Oct 2015 07:28:00 GMT',
+            'cache-control': 'public, max-age=60'})
+        self.assertEqual('"abc"', self.entry.etag)
+        self.assertEqual('Wed, 21 Oct 2015 07:28:00 GMT',
+            self.entry.last_modified)
+        self.assertAlmostEqual(time.time() + 60, self.entry.expires, delta=5)
+        self.assertEqual({'If-None-Match': '"abc"',
+                          'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'},
+                         self.entry.get_validators())
+
+    def test_message_headers(self):
+        headers = Message()
+        headers['ETag'] = '"abc"'
+        headers['Cache-Control'] = 'max-age=120'
+        ImageCache._update_entry(self.entry, headers)
+        self.assertEqual('"abc"', self.entry.etag)
+        self.assertIsNone(self.entry.last_modified)
+        self.assertAlmostEqual(time.time() + 120, self.entry.expires, delta=5)
+
+if __name__ == "__main__":
+    unittest.main()
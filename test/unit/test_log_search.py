@@ -0,0 +1,107 @@
+'''
+Tests for the full-text index of the logs
+'''
+import sqlite3
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common.logger import LogSearchIndex
+
+class TestLogSearchIndex(unittest.TestCase):
+
+    fts5 = False
+
+    def setUp(self):
+        self.con = sqlite3.connect(':memory:')
+        self.con.execute('''
+            CREATE TABLE logs(
+                log_line_id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+                message TEXT,
+                subject TEXT,
+                contact_name TEXT)''')
+        # Logged before the index existed
+        self.insert('Old news about the weather')
+        self.index = LogSearchIndex(self.con)
+        if self.fts5 and not self.index.fts5:
+            self.skipTest('SQLite is built without FTS5')
+        self.index.fts5 = self.fts5
+        self.index.init_tables()
+
+    def tearDown(self):
+        self.con.close()
+
+    def insert(self, message, subject=None, contact_name=None):
+        log_line_id = self.con.execute(
+            'INSERT INTO logs (message, subject, contact_name) '
+            'VALUES (?, ?, ?)', (message, subject, contact_name)).lastrowid
+        if hasattr(self, 'index'):
+            self.index.add(log_line_id, message, subject, contact_name)
+        return log_line_id
+
+    def delete(self, log_line_id):
+        self.index.remove([log_line_id])
+        self.con.execute('DELETE FROM logs WHERE log_line_id = ?',
+                         (log_line_id,))
+
+    def search(self, query):
+        join, condition, rank, params = self.index.get_search_sql(query)
+        sql = '''
+            SELECT logs.log_line_id, {rank} FROM logs {join}
+            WHERE {condition} ORDER BY logs.log_line_id
+            '''.format(join=join, condition=condition, rank=rank)
+        return [row[0] for row in self.con.execute(sql, params)]
+
+    def test_backfill(self):
+        self.assertTrue(self.index.backfill_pending())
+        self.assertEqual([], self.search('weather'))
+        while self.index.backfill():
+            pass
+        self.assertFalse(self.index.backfill_pending())
+        self.assertEqual([1], self.search('weather'))
+
+    def test_insert_and_delete(self):
+        first = self.insert('Hello World')
+        second = self.insert('hello again', contact_name='Romeo')
+        self.assertEqual([first, second], self.search('hello'))
+        self.assertEqual([second], self.search('romeo'))
+        self.delete(first)
+        self.assertEqual([second], self.search('hello'))
+        self.assertEqual([], self.search('world'))
+
+    def test_prefix(self):
+        first = self.insert('Gajim is an XMPP client')
+        self.insert('Gaming tonight?')
+        self.assertEqual([first], self.search('gaji*'))
+        self.assertEqual(2, len(self.search('ga*')))
+
+    def test_phrase(self):
+        first = self.insert('the quick brown fox')
+        self.insert('brown, the quick fox')
+        self.assertEqual([first], self.search('"quick brown"'))
+
+    def test_no_terms(self):
+        self.assertIsNone(self.index.get_search_sql(''))
+
+class TestLogSearchIndexFTS5(TestLogSearchIndex):
+
+    fts5 = True
+
+    def test_index_has_no_copy_of_the_messages(self):
+        row = self.con.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'logs_search'"
+            ).fetchone()
+        self.assertIn("content='logs'", row[0])
+
+    def test_delete_before_backfill(self):
+        # The trigger must not touch rows the backfill did not index yet
+        self.delete(1)
+        while self.index.backfill():
+            pass
+        self.con.execute(
+            "INSERT INTO logs_search (logs_search) VALUES ('integrity-check')")
+        self.assertEqual([], self.search('weather'))
+
+if __name__ == "__main__":
+    unittest.main()
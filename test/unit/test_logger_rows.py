@@ -0,0 +1,77 @@
+'''
+Tests for the row factory of the Logger
+'''
+import json
+import sqlite3
+import unittest
+
+import lib
+lib.setup_env()
+
+from gajim.common.logger import RowFactory
+
+class TestRowFactory(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = RowFactory()
+        self.con = sqlite3.connect(':memory:')
+        self.con.row_factory = self.factory
+        self.con.execute('''
+            CREATE TABLE logs(
+                log_line_id INTEGER PRIMARY KEY,
+                message TEXT,
+                additional_data TEXT)''')
+        self.data = {'gajim': {'oob_url': 'https://example.org/a.png'}}
+        self.con.executemany(
+            'INSERT INTO logs (message, additional_data) VALUES (?, ?)',
+            [('first', json.dumps(self.data)), ('second', None)])
+
+    def tearDown(self):
+        self.con.close()
+
+    def test_row_type_is_reused(self):
+        rows = self.con.execute(
+            'SELECT log_line_id, message FROM logs').fetchall()
+        self.assertIs(type(rows[0]), type(rows[1]))
+        self.assertEqual(rows[0].message, 'first')
+        self.assertEqual(rows[1]._fields, ('log_line_id', 'message'))
+
+        # A new query with the same columns gets the same type
+        row = self.con.execute(
+            'SELECT log_line_id, message FROM logs').fetchone()
+        self.assertIs(type(row), type(rows[0]))
+
+    def test_other_columns_get_other_type(self):
+        row1 = self.con.execute('SELECT message FROM logs').fetchone()
+        row2 = self.con.execute('SELECT log_line_id FROM logs').fetchone()
+        self.assertIsNot(type(row1), type(row2))
+        self.assertEqual(row1.message, 'first')
+        self.assertEqual(row2.log_line_id, 1)
+
+    def test_get_row_type(self):
+        row_type = self.factory.get_row_type(('jid_id', 'jid', 'type'))
+        self.assertIs(
+            self.factory.get_row_type(('jid_id', 'jid', 'type')), row_type)
+        self.assertEqual(row_type(1, 'a@b', 0).jid, 'a@b')
+
+    def test_additional_data_is_decoded(self):
+        rows = self.con.execute(
+            'SELECT message, additional_data FROM logs').fetchall()
+        self.assertEqual(rows[0].additional_data, self.data)
+        # Decoded once and cached
+        self.assertIs(rows[0].additional_data, rows[0].additional_data)
+        # NULL decodes to an empty dict
+        self.assertEqual(rows[1].additional_data, {})
+
+    def test_additional_data_raw_access(self):
+        row = self.con.execute(
+            'SELECT message, additional_data FROM logs').fetchone()
+        self.assertEqual(row[1], json.dumps(self.data))
+        message, additional_data = row
+        self.assertEqual(message, 'first')
+        self.assertEqual(additional_data, json.dumps(self.data))
+        self.assertEqual(row, ('first', json.dumps(self.data)))
+
+
+if __name__ == '__main__':
+    unittest.main()